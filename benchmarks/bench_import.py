@@ -0,0 +1,40 @@
+"""Benchmark the import time of openai_api_call
+
+Usage:
+    python benchmarks/bench_import.py [-n 20]
+"""
+
+import subprocess, sys, statistics, argparse
+
+HEAVY_MODULES = ["requests", "aiohttp", "tiktoken", "tqdm", "openai_api_call.asynctool"]
+
+SCRIPT = """
+import time, sys
+start = time.perf_counter()
+import openai_api_call
+elapsed = time.perf_counter() - start
+print(elapsed)
+print(','.join(m for m in %r if m in sys.modules))
+""" % (HEAVY_MODULES,)
+
+def import_time():
+    """Import the package in a fresh interpreter
+
+    Returns:
+        Tuple[float, List[str]]: import time in seconds and the heavy modules loaded
+    """
+    output = subprocess.run([sys.executable, "-c", SCRIPT], check=True,
+                            capture_output=True, text=True).stdout.split('\n')
+    return float(output[0]), [m for m in output[1].split(',') if m]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", type=int, default=20, help="number of runs")
+    args = parser.parse_args()
+    times = []
+    for _ in range(args.n):
+        elapsed, loaded = import_time()
+        times.append(elapsed)
+    print(f"import openai_api_call: median {statistics.median(times) * 1000:.1f}ms, "
+          f"min {min(times) * 1000:.1f}ms over {args.n} runs")
+    print("heavy modules loaded:", ', '.join(loaded) if loaded else "none")
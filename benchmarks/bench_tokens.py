@@ -0,0 +1,116 @@
+"""Compare the fast token estimation with the exact counting of tiktoken
+
+Usage:
+    python benchmarks/bench_tokens.py [--model gpt-3.5-turbo] [FILE ...]
+    python benchmarks/bench_tokens.py --fit [--chunk-size 300] FILE ...
+
+Each FILE is read as one text, the built-in samples are used if no file is given.
+With `--fit`, the files are split into chunks of paragraphs, and the weights and the
+errors of `estimator_params` and `estimator_error` are fitted on half of the chunks
+for each encoding, and checked on the other half.
+"""
+
+import argparse, math, random, timeit
+from openai_api_call.tokencalc import estimate_tokens, estimator_params, _get_encoding, \
+    _encoding_name, _class_counts
+
+SAMPLES = {
+    "english": "The quick brown fox jumps over the lazy dog, again and again. " * 50,
+    "code": "def add(a, b):\n    return a + b  # add two numbers\n\nprint(add(1, 2))\n" * 50,
+    "numbers": "Order 12345 shipped on 2023-07-01 for $1,234.56 to 221B Baker St. " * 50,
+    "chinese": "今天天气很好，我们一起去公园散步吧。人工智能正在改变世界。" * 50,
+    "russian": "Быстрая коричневая лиса прыгает через ленивую собаку. " * 50,
+}
+
+CLASSES = ["letter", "space", "digit", "punct", "cyrillic", "other", "cjk", "hangul"]
+GROUPS = {"ascii": [0, 1, 2, 3], "other": [4, 5], "cjk": [6, 7]}
+
+def bench(name, text, model, number=100):
+    encoding = _get_encoding(model)
+    exact = len(encoding.encode(text))
+    estimate, lower, upper = estimate_tokens(text, model, bounds=True)
+    t_exact = timeit.timeit(lambda: encoding.encode(text), number=number) / number
+    t_estimate = timeit.timeit(lambda: estimate_tokens(text, model), number=number) / number
+    error = (estimate - exact) / exact * 100
+    inside = "yes" if lower <= exact <= upper else "no"
+    print(f"{name:<12}{exact:>8}{estimate:>10}{error:>+9.1f}%{inside:>8}"
+          f"{t_exact * 1e6:>12.1f}{t_estimate * 1e6:>12.1f}{t_exact / t_estimate:>9.0f}x")
+
+def chunks(path, size, limit):
+    """Paragraphs of the file merged into chunks of at least `size` characters"""
+    result, chunk = [], ""
+    with open(path, encoding="utf-8") as f:
+        for paragraph in f.read().split("\n\n"):
+            chunk = chunk + "\n\n" + paragraph if chunk else paragraph
+            if len(chunk) >= size:
+                result.append(chunk)
+                chunk = ""
+    random.shuffle(result)
+    return result[:limit]
+
+def fit(encoding, corpus, quantile):
+    """Weights of the classes and the relative errors of the groups for the encoding"""
+    import numpy as np, tiktoken
+    enc = tiktoken.get_encoding(encoding)
+    train, test = [], []
+    for name, texts in corpus.items():
+        rows = [(name, _class_counts(text), len(enc.encode(text, disallowed_special=())))
+                for text in texts]
+        train += rows[::2]
+        test += rows[1::2]
+    counts = np.array([row[1] for row in train], dtype=float)
+    exact = np.array([row[2] for row in train], dtype=float)
+    # least squares of the relative errors, dropping the negative weights
+    scaled, columns = counts / exact[:, None], list(range(len(CLASSES)))
+    while True:
+        solution = np.linalg.lstsq(scaled[:, columns], np.ones(len(exact)), rcond=None)[0]
+        if (solution >= 0).all(): break
+        columns.pop(int(np.argmin(solution)))
+    weights = np.zeros(len(CLASSES))
+    weights[columns] = solution
+    # error of a group by the chunks it dominates
+    parts = counts * weights
+    estimate, errors = parts.sum(axis=1), {}
+    for group, ind in GROUPS.items():
+        share = parts[:, ind].sum(axis=1) / estimate
+        dominated = share >= 0.8
+        residual = np.abs(estimate - exact)[dominated] / estimate[dominated]
+        errors[group] = float(np.quantile(residual, quantile)) if dominated.any() else 0.5
+    params = {name: round(float(weight), 3) for name, weight in zip(CLASSES, weights)}
+    errors = {group: round(error, 2) for group, error in errors.items()}
+    return params, errors, test
+
+def coverage(encoding, params, errors, rows):
+    """Share of the texts whose exact count is inside the bounds, by the corpus"""
+    inside = {}
+    for name, counts, exact in rows:
+        parts = [params[cls] * count for cls, count in zip(CLASSES, counts)]
+        estimate = sum(parts)
+        error = sum(errors[group] * sum(parts[i] for i in ind) for group, ind in GROUPS.items())
+        inside.setdefault(name, []).append(int(estimate - error) <= exact <= math.ceil(estimate + error))
+    return {name: sum(values) / len(values) for name, values in inside.items()}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("files", nargs="*", help="text files to test")
+    parser.add_argument("--model", default="gpt-3.5-turbo", help="model or encoding name")
+    parser.add_argument("--fit", action="store_true", help="fit the estimator on the files")
+    parser.add_argument("--chunk-size", type=int, default=300, help="minimum characters of a chunk")
+    parser.add_argument("--limit", type=int, default=2000, help="maximum chunks of a file")
+    parser.add_argument("--quantile", type=float, default=0.99, help="quantile of the errors")
+    args = parser.parse_args()
+    if args.fit:
+        random.seed(0)
+        corpus = {f: chunks(f, args.chunk_size, args.limit) for f in args.files}
+        for encoding in estimator_params:
+            params, errors, test = fit(encoding, corpus, args.quantile)
+            print(f'"{encoding}": {params},\nerrors: {errors}')
+            for name, share in coverage(encoding, params, errors, test).items():
+                print(f"    {name:<40}{share:>8.1%} inside the bounds")
+    else:
+        texts = SAMPLES if not args.files else {f: open(f, encoding="utf-8").read() for f in args.files}
+        print(f"encoding: {_encoding_name(args.model)}")
+        print(f"{'text':<12}{'exact':>8}{'estimate':>10}{'error':>10}{'bounds':>8}"
+              f"{'exact(us)':>12}{'est.(us)':>12}{'speedup':>10}")
+        for name, text in texts.items():
+            bench(name, text, args.model)
@@ -4,13 +4,56 @@ __author__ = """Rex Wang"""
 __email__ = '1073853456@qq.com'
 __version__ = '1.4.0'
 
-import os, sys, requests
+import os, sys, importlib
 from .chattool import Chat, Resp
+from .client import Client
 from .checkpoint import load_chats, process_chats
 from .proxy import proxy_on, proxy_off, proxy_status
 from . import request
-from .tokencalc import num_tokens_from_messages, model_cost_perktoken, token2cost
-from .asynctool import async_chat_completion
+from .tokencalc import num_tokens_from_messages, num_tokens_from_message, model_cost_perktoken,\
+    model_context_window, token2cost, token2cost_bulk, estimate_tokens, estimate_tokens_from_messages
+from .context import ContextWindow
+from .deadline import Timeout, DeadlineExceeded
+from .preflight import preflight_report
+from .tokencache import prefetch_encodings, prewarm_encodings, encodings_ready, wait_encodings
+
+# heavy modules are imported on first access, see `__getattr__`
+_lazy_modules = ["asynctool", "cli"]
+_lazy_attrs = {
+    "async_chat_completion": "asynctool",
+    "abatch_completion": "asynctool",
+    "aiter_completion": "asynctool",
+    "iter_completion": "asynctool",
+    "RateLimiter": "ratelimit",
+    "Hedge": "hedge",
+    "embed": "embedding",
+    "aembed": "embedding",
+    "SemanticCache": "semcache",
+    "record": "transport",
+    "replay": "transport",
+    "Step": "pipeline",
+    "run_pipeline": "pipeline",
+    "arun_pipeline": "pipeline",
+    "Tools": "tools",
+    "WorkQueue": "workqueue",
+    "run_worker": "workqueue",
+    "arun_worker": "workqueue",
+    "Scheduler": "scheduler",
+    "tenant": "scheduler",
+    "JSONStreamValidator": "structured",
+}
+
+def __getattr__(name:str):
+    """Import the heavy modules lazily"""
+    if name in _lazy_modules:
+        return importlib.import_module("." + name, __name__)
+    if name in _lazy_attrs:
+        module = importlib.import_module("." + _lazy_attrs[name], __name__)
+        return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(list(globals()) + _lazy_modules + list(_lazy_attrs))
 
 # read API key from the environment variable
 api_key = os.environ.get('OPENAI_API_KEY')
@@ -73,6 +116,7 @@ def debug_log( net_url:str="https://www.baidu.com"
         bool: True if the debug is finished.
     """
     # Network test
+    import requests
     try:
         requests.get(net_url, timeout=timeout)
     except:
@@ -1,8 +1,13 @@
 import asyncio, aiohttp
-import time, random, warnings, json, os
-from typing import List, Dict, Union
+import time, random, warnings, json, os, hashlib
+from typing import List, Dict, Union, Callable, Iterable, Iterator, AsyncIterator, Tuple, Set
 from openai_api_call import Chat, Resp, load_chats
 import openai_api_call
+from .request import stats, async_session, async_slot
+from .checkpoint import checkpoint_ids
+from .ratelimit import RateLimiter
+from .deadline import Timeout, as_timeout
+from .tokencalc import num_tokens_from_messages, estimate_tokens_from_messages
 from tqdm.asyncio import tqdm
 
 async def async_post( session
@@ -12,7 +17,8 @@ async def async_post( session
                     , headers:Dict
                     , max_requests:int=1
                     , timeinterval=0
-                    , timeout=0):
+                    , timeout:Union[int, Timeout]=0
+                    , max_tokens:Union[int, None]=None):
     """Asynchronous post request
 
     Args:
@@ -23,34 +29,134 @@ async def async_post( session
         headers (Dict): request headers
         max_requests (int, optional): maximum number of requests to make. Defaults to 1.
         timeinterval (int, optional): time interval between two API calls. Defaults to 0.
-        timeout (int, optional): timeout for the API call. Defaults to 0(no timeout).
+        timeout (Union[int, Timeout], optional): timeout in seconds, or `Timeout` whose deadline
+          also stops the retries. Defaults to 0(no timeout).
+        max_tokens (Union[int, None], optional): `max_tokens` of the request, used to scale
+          the timeouts. Defaults to None.
     
     Returns:
         str: response text
     """
+    timeout = as_timeout(timeout)
     async with sem:
         ntries = 0
         while max_requests > 0:
-            try:    
-                async with session.post(url, headers=headers, data=data, timeout=timeout) as response:
-                    return await response.text()
+            if timeout.expired():
+                warnings.warn(f"Deadline exceeded after {ntries} tries!")
+                return None
+            start = time.time()
+            try:
+                async with async_slot('batch'): # the waiting time is not recorded
+                    start = time.time()
+                    async with async_session(session).post(url, headers=headers, data=data,
+                                            timeout=timeout.aiohttp(max_tokens)) as response:
+                        text = await response.text()
+                stats.record(time.time() - start)
+                return text
             except Exception as e:
+                stats.record(time.time() - start, success=False)
                 max_requests -= 1
                 ntries += 1
-                time.sleep(random.random() * timeinterval)
+                await asyncio.sleep(timeout.clip(random.random() * timeinterval))
                 print(f"Request Failed({ntries}):{e}")
         else:
             warnings.warn("Maximum number of requests reached!")
             return None    
     
+def estimate_cost( chatlog:List[Dict]
+                 , model:str='gpt-3.5-turbo'
+                 , completion_tokens:int=0
+                 , exact:bool=False)->int:
+    """Estimate the cost of a request by the number of tokens
+
+    Args:
+        chatlog (List[Dict]): chat log
+        model (str, optional): model to use. Defaults to 'gpt-3.5-turbo'.
+        completion_tokens (int, optional): expected number of completion tokens. Defaults to 0.
+        exact (bool, optional): whether to count the prompt tokens exactly by tiktoken,
+          otherwise use the fast estimation. Defaults to False.
+
+    Returns:
+        int: prompt tokens plus the expected completion tokens
+    """
+    if not exact:
+        return estimate_tokens_from_messages(chatlog, model=model) + completion_tokens
+    # use the pinned version to avoid the warnings of the floating models
+    model = "gpt-4-0613" if "gpt-4" in model else "gpt-3.5-turbo-0613"
+    return num_tokens_from_messages(chatlog, model=model) + completion_tokens
+
+def prefix_order(chatlogs:List[List[Dict]])->List[int]:
+    """Order the chat logs so that those sharing a prefix are adjacent
+
+    The chat logs are inserted into a trie over the message hashes, and the indexes
+    are collected by depth-first traversal, so chat logs sharing longer prefixes are
+    dispatched back-to-back, and hit the prompt cache of the provider.
+
+    Args:
+        chatlogs (List[List[Dict]]): list of chat logs
+
+    Returns:
+        List[int]: indexes of the chat logs
+    """
+    root = ({}, []) # children, indexes ending at the node
+    for ind, chatlog in enumerate(chatlogs):
+        node = root
+        for msg in chatlog:
+            key = hashlib.sha1(json.dumps(msg, sort_keys=True).encode()).digest()
+            if key not in node[0]:
+                node[0][key] = ({}, [])
+            node = node[0][key]
+        node[1].append(ind)
+    order, stack = [], [root]
+    while stack:
+        children, indexes = stack.pop()
+        order.extend(indexes)
+        # children are visited in the order of their first appearance
+        stack.extend(reversed(list(children.values())))
+    return order
+
+def schedule_order( chatlogs:List[List[Dict]]
+                  , schedule:Union[str, Callable[[List[Dict]], float]]='fifo'
+                  , model:str='gpt-3.5-turbo'
+                  , completion_tokens:int=0)->List[int]:
+    """Order in which the chat logs are dispatched
+
+    Args:
+        chatlogs (List[List[Dict]]): list of chat logs
+        schedule (Union[str, Callable], optional): 'fifo' for the input order, 'longest' for
+          the longest-first order, 'prefix' to group the chat logs by shared prefixes, see
+          `prefix_order`, or a function that estimates the cost of a chat log, which is
+          dispatched in the descending order of the cost. Defaults to 'fifo'.
+        model (str, optional): model to use. Defaults to 'gpt-3.5-turbo'.
+        completion_tokens (int, optional): expected number of completion tokens. Defaults to 0.
+
+    Returns:
+        List[int]: indexes of the chat logs
+    """
+    if schedule == 'fifo':
+        return list(range(len(chatlogs)))
+    if schedule == 'prefix':
+        return prefix_order(chatlogs)
+    if schedule == 'longest':
+        costfunc = lambda chatlog: estimate_cost(chatlog, model, completion_tokens)
+    elif callable(schedule):
+        costfunc = schedule
+    else:
+        raise ValueError("schedule should be 'fifo', 'longest', 'prefix' or a function")
+    costs = [costfunc(chatlog) for chatlog in chatlogs]
+    # sorting is stable, so chats with the same cost keep the input order
+    return sorted(range(len(chatlogs)), key=lambda ind: -costs[ind])
+
 async def async_process_msgs( chatlogs:List[List[Dict]]
                             , chkpoint:str
                             , api_key:str
                             , chat_url:str
                             , max_requests:int=1
                             , ncoroutines:int=1
-                            , timeout:int=0
+                            , timeout:Union[int, Timeout]=0
                             , timeinterval:int=0
+                            , schedule:Union[str, Callable]='fifo'
+                            , completion_tokens:Union[int, None]=None
                             , **options
                             )->List[bool]:
     """Process messages asynchronously
@@ -61,8 +167,12 @@ async def async_process_msgs( chatlogs:List[List[Dict]]
         api_key (Union[str, None], optional): API key. Defaults to None.
         max_requests (int, optional): maximum number of requests to make. Defaults to 1.
         ncoroutines (int, optional): number of coroutines. Defaults to 5.
-        timeout (int, optional): timeout for the API call. Defaults to 0(no timeout).
+        timeout (Union[int, Timeout], optional): timeout in seconds, or `Timeout` whose deadline
+          also stops the retries and the new requests. Defaults to 0(no timeout).
         timeinterval (int, optional): time interval between two API calls. Defaults to 0.
+        schedule (Union[str, Callable], optional): dispatching order, see `schedule_order`. Defaults to 'fifo'.
+        completion_tokens (Union[int, None], optional): expected number of completion tokens
+          used by the scheduler. Defaults to None(use `max_tokens` if given).
 
     Returns:
         List[bool]: list of responses
@@ -80,22 +190,9 @@ async def async_process_msgs( chatlogs:List[List[Dict]]
     locker = asyncio.Lock()
 
     async def chat_complete(ind, locker, chatlog, chkpoint, **options):
-        payload = {"messages": chatlog}
-        payload.update(options)
-        data = json.dumps(payload)
-        response = await async_post( session=session
-                                   , sem=sem
-                                   , url=chat_url
-                                   , data=data
-                                   , headers=headers
-                                   , max_requests=max_requests
-                                   , timeinterval=timeinterval
-                                   , timeout=timeout)
-        if response is None:return False
-        resp = Resp(json.loads(response))
-        if not resp.is_valid():
-            warnings.warn(f"Invalid response: {resp.error_message}")
-            return False
+        resp = await _post_chatlog( session, sem, chat_url, headers, chatlog
+                                  , max_requests, timeinterval, timeout, options)
+        if resp is None: return False
         ## saving files
         chatlog.append(resp.message)
         chat = Chat(chatlog)
@@ -105,9 +202,16 @@ async def async_process_msgs( chatlogs:List[List[Dict]]
 
     async with sem, aiohttp.ClientSession() as session:
         tasks = []
-        for ind, chatlog in enumerate(chatlogs):
-            if chats[ind] is not None: # skip completed chats
-                continue
+        # waiters of the semaphore are woken up in the order of the task creation
+        todo = [ind for ind in range(len(chatlogs)) if chats[ind] is None] # skip completed chats
+        if completion_tokens is None:
+            completion_tokens = options.get('max_tokens', 0)
+        order = schedule_order( [chatlogs[ind] for ind in todo]
+                              , schedule=schedule
+                              , model=options.get('model', 'gpt-3.5-turbo')
+                              , completion_tokens=completion_tokens)
+        for ind in (todo[i] for i in order):
+            chatlog = chatlogs[ind]
             tasks.append(
                 asyncio.create_task(
                     chat_complete( ind=ind
@@ -119,10 +223,328 @@ async def async_process_msgs( chatlogs:List[List[Dict]]
             responses = await tqdm.gather(tasks)
         else: # for windows and linux
             responses = await asyncio.gather(*tasks)
-        for ind, cost in responses:
+        for response in responses:
+            if not response: continue # failed requests
+            ind, cost = response
             costs[ind] = cost
         return costs
 
+async def _post_chatlog( session, sem, chat_url, headers, chatlog
+                      , max_requests, timeinterval, timeout, options) -> Union[Resp, None]:
+    """Post the chat log, None if the request failed or the response is invalid"""
+    data = json.dumps({"messages": chatlog, **options})
+    response = await async_post( session=session
+                               , sem=sem
+                               , url=chat_url
+                               , data=data
+                               , headers=headers
+                               , max_requests=max_requests
+                               , timeinterval=timeinterval
+                               , timeout=timeout
+                               , max_tokens=options.get('max_tokens'))
+    resp = Resp(json.loads(response)) if response is not None else None
+    if resp is not None and not resp.is_valid():
+        warnings.warn(f"Invalid response: {resp.error_message}")
+        return None
+    return resp
+
+def _resp_cost(resp:Resp) -> Union[float, None]:
+    """Cost of the response, None if the price of the model is not known"""
+    try:
+        return resp.cost()
+    except AssertionError:
+        return None
+
+async def async_process_stream( items:Iterable[Tuple[int, List[Dict]]]
+                              , chkpoint:str
+                              , api_key:str
+                              , chat_url:str
+                              , max_requests:int=1
+                              , ncoroutines:int=1
+                              , timeout:Union[int, Timeout]=0
+                              , timeinterval:int=0
+                              , rate:Union[float, None]=None
+                              , budget:Union[float, None]=None
+                              , spent:float=0
+                              , done:Union[Set[int], None]=None
+                              , **options
+                              )->Dict:
+    """Process a stream of chat logs asynchronously
+
+    The chat logs are pulled lazily by `ncoroutines` workers, so the input is never
+    loaded into memory. Chats already saved in the checkpoint are skipped, and each
+    result is saved with its chat id, usage and cost.
+
+    Args:
+        items (Iterable[Tuple[int, List[Dict]]]): pairs of chat id and chat log
+        chkpoint (str): checkpoint file
+        api_key (str): API key
+        chat_url (str): chat completion url
+        max_requests (int, optional): maximum number of requests to make. Defaults to 1.
+        ncoroutines (int, optional): number of concurrent requests. Defaults to 1.
+        timeout (Union[int, Timeout], optional): timeout in seconds, or `Timeout` whose deadline
+          also stops the retries and the new requests. Defaults to 0(no timeout).
+        timeinterval (int, optional): time interval between two API calls. Defaults to 0.
+        rate (Union[float, None], optional): maximum number of requests per minute. Defaults to None.
+        budget (Union[float, None], optional): stop sending new requests once the cost reaches
+          the budget, the requests in flight may exceed it. Defaults to None.
+        spent (float, optional): cost already spent, e.g. by the previous runs. Defaults to 0.
+        done (Union[Set[int], None], optional): chat ids to skip. Defaults to None(the chat ids
+          saved in the checkpoint).
+
+    Returns:
+        Dict: number of completed, failed and skipped chats, the total cost, and whether
+          the budget is exhausted or the deadline has passed
+    """
+    assert ncoroutines > 0, "ncoroutines must be greater than 0!"
+    if done is None: done = checkpoint_ids(chkpoint)
+    limiter = RateLimiter(rate) if rate else None
+    sem = asyncio.Semaphore(ncoroutines)
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": "Bearer " + api_key
+    }
+    summary = { "completed": 0, "failed": 0, "skipped": 0, "cost": spent
+              , "exhausted": False, "expired": False}
+    timeout = as_timeout(timeout)
+    items = iter(items)
+
+    async def worker(session):
+        # workers share the iterator, `next` never runs concurrently in the event loop
+        for chatid, chatlog in items:
+            if chatid in done:
+                summary["skipped"] += 1
+                continue
+            if budget is not None and summary["cost"] >= budget:
+                summary["exhausted"] = True
+                return
+            if timeout.expired():
+                summary["expired"] = True
+                return
+            if limiter is not None: await limiter.acquire()
+            resp = await _post_chatlog( session, sem, chat_url, headers, chatlog
+                                      , max_requests, timeinterval, timeout, options)
+            if resp is None:
+                summary["failed"] += 1
+                continue
+            cost = _resp_cost(resp)
+            Chat(chatlog + [resp.message]).savewithid(
+                chkpoint, chatid=chatid, usage=resp.usage, cost=cost)
+            summary["completed"] += 1
+            summary["cost"] += cost or 0
+
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*[worker(session) for _ in range(ncoroutines)])
+    return summary
+
+def _endpoint(api_key:Union[str, None], chat_url:Union[str, None]) -> Tuple[str, str]:
+    """API key and chat url, read from the globals if not given"""
+    if api_key is None:
+        api_key = openai_api_call.api_key
+    assert api_key is not None, "API key is not provided!"
+    if chat_url is None:
+        chat_url = os.path.join(openai_api_call.base_url, "v1/chat/completions")
+    return api_key, openai_api_call.request.normalize_url(chat_url)
+
+async def aiter_completion( chatlogs:Iterable[Union[List[Dict], str]]
+                          , chkpoint:Union[str, None]=None
+                          , model:str='gpt-3.5-turbo'
+                          , api_key:Union[str, None]=None
+                          , chat_url:Union[str, None]=None
+                          , max_requests:int=1
+                          , ncoroutines:int=1
+                          , timeout:Union[int, Timeout]=0
+                          , timeinterval:int=0
+                          , maxsize:Union[int, None]=None
+                          , **options
+                          ) -> AsyncIterator[Tuple[int, Union[Resp, None]]]:
+    """Yield the responses as the requests complete
+
+    The chat logs are pulled lazily by `ncoroutines` workers, and at most `maxsize` results
+    wait for the consumer, the workers pause when they are full. Closing the iterator early
+    cancels the requests in flight.
+
+    Args:
+        chatlogs (Iterable[Union[List[Dict], str]]): chat logs or chat messages, numbered by their order
+        chkpoint (Union[str, None], optional): checkpoint file to skip the saved chats and save
+          the results. Defaults to None(no checkpoint).
+        model (str, optional): model to use. Defaults to 'gpt-3.5-turbo'.
+        api_key (Union[str, None], optional): API key. Defaults to None.
+        chat_url (Union[str, None], optional): chat completion url. Defaults to None.
+        max_requests (int, optional): maximum number of requests to make. Defaults to 1.
+        ncoroutines (int, optional): number of concurrent requests. Defaults to 1.
+        timeout (Union[int, Timeout], optional): timeout in seconds, or `Timeout` whose deadline
+          also stops the retries and the new requests. Defaults to 0(no timeout).
+        timeinterval (int, optional): time interval between two API calls. Defaults to 0.
+        maxsize (Union[int, None], optional): maximum number of results waiting for the consumer.
+          Defaults to None(`ncoroutines`).
+
+    Yields:
+        Tuple[int, Union[Resp, None]]: chat id and response, None if the request failed
+    """
+    assert ncoroutines > 0, "ncoroutines must be greater than 0!"
+    api_key, chat_url = _endpoint(api_key, chat_url)
+    done = checkpoint_ids(chkpoint) if chkpoint is not None else set()
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": "Bearer " + api_key
+    }
+    options["model"] = model
+    timeout = as_timeout(timeout)
+    sem = asyncio.Semaphore(ncoroutines)
+    results, errors = asyncio.Queue(maxsize=maxsize or ncoroutines), []
+    items = enumerate(chatlogs)
+
+    async def worker(session):
+        try:
+            for chatid, chatlog in items:
+                if chatid in done: continue
+                chatlog = Chat(chatlog).chat_log
+                resp = await _post_chatlog( session, sem, chat_url, headers, chatlog
+                                          , max_requests, timeinterval, timeout, options)
+                if resp is not None and chkpoint is not None:
+                    Chat(chatlog + [resp.message]).savewithid(
+                        chkpoint, chatid=chatid, usage=resp.usage, cost=_resp_cost(resp))
+                await results.put((chatid, resp)) # wait for the consumer if full
+        except Exception as e:
+            errors.append(e)
+        await results.put(None) # end of the worker
+
+    async with aiohttp.ClientSession() as session:
+        workers = [asyncio.create_task(worker(session)) for _ in range(ncoroutines)]
+        try:
+            nrunning = ncoroutines
+            while nrunning:
+                result = await results.get()
+                if result is None:
+                    nrunning -= 1
+                    continue
+                yield result
+            if errors: raise errors[0]
+        finally:
+            for task in workers: task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+def iter_completion( chatlogs:Iterable[Union[List[Dict], str]]
+                   , chkpoint:Union[str, None]=None
+                   , maxsize:Union[int, None]=None
+                   , **kwargs) -> Iterator[Tuple[int, Union[Resp, None]]]:
+    """Yield the responses as the requests complete (sync version of `aiter_completion`)
+
+    The requests run in an event loop of a background thread, so it also works inside
+    a running event loop, e.g. in Jupyter Notebook.
+
+    Args:
+        chatlogs (Iterable[Union[List[Dict], str]]): chat logs or chat messages, numbered by their order
+        chkpoint (Union[str, None], optional): checkpoint file. Defaults to None(no checkpoint).
+        maxsize (Union[int, None], optional): maximum number of results waiting for the consumer.
+          Defaults to None(`ncoroutines`).
+        **kwargs: other arguments of `aiter_completion`
+
+    Yields:
+        Tuple[int, Union[Resp, None]]: chat id and response, None if the request failed
+    """
+    import queue, threading
+    maxsize = maxsize or kwargs.get('ncoroutines', 1)
+    results, stop, running = queue.Queue(maxsize=maxsize), threading.Event(), []
+
+    def put(item) -> bool:
+        # block until the consumer takes the item, or gives up
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    async def pump():
+        responses = aiter_completion(chatlogs, chkpoint, maxsize=maxsize, **kwargs)
+        loop = asyncio.get_running_loop()
+        running.append((loop, asyncio.current_task()))
+        try:
+            async for result in responses:
+                if not await loop.run_in_executor(None, put, ("result", result)): break
+        except BaseException as e:
+            put(("error", e))
+        else:
+            put(("done", None))
+        finally:
+            await responses.aclose()
+
+    thread = threading.Thread(target=asyncio.run, args=(pump(),), daemon=True)
+    thread.start()
+    try:
+        while True:
+            kind, value = results.get()
+            if kind == "done": break
+            if kind == "error": raise value
+            yield value
+    finally:
+        stop.set()
+        if running: # cancel the requests in flight if the consumer stops early
+            loop, task = running[0]
+            try:
+                loop.call_soon_threadsafe(task.cancel)
+            except RuntimeError: # the loop is closed
+                pass
+        thread.join(timeout=5)
+
+async def abatch_completion( chatlogs:Union[List[List[Dict]], str]
+                           , chkpoint:str
+                           , model:str='gpt-3.5-turbo'
+                           , api_key:Union[str, None]=None
+                           , chat_url:Union[str, None]=None
+                           , max_requests:int=1
+                           , ncoroutines:int=1
+                           , timeout:Union[int, Timeout]=0
+                           , timeinterval:int=0
+                           , clearfile:bool=False
+                           , schedule:Union[str, Callable]='fifo'
+                           , completion_tokens:Union[int, None]=None
+                           , **options
+                           ):
+    """Asynchronous chat completion, awaitable inside a running event loop
+
+    Args:
+        chatlogs (Union[List[List[Dict]], str]): list of chat logs or chat message
+        chkpoint (str): checkpoint file
+        model (str, optional): model to use. Defaults to 'gpt-3.5-turbo'.
+        api_key (Union[str, None], optional): API key. Defaults to None.
+        max_requests (int, optional): maximum number of requests to make. Defaults to 1.
+        ncoroutines (int, optional): number of coroutines. Defaults to 5.
+        timeout (Union[int, Timeout], optional): timeout in seconds, or `Timeout` whose deadline
+          also stops the retries and the new requests. Defaults to 0(no timeout).
+        timeinterval (int, optional): time interval between two API calls. Defaults to 0.
+        clearfile (bool, optional): whether to clear the checkpoint file. Defaults to False.
+        schedule (Union[str, Callable], optional): dispatching order, 'fifo', 'longest', 'prefix'
+          or a cost function, see `schedule_order`. Defaults to 'fifo'.
+        completion_tokens (Union[int, None], optional): expected number of completion tokens
+          used by the scheduler. Defaults to None(use `max_tokens` if given).
+
+    Returns:
+        List[float]: list of costs
+    """
+    # read chatlogs | use method from the Chat object
+    chatlogs = [Chat(log).chat_log for log in chatlogs]
+    if clearfile and os.path.exists(chkpoint):
+        os.remove(chkpoint)
+    api_key, chat_url = _endpoint(api_key, chat_url)
+    # run async process
+    assert ncoroutines > 0, "ncoroutines must be greater than 0!"
+    return await async_process_msgs( chatlogs=chatlogs
+                                   , chkpoint=chkpoint
+                                   , api_key=api_key
+                                   , chat_url=chat_url
+                                   , max_requests=max_requests
+                                   , ncoroutines=ncoroutines
+                                   , timeout=timeout
+                                   , timeinterval=timeinterval
+                                   , schedule=schedule
+                                   , completion_tokens=completion_tokens
+                                   , model=model
+                                   , **options)
+
 def async_chat_completion( chatlogs:Union[List[List[Dict]], str]
                          , chkpoint:str
                          , model:str='gpt-3.5-turbo'
@@ -130,10 +552,12 @@ def async_chat_completion( chatlogs:Union[List[List[Dict]], str]
                          , chat_url:Union[str, None]=None
                          , max_requests:int=1
                          , ncoroutines:int=1
-                         , timeout:int=0
+                         , timeout:Union[int, Timeout]=0
                          , timeinterval:int=0
                          , clearfile:bool=False
                          , notrun:bool=False
+                         , schedule:Union[str, Callable]='fifo'
+                         , completion_tokens:Union[int, None]=None
                          , **options
                          ):
     """Asynchronous chat completion
@@ -145,40 +569,39 @@ def async_chat_completion( chatlogs:Union[List[List[Dict]], str]
         api_key (Union[str, None], optional): API key. Defaults to None.
         max_requests (int, optional): maximum number of requests to make. Defaults to 1.
         ncoroutines (int, optional): number of coroutines. Defaults to 5.
-        timeout (int, optional): timeout for the API call. Defaults to 0(no timeout).
+        timeout (Union[int, Timeout], optional): timeout in seconds, or `Timeout` whose deadline
+          also stops the retries and the new requests. Defaults to 0(no timeout).
         timeinterval (int, optional): time interval between two API calls. Defaults to 0.
         clearfile (bool, optional): whether to clear the checkpoint file. Defaults to False.
         notrun (bool, optional): whether to run the async process. It should be True
           when use in Jupyter Notebook. Defaults to False.
+        schedule (Union[str, Callable], optional): dispatching order, 'fifo', 'longest', 'prefix'
+          or a cost function, see `schedule_order`. Defaults to 'fifo'.
+        completion_tokens (Union[int, None], optional): expected number of completion tokens
+          used by the scheduler. Defaults to None(use `max_tokens` if given).
 
     Returns:
         List[Dict]: list of responses
     """
-    # read chatlogs | use method from the Chat object
-    chatlogs = [Chat(log).chat_log for log in chatlogs]
-    if clearfile and os.path.exists(chkpoint):
-        os.remove(chkpoint)
-    if api_key is None:
-        api_key = openai_api_call.api_key
-    assert api_key is not None, "API key is not provided!"
-    if chat_url is None:
-        chat_url = os.path.join(openai_api_call.base_url, "v1/chat/completions")
-    chat_url = openai_api_call.request.normalize_url(chat_url)
-    # run async process
-    assert ncoroutines > 0, "ncoroutines must be greater than 0!"
-    args = {
-        "chatlogs": chatlogs,
-        "chkpoint": chkpoint,
-        "api_key": api_key,
-        "chat_url": chat_url,
-        "max_requests": max_requests,
-        "ncoroutines": ncoroutines,
-        "timeout": timeout,
-        "timeinterval": timeinterval,
-        "model": model,
-        **options
-    }
+    coro = abatch_completion( chatlogs=chatlogs
+                            , chkpoint=chkpoint
+                            , model=model
+                            , api_key=api_key
+                            , chat_url=chat_url
+                            , max_requests=max_requests
+                            , ncoroutines=ncoroutines
+                            , timeout=timeout
+                            , timeinterval=timeinterval
+                            , clearfile=clearfile
+                            , schedule=schedule
+                            , completion_tokens=completion_tokens
+                            , **options)
     if notrun: # when use in Jupyter Notebook
-        return async_process_msgs(**args) # return the async object
-    else:
-        return asyncio.run(async_process_msgs(**args))
\ No newline at end of file
+        return coro # return the async object
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError: # no running event loop
+        return asyncio.run(coro)
+    coro.close()
+    raise RuntimeError("`async_chat_completion` can not be called inside a running event loop, " +
+                       "use `await abatch_completion(...)` instead.")
@@ -3,17 +3,21 @@
 from typing import List, Dict, Union
 import openai_api_call
 from .response import Resp
-from .tokencalc import num_tokens_from_messages, token2cost
-from .request import chat_completion, valid_models
+from .tokencalc import num_tokens_from_message, token2cost, _message_format
+from .request import chat_completion, achat_completion, astream_completion, valid_models
+from .context import ContextWindow
+from .deadline import Timeout, as_timeout, DeadlineExceeded
+from .client import Client
 import time, random, json
-import aiohttp
 
 class Chat():
     def __init__( self
                 , msg:Union[List[Dict], None, str]=None
                 , api_key:Union[None, str]=None
                 , chat_url:Union[None, str]=None
-                , model:Union[None, str]=None):
+                , model:Union[None, str]=None
+                , context_window:Union[None, ContextWindow]=None
+                , client:Union[None, Client]=None):
         """Initialize the chat log
 
         Args:
@@ -21,37 +25,88 @@ class Chat():
             api_key (Union[None, str], optional): API key. Defaults to None.
             chat_url (Union[None, str], optional): base url. Defaults to None. Example: "https://api.openai.com/v1/chat/completions"
             model (Union[None, str], optional): model to use. Defaults to None.
+            context_window (Union[None, ContextWindow], optional): truncate the chat log to fit the
+              context window before sending. Defaults to None(send the whole chat log).
+            client (Union[None, Client], optional): configuration to bind, which replaces the module
+              globals and provides the session, proxies and default options. Defaults to None.
         
         Raises:
             ValueError: msg should be a list of dict, a string or None
         """
+        default_prompt = openai_api_call.default_prompt if client is None else client.default_prompt
         if msg is None:
             self._chat_log = []
         elif isinstance(msg, str):
-            if openai_api_call.default_prompt is None:
+            if default_prompt is None:
                 self._chat_log = [{"role": "user", "content": msg}]
             else:
-                self._chat_log = openai_api_call.default_prompt(msg)
+                self._chat_log = default_prompt(msg)
         elif isinstance(msg, list):
             self._chat_log = msg.copy() # avoid changing the original list
         else:
             raise ValueError("msg should be a list of dict, a string or None")
-        self._api_key = openai_api_call.api_key if api_key is None else api_key
-        self._chat_url = chat_url if chat_url is not None else\
-              openai_api_call.base_url.rstrip('/') + '/v1/chat/completions'
-        self._model = 'gpt-3.5-turbo' if model is None else model
+        self.client = client
+        if client is not None:
+            self._api_key = client.api_key if api_key is None else api_key
+            self._chat_url = client.chat_url if chat_url is None else chat_url
+            self._model = client.model if model is None else model
+        else:
+            self._api_key = openai_api_call.api_key if api_key is None else api_key
+            self._chat_url = chat_url if chat_url is not None else\
+                  openai_api_call.base_url.rstrip('/') + '/v1/chat/completions'
+            self._model = 'gpt-3.5-turbo' if model is None else model
+        self.context_window = context_window
         self._resp = None
+        # token counts of the messages, computed lazily
+        self._token_model, self._token_counts, self._token_total = None, [], 0
+        # number of messages saved by `savedelta`, keyed by the file and the chat id
+        self._saved = {}
     
     def prompt_token(self, model:str="gpt-3.5-turbo-0613"):
         """Get the prompt token for the model
 
+        The token counts of each message are cached, so only the newly added
+        messages are encoded.
+
         Args:
             model (str): model to use
 
         Returns:
             str: prompt token
         """
-        return num_tokens_from_messages(self.chat_log, model=model)
+        self.token_counts(model)
+        return self._token_total + 3 # every reply is primed with <|start|>assistant<|message|>
+
+    def token_counts(self, model:str="gpt-3.5-turbo-0613") -> List[int]:
+        """Get the token counts of the messages
+
+        Args:
+            model (str): model to use
+
+        Returns:
+            List[int]: number of tokens of each message
+        """
+        model = _message_format(model)[0]
+        if model != self._token_model or len(self._token_counts) > len(self._chat_log):
+            self._reset_tokens(model)
+        for msg in self._chat_log[len(self._token_counts):]:
+            ntokens = num_tokens_from_message(msg, model)
+            self._token_counts.append(ntokens)
+            self._token_total += ntokens
+        return self._token_counts
+
+    def _reset_tokens(self, model:Union[str, None]=None, start:int=0):
+        """Invalidate the token counts of the messages from `start`"""
+        if model is not None and model != self._token_model:
+            self._token_model, self._token_counts, self._token_total = model, [], 0
+        if start < len(self._token_counts):
+            self._token_total -= sum(self._token_counts[start:])
+            del self._token_counts[start:]
+
+    def _reset_saved(self, start:int=0):
+        """Mark the messages from `start` as not saved by `savedelta`"""
+        for key, nsaved in self._saved.items():
+            self._saved[key] = min(nsaved, start)
 
     @property
     def model(self):
@@ -86,21 +141,57 @@ class Chat():
     def chat_log(self):
         """Chat history"""
         return self._chat_log
+
+    def _options(self, options:Dict) -> Dict:
+        """Request options with the defaults of the client"""
+        if self.client is None or not self.client.options:
+            return options
+        return {**self.client.options, **options}
+
+    def _proxy(self, chat_url:str) -> Union[str, None]:
+        """Proxy of the async requests"""
+        return None if self.client is None else self.client.proxy(chat_url)
+
+    def prompt_messages(self, reserve:int=0) -> List[Dict]:
+        """Messages to send, truncated by the context window if set
+
+        Args:
+            reserve (int, optional): tokens reserved for the completion. Defaults to 0.
+
+        Raises:
+            ValueError: the latest message exceeds the context window
+
+        Returns:
+            List[Dict]: messages to send
+        """
+        if self.context_window is None:
+            return self.chat_log
+        counts = None
+        if self.context_window.counter is num_tokens_from_message:
+            counts = self.token_counts(self.model)
+        return self.context_window.fit(
+            self.chat_log, model=self.model, reserve=reserve, counts=counts)
     
     def getresponse( self
                    , max_requests:int=1
-                   , timeout:int = 0
+                   , timeout:Union[int, Timeout] = 0
                    , timeinterval:int = 0
                    , update:bool = True
                    , stream:bool = False
+                   , hedge=None
+                   , cache=None
                    , **options)->Resp:
         """Get the API response
 
         Args:
             max_requests (int, optional): maximum number of requests to make. Defaults to 1.
-            timeout (int, optional): timeout for the API call. Defaults to 0(no timeout).
+            timeout (Union[int, Timeout], optional): timeout in seconds, or `Timeout` whose deadline
+              also stops the retries. Defaults to 0(no timeout).
             timeinterval (int, optional): time interval between two API calls. Defaults to 0.
             update (bool, optional): whether to update the chat log. Defaults to True.
+            hedge (Hedge, optional): policy to send a duplicate of the slow requests. Defaults to None.
+            cache (SemanticCache, optional): cache to return the response of a similar prompt,
+              and to store the new response. Defaults to None.
             options (dict, optional): other options like `temperature`, `top_p`, etc.
 
         Returns:
@@ -109,33 +200,299 @@ class Chat():
         # initialize data
         api_key, model = self.api_key, self.model
         assert api_key is not None, "API key is not set!"
-        if not len(options):options = {}
-        msg, resp, numoftries = self.chat_log, None, 0
+        options = self._options(options)
+        session = None if self.client is None else self.client.session()
+        msg, resp, numoftries = self.prompt_messages(options.get('max_tokens', 0)), None, 0
         if stream: # TODO: add the `usage` key to the response
             print("Warning: stream mode is not supported yet! Use `async_stream_responses()` instead.")
+        timeout = as_timeout(timeout)
+        if cache is not None: resp = cache.lookup(msg, model, options)
+        hit = resp is not None
+        if hit: max_requests = 0
         # make requests
         while max_requests:
+            if timeout.expired():
+                raise DeadlineExceeded(f"Deadline exceeded after {numoftries} tries!")
             try:
                 # Make the API call
-                response = chat_completion(
+                call = lambda chat_url: chat_completion(
                     api_key=api_key, messages=msg, model=model,
-                    chat_url=self.chat_url, timeout=timeout, **options)
+                    chat_url=chat_url, timeout=timeout, session=session, **options)
+                if hedge is None:
+                    response = call(self.chat_url)
+                else:
+                    from .hedge import hedged_call
+                    response = hedged_call(hedge, call, self.chat_url)
                 resp = Resp(response)
                 assert resp.is_valid(), "Invalid response with message: " + resp.error_message
                 break
             except Exception as e:
                 max_requests -= 1
                 numoftries += 1
-                time.sleep(random.random() * timeinterval)
+                time.sleep(timeout.clip(random.random() * timeinterval))
+                print(f"Try again ({numoftries}):{e}\n")
+        else:
+            if not hit:
+                raise Exception("Request failed! Try using `debug_log()` to find out the problem " +
+                                "or increase the `max_requests`.")
+        if cache is not None and not hit:
+            cache.store(msg, resp, model, options)
+        if update: # update the chat log
+            self._add_resp(resp)
+        return resp
+    
+    def getresponses( self
+                    , n:int=2
+                    , native:bool=True
+                    , max_requests:int=1
+                    , timeout:Union[int, Timeout] = 0
+                    , timeinterval:int = 0
+                    , **options)->List["Chat"]:
+        """Sample `n` responses and branch the chat for each of them
+
+        The branches share the message objects and the token counts of this chat,
+        and this chat itself is not updated.
+
+        Args:
+            n (int, optional): number of responses. Defaults to 2.
+            native (bool, optional): whether to request `n` choices in one call. Responses missing
+              from the call, e.g. when `n` is ignored or rejected, are requested in parallel. Defaults to True.
+            max_requests (int, optional): maximum number of requests to make. Defaults to 1.
+            timeout (Union[int, Timeout], optional): timeout in seconds, or `Timeout` whose deadline
+              also stops the retries. Defaults to 0(no timeout).
+            timeinterval (int, optional): time interval between two API calls. Defaults to 0.
+            options (dict, optional): other options like `temperature`, `top_p`, etc.
+
+        Returns:
+            List[Chat]: branched chats, each ends with one of the responses
+        """
+        resps = []
+        kwargs = dict(max_requests=max_requests, timeout=timeout,
+                      timeinterval=timeinterval, update=False, **options)
+        if native:
+            try:
+                resps = self.getresponse(n=n, **kwargs).split()[:n]
+            except DeadlineExceeded:
+                raise
+            except Exception: # e.g. `n` is rejected by the provider
+                resps = []
+        if len(resps) < n: # fan out the rest
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=n - len(resps)) as executor:
+                futures = [executor.submit(self.getresponse, **kwargs)
+                           for _ in range(n - len(resps))]
+                resps += [future.result() for future in futures]
+        return [self._branch(resp) for resp in resps]
+
+    async def agetresponses( self
+                           , n:int=2
+                           , native:bool=True
+                           , max_requests:int=1
+                           , timeout:Union[int, Timeout] = 0
+                           , timeinterval:int = 0
+                           , session=None
+                           , **options)->List["Chat"]:
+        """Sample `n` responses and branch the chat for each of them (asyncio version)
+
+        Args:
+            n (int, optional): number of responses. Defaults to 2.
+            native (bool, optional): whether to request `n` choices in one call. Responses missing
+              from the call, e.g. when `n` is ignored or rejected, are requested concurrently. Defaults to True.
+            max_requests (int, optional): maximum number of requests to make. Defaults to 1.
+            timeout (Union[int, Timeout], optional): timeout in seconds, or `Timeout` whose deadline
+              also stops the retries. Defaults to 0(no timeout).
+            timeinterval (int, optional): time interval between two API calls. Defaults to 0.
+            session (aiohttp.ClientSession, optional): session to use. Defaults to None(the pooled session).
+            options (dict, optional): other options like `temperature`, `top_p`, etc.
+
+        Returns:
+            List[Chat]: branched chats, each ends with one of the responses
+        """
+        import asyncio
+        resps = []
+        kwargs = dict(max_requests=max_requests, timeout=timeout, timeinterval=timeinterval,
+                      update=False, session=session, **options)
+        if native:
+            try:
+                resps = (await self.agetresponse(n=n, **kwargs)).split()[:n]
+            except DeadlineExceeded:
+                raise
+            except Exception: # e.g. `n` is rejected by the provider
+                resps = []
+        if len(resps) < n: # fan out the rest
+            resps += await asyncio.gather(
+                *[self.agetresponse(**kwargs) for _ in range(n - len(resps))])
+        return [self._branch(resp) for resp in resps]
+
+    def _branch(self, resp:Resp)->"Chat":
+        """Branch the chat with the response"""
+        chat = self.copy()
+        chat._add_resp(resp)
+        return chat
+
+    async def agetresponse( self
+                          , max_requests:int=1
+                          , timeout:Union[int, Timeout] = 0
+                          , timeinterval:int = 0
+                          , update:bool = True
+                          , session=None
+                          , hedge=None
+                          , **options)->Resp:
+        """Get the API response (asyncio version)
+
+        Args:
+            max_requests (int, optional): maximum number of requests to make. Defaults to 1.
+            timeout (Union[int, Timeout], optional): timeout in seconds, or `Timeout` whose deadline
+              also stops the retries. Defaults to 0(no timeout).
+            timeinterval (int, optional): time interval between two API calls. Defaults to 0.
+            update (bool, optional): whether to update the chat log. Defaults to True.
+            session (aiohttp.ClientSession, optional): session to use. Defaults to None(the pooled session).
+            hedge (Hedge, optional): policy to send a duplicate of the slow requests, the slower
+              one is cancelled. Defaults to None.
+            options (dict, optional): other options like `temperature`, `top_p`, etc.
+
+        Returns:
+            Resp: API response
+        """
+        import asyncio
+        api_key, model = self.api_key, self.model
+        assert api_key is not None, "API key is not set!"
+        options = self._options(options)
+        msg, resp, numoftries = self.prompt_messages(options.get('max_tokens', 0)), None, 0
+        timeout = as_timeout(timeout)
+        while max_requests:
+            if timeout.expired():
+                raise DeadlineExceeded(f"Deadline exceeded after {numoftries} tries!")
+            try:
+                call = lambda chat_url: achat_completion(
+                    api_key=api_key, messages=msg, model=model, chat_url=chat_url,
+                    timeout=timeout, session=session, proxy=self._proxy(chat_url), **options)
+                if hedge is None:
+                    response = await call(self.chat_url)
+                else:
+                    from .hedge import ahedged_call
+                    response = await ahedged_call(hedge, call, self.chat_url)
+                resp = Resp(response)
+                assert resp.is_valid(), "Invalid response with message: " + resp.error_message
+                break
+            except Exception as e:
+                max_requests -= 1
+                numoftries += 1
+                await asyncio.sleep(timeout.clip(random.random() * timeinterval))
                 print(f"Try again ({numoftries}):{e}\n")
         else:
             raise Exception("Request failed! Try using `debug_log()` to find out the problem " +
                             "or increase the `max_requests`.")
         if update: # update the chat log
-            self.assistant(resp.content)
-            self._resp = resp
+            self._add_resp(resp)
         return resp
-    
+
+    async def astream(self, timeout:Union[int, Timeout]=0, update:bool=True, session=None, hedge=None, **options):
+        """Post request asynchronously and stream the responses
+
+        Args:
+            timeout (Union[int, Timeout], optional): timeout in seconds or `Timeout`. Defaults to 0(no timeout).
+            update (bool, optional): whether to add the full response to the chat log. Defaults to True.
+            session (aiohttp.ClientSession, optional): session to use. Defaults to None(the pooled session).
+            hedge (Hedge, optional): policy to send a duplicate if the first chunk is late, the
+              slower stream is closed. Defaults to None.
+            options (dict, optional): other options like `temperature`, `top_p`, etc.
+
+        Yields:
+            Resp: chunk of the response, use `delta_content` to get the text
+        """
+        assert self.api_key is not None, "API key is not set!"
+        options = self._options(options)
+        msg, contents = self.prompt_messages(options.get('max_tokens', 0)), []
+        stream = lambda chat_url: astream_completion(
+            api_key=self.api_key, messages=msg, model=self.model, chat_url=chat_url,
+            timeout=timeout, session=session, proxy=self._proxy(chat_url), **options)
+        if hedge is None:
+            chunks = stream(self.chat_url)
+        else:
+            from .hedge import ahedged_stream
+            chunks = ahedged_stream(hedge, stream, self.chat_url)
+        try:
+            async for chunk in chunks:
+                resp = Resp(chunk)
+                if resp.finish_reason == 'stop': break
+                if resp.delta_content is None: continue
+                contents.append(resp.delta_content)
+                yield resp
+        except Exception as e:
+            raise Exception(f"Request Failed:{e}")
+        finally:
+            await chunks.aclose()
+        if update:
+            self.assistant(''.join(contents))
+
+    async def agetjson( self
+                      , schema:Union[Dict, None]=None
+                      , max_requests:int=3
+                      , timeout:Union[int, Timeout]=0
+                      , update:bool=True
+                      , session=None
+                      , **options):
+        """Get a JSON response, validated as it is streamed
+
+        The `response_format` option is set by the schema. The stream is closed as soon as
+        the output can no longer be valid, and the request is sent again right away.
+
+        Args:
+            schema (Union[Dict, None], optional): JSON schema of the output, see `JSONStreamValidator`
+              for the keywords checked. Defaults to None(any JSON object).
+            max_requests (int, optional): maximum number of requests to make. Defaults to 3.
+            timeout (Union[int, Timeout], optional): timeout in seconds, or `Timeout` whose deadline
+              also stops the retries. Defaults to 0(no timeout).
+            update (bool, optional): whether to update the chat log. Defaults to True.
+            session (aiohttp.ClientSession, optional): session to use. Defaults to None(the pooled session).
+            options (dict, optional): other options like `temperature`, `top_p`, etc.
+
+        Raises:
+            ValueError: no valid JSON is returned after `max_requests` requests
+
+        Returns:
+            Any: parsed JSON
+        """
+        from .structured import JSONStreamValidator, response_format
+        options.setdefault('response_format', response_format(schema))
+        timeout, numoftries, error = as_timeout(timeout), 0, None
+        while numoftries < max_requests:
+            if timeout.expired():
+                raise DeadlineExceeded(f"Deadline exceeded after {numoftries} tries!")
+            validator = JSONStreamValidator(schema)
+            chunks = self.astream(timeout=timeout, update=False, session=session, **options)
+            try:
+                async for resp in chunks:
+                    if not validator.feed(resp.delta_content): break # abort the stream
+                else:
+                    validator.finish()
+                error = validator.error
+            except Exception as e:
+                error = str(e)
+            finally:
+                await chunks.aclose()
+            if error is None:
+                if update: self.assistant(validator.text)
+                return json.loads(validator.text)
+            numoftries += 1
+            print(f"Try again ({numoftries}):{error}\n")
+        raise ValueError(f"No valid JSON after {numoftries} requests: {error}")
+
+    def getjson(self, schema:Union[Dict, None]=None, **kwargs):
+        """Get a JSON response, validated as it is streamed, see `agetjson` for the arguments
+
+        Returns:
+            Any: parsed JSON
+        """
+        import asyncio
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError: # no running event loop
+            return asyncio.run(self.agetjson(schema, **kwargs))
+        raise RuntimeError("`getjson` can not be called inside a running event loop, " +
+                           "use `await chat.agetjson(...)` instead.")
+
     async def async_stream_responses(self, timeout=0):
         """Post request asynchronously and stream the responses
 
@@ -145,25 +502,8 @@ class Chat():
         Returns:
             str: response text
         """
-        data = json.dumps({
-            "model" : self.model, "messages" : self.chat_log, "stream":True})
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': 'Bearer ' + self.api_key}
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.chat_url, headers=headers, data=data, timeout=timeout) as response:
-                    while True:
-                        line = await response.content.readline()
-                        if not line: break
-                        strline = line.decode().lstrip('data:').strip()
-                        if not strline: continue
-                        line = json.loads(strline)
-                        resp = Resp(line)
-                        if resp.finish_reason == 'stop': break
-                        yield resp
-        except Exception as e:
-            raise Exception(f"Request Failed:{e}")
+        async for resp in self.astream(timeout=timeout, update=False):
+            yield resp
     
     def get_valid_models(self, gpt_only:bool=True)->List[str]:
         """Get the valid models
@@ -174,14 +514,26 @@ class Chat():
         Returns:
             List[str]: valid models
         """
-        return valid_models(self.api_key, gpt_only=gpt_only)
+        if self.client is None:
+            return valid_models(self.api_key, gpt_only=gpt_only)
+        return valid_models(self.api_key, gpt_only=gpt_only,
+                            base_url=self.client.base_url, session=self.client.session())
 
-    def add(self, role:str, msg:str):
-        """Add a message to the chat log"""
-        assert role in ['user', 'assistant', 'system'], "role should be 'user', 'assistant' or 'system'"
-        self._chat_log.append({"role": role, "content": msg})
+    def add(self, role:str, msg:str, **fields):
+        """Add a message to the chat log, with other fields like `tool_call_id`"""
+        assert role in ['user', 'assistant', 'system', 'tool'], \
+            "role should be 'user', 'assistant', 'system' or 'tool'"
+        self._chat_log.append({"role": role, "content": msg, **fields})
         return self
 
+    def _add_resp(self, resp:Resp):
+        """Add the response message, with its tool calls if any"""
+        if resp.tool_calls:
+            self.add('assistant', resp.content, tool_calls=resp.tool_calls)
+        else:
+            self.assistant(resp.content)
+        self._resp = resp
+
     def user(self, msg:str):
         """User message"""
         return self.add('user', msg)
@@ -193,14 +545,59 @@ class Chat():
     def system(self, msg:str):
         """System message"""
         return self.add('system', msg)
+
+    def tool(self, msg:str, tool_call_id:str):
+        """Tool message, the result of a tool call"""
+        return self.add('tool', msg, tool_call_id=tool_call_id)
+
+    @staticmethod
+    def _tools_option(tools) -> Dict:
+        schema = tools.schema()
+        return {"tools": schema} if schema else {}
+
+    def run_tools(self, tools, max_rounds:int=10, **kwargs)->Resp:
+        """Get the responses and run the tools they call until a response calls no tool
+
+        Args:
+            tools (Tools): tools to offer and run, see `Tools`, the `tools` option is not sent
+              if there is no tool, which the API rejects
+            max_rounds (int, optional): maximum number of responses. Defaults to 10.
+            kwargs (dict, optional): arguments of `getresponse`, like `timeout`
+
+        Returns:
+            Resp: last response, which may still call tools if `max_rounds` is reached
+        """
+        assert max_rounds > 0, "max_rounds must be greater than 0!"
+        for _ in range(max_rounds):
+            resp = self.getresponse(**self._tools_option(tools), **kwargs)
+            if not resp.tool_calls: break
+            for tool_call_id, result in tools.run(resp.tool_calls):
+                self.tool(result, tool_call_id)
+        return resp
+
+    async def arun_tools(self, tools, max_rounds:int=10, **kwargs)->Resp:
+        """Asynchronous version of `run_tools`, the tools run on the event loop or in threads"""
+        assert max_rounds > 0, "max_rounds must be greater than 0!"
+        for _ in range(max_rounds):
+            resp = await self.agetresponse(**self._tools_option(tools), **kwargs)
+            if not resp.tool_calls: break
+            for tool_call_id, result in await tools.arun(resp.tool_calls):
+                self.tool(result, tool_call_id)
+        return resp
     
     def clear(self):
         """Clear the chat log"""
         self._chat_log = []
+        self._reset_tokens()
+        self._reset_saved()
     
     def copy(self):
         """Copy the chat log"""
-        return Chat(self._chat_log, api_key=self.api_key, chat_url=self.chat_url, model=self.model)
+        chat = Chat( self._chat_log, api_key=self.api_key, chat_url=self.chat_url
+                   , model=self.model, context_window=self.context_window, client=self.client)
+        chat._token_model, chat._token_total = self._token_model, self._token_total
+        chat._token_counts = self._token_counts.copy()
+        return chat
     
     def last_message(self):
         """Get the last message"""
@@ -228,20 +625,39 @@ class Chat():
             f.write(json.dumps(data, ensure_ascii=False) + '\n')
         return
     
-    def savewithid(self, path:str, chatid:int, mode:str='a'):
+    def savewithid(self, path:str, chatid:int, mode:str='a', **extra):
         """Save the chat log with chat id. Each line is a json string.
 
         Args:
             path (str): path to the file
             chatid (int): chat id
             mode (str, optional): mode to open the file. Defaults to 'a'.
+            extra (dict, optional): other fields to save, e.g. `cost`.
         """
         assert mode in ['a', 'w'], "saving mode should be 'a' or 'w'"
-        data = {"chatid": chatid, "chatlog": self.chat_log}
+        data = {"chatid": chatid, "chatlog": self.chat_log, **extra}
         with open(path, mode, encoding='utf-8') as f:
             f.write(json.dumps(data, ensure_ascii=False) + '\n')
         return
 
+    def savedelta(self, path:str, chatid:int, **extra):
+        """Append the messages not saved yet, instead of the whole chat log
+
+        Each line keeps the chat id, the number of messages before the new ones(`offset`)
+        and the new messages, which are rebuilt into the chat log by `load_chats`. The
+        messages edited or popped after saving are saved again from their position.
+
+        Args:
+            path (str): path to the file
+            chatid (int): chat id
+            extra (dict, optional): other fields to save, e.g. `cost`.
+        """
+        offset = self._saved.get((path, chatid), 0)
+        data = {"chatid": chatid, "offset": offset, "messages": self._chat_log[offset:], **extra}
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(data, ensure_ascii=False) + '\n')
+        self._saved[(path, chatid)] = len(self._chat_log)
+
     def print_log(self, sep: Union[str, None]=None):
         """Print the chat log"""
         if sep is None:
@@ -251,7 +667,12 @@ class Chat():
     
     def pop(self, ind:int=-1):
         """Pop the last message"""
-        return self._chat_log.pop(ind)
+        msg = self._chat_log.pop(ind)
+        if ind < 0: ind += len(self._chat_log) + 1
+        if ind < len(self._token_counts):
+            self._token_total -= self._token_counts.pop(ind)
+        self._reset_saved(ind)
+        return msg
 
     def __len__(self):
         """Length of the chat log"""
@@ -271,4 +692,11 @@ class Chat():
     def __getitem__(self, index):
         """Get the message at index"""
         return self._chat_log[index]
+
+    def __setitem__(self, index:int, msg:Dict):
+        """Edit the message at index"""
+        self._chat_log[index] = msg
+        if index < 0: index += len(self._chat_log)
+        self._reset_tokens(start=index)
+        self._reset_saved(index)
     
\ No newline at end of file
@@ -1,11 +1,13 @@
 import json, warnings, os
-from typing import List, Dict, Union, Callable, Any
+from typing import List, Dict, Union, Callable, Any, Iterator, Tuple, Set
 from .chattool import Chat
-import tqdm
 
 def load_chats( checkpoint:str
               , withid:bool=False):
     """Load chats from a checkpoint file
+
+    The lines saved by `Chat.savedelta` are applied to the chat log of the same chat id,
+    and the loaded chats continue to save the deltas to the same file.
     
     Args:
         checkpoint (str): path to the checkpoint file
@@ -27,6 +29,7 @@ def load_chats( checkpoint:str
     # get the chatlogs
     logs = [json.loads(txt) for txt in txts]
     ## chatlogs with chatid
+    deltas = set() # chat ids saved by deltas
     if withid:
         chat_size, chatlogs = 1, [None]
         for log in logs:
@@ -34,11 +37,25 @@ def load_chats( checkpoint:str
             if idx >= chat_size: # extend chatlogs
                 chatlogs.extend([None] * (idx - chat_size + 1))
                 chat_size = idx + 1
-            chatlogs[idx] = log['chatlog']
+            if 'offset' not in log:
+                chatlogs[idx] = log['chatlog']
+                deltas.discard(idx)
+                continue
+            # delta of the chat log
+            chatlog, offset = chatlogs[idx] or [], log['offset']
+            if offset > len(chatlog):
+                raise ValueError(f"chat {idx} has {len(chatlog)} messages before the delta at offset {offset}")
+            del chatlog[offset:]
+            chatlog.extend(log['messages'])
+            chatlogs[idx] = chatlog
+            deltas.add(idx)
     else: ## logs without chatid
         chatlogs = logs
     # return Chat class
-    return [Chat(chatlog) if chatlog is not None else None for chatlog in chatlogs]
+    chats = [Chat(chatlog) if chatlog is not None else None for chatlog in chatlogs]
+    for idx in deltas: # continue saving the deltas
+        chats[idx]._saved[(checkpoint, idx)] = len(chats[idx])
+    return chats
 
 def process_chats( data:List[Any]
                  , data2chat:Callable[[Any], Chat]
@@ -68,10 +85,104 @@ def process_chats( data:List[Any]
     
     chats.extend([None] * (len(data) - len(chats)))
     ## process chats
+    import tqdm, tqdm.notebook
     tq = tqdm.tqdm if not isjupyter else tqdm.notebook.tqdm
     for i in tq(range(len(data))):
         if chats[i] is not None: continue
         chat = data2chat(data[i])
         chat.save(checkpoint, mode='a')
         chats[i] = chat
-    return chats
\ No newline at end of file
+    return chats
+def iter_jsonl(path:str) -> Iterator[Any]:
+    """Iterate over the json lines of a file without loading the whole file
+
+    Args:
+        path (str): path to the file
+
+    Yields:
+        Any: data of each line
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line: yield json.loads(line)
+
+def iter_chatlogs(path:str) -> Iterator[Tuple[int, List[Dict]]]:
+    """Iterate over the chat logs of an input file
+
+    Each line is a chat log, a message string, or an object with the key `chatlog`
+    (or `messages`) and an optional key `chatid`. Lines without a chat id are numbered
+    by their order in the file.
+
+    Args:
+        path (str): path to the input file
+
+    Yields:
+        Tuple[int, List[Dict]]: chat id and chat log
+    """
+    for ind, data in enumerate(iter_jsonl(path)):
+        yield parse_chatlog(data, ind)
+
+def parse_chatlog(data:Any, ind:int) -> Tuple[int, List[Dict]]:
+    """Chat id and chat log of a line of the input file, see `iter_chatlogs`
+
+    Args:
+        data (Any): data of the line
+        ind (int): index of the line, used as the default chat id
+
+    Returns:
+        Tuple[int, List[Dict]]: chat id and chat log
+    """
+    chatid = ind
+    if isinstance(data, dict):
+        chatid = data.get('chatid', ind)
+        data = data['chatlog'] if 'chatlog' in data else data['messages']
+    return chatid, Chat(data).chat_log
+
+def checkpoint_ids(checkpoint:str) -> Set[int]:
+    """Chat ids saved in a checkpoint file
+
+    Args:
+        checkpoint (str): path to the checkpoint file
+
+    Returns:
+        Set[int]: chat ids
+    """
+    if not os.path.exists(checkpoint): return set()
+    return set(data['chatid'] for data in iter_jsonl(checkpoint))
+
+def merge_checkpoints(output:str, checkpoints:List[str]) -> int:
+    """Merge checkpoint files with chat ids, sorted by the chat id
+
+    Only the positions of the lines are kept in memory. If a chat id appears
+    more than once, the last one is kept. The deltas saved by `Chat.savedelta`
+    can not be merged, load and save the chats instead.
+
+    Args:
+        output (str): path to the merged file
+        checkpoints (List[str]): paths to the checkpoint files
+
+    Returns:
+        int: number of chats in the merged file
+    """
+    index = {}
+    for fid, path in enumerate(checkpoints):
+        with open(path, 'rb') as f:
+            offset = 0
+            for line in f:
+                if line.strip():
+                    data = json.loads(line)
+                    if 'offset' in data:
+                        raise ValueError(f"{path} has the deltas of the chat logs, which can not be merged")
+                    index[data['chatid']] = (fid, offset)
+                offset += len(line)
+    files = [open(path, 'rb') for path in checkpoints]
+    try:
+        with open(output, 'wb') as out:
+            for chatid in sorted(index):
+                fid, offset = index[chatid]
+                files[fid].seek(offset)
+                out.write(files[fid].readline().rstrip(b'\r\n') + b'\n')
+    finally:
+        for f in files: f.close()
+    return len(index)
@@ -1,16 +1,304 @@
 """Console script for openai_api_call."""
-import sys
+import sys, os, json, time, asyncio
+import aiohttp
 import click
+import openai_api_call
+from .checkpoint import iter_jsonl, iter_chatlogs, merge_checkpoints
+from .asynctool import async_process_stream
+from .tokencache import prefetch_encodings, cached_encodings
+from .deadline import Timeout
+from .preflight import preflight_report
+from .workqueue import WorkQueue, arun_worker
 
+def job_path(chkpoint:str) -> str:
+    """Path to the job file of a checkpoint"""
+    return chkpoint + '.job.json'
 
-@click.command()
+# arguments of the requests set by the flags of the commands, not by `--option`
+reserved_options = { 'model', 'api_key', 'chat_url', 'max_requests', 'ncoroutines', 'timeout'
+                   , 'timeinterval', 'rate', 'budget', 'spent', 'done', 'chkpoint'}
+
+def parse_options(options) -> dict:
+    """Parse the `KEY=VALUE` options, values are read as json if possible"""
+    parsed = {}
+    for option in options:
+        key, sep, value = option.partition('=')
+        if not sep:
+            raise click.BadParameter(f"option should be KEY=VALUE, got {option}")
+        if key in reserved_options:
+            raise click.BadParameter(f"{key} is set by its own flag, not by --option")
+        try:
+            parsed[key] = json.loads(value)
+        except json.JSONDecodeError:
+            parsed[key] = value
+    return parsed
+
+def checkpoint_status(chkpoint:str) -> dict:
+    """Progress and cost read from the checkpoint"""
+    chatids, cost, prompt_tokens, completion_tokens, cached_tokens = set(), 0, 0, 0, 0
+    if os.path.exists(chkpoint):
+        for data in iter_jsonl(chkpoint):
+            chatids.add(data['chatid'])
+            cost += data.get('cost') or 0
+            usage = data.get('usage') or {}
+            prompt_tokens += usage.get('prompt_tokens', 0)
+            completion_tokens += usage.get('completion_tokens', 0)
+            cached_tokens += (usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0
+    return { "completed": len(chatids), "cost": cost, "prompt_tokens": prompt_tokens
+           , "completion_tokens": completion_tokens, "cached_tokens": cached_tokens}
+
+def run_job(job:dict, api_key:str):
+    """Run the job saved in the job file"""
+    if api_key is None:
+        raise click.ClickException("API key is not provided!")
+    chat_url = job['chat_url']
+    if chat_url is None:
+        chat_url = os.path.join(openai_api_call.base_url, "v1/chat/completions")
+    spent = checkpoint_status(job['chkpoint'])['cost']
+    timeout = Timeout(total=job['timeout'] or None, deadline=job.get('deadline'))
+    t = time.time()
+    summary = asyncio.run(async_process_stream(
+        iter_chatlogs(job['input']), job['chkpoint'], api_key=api_key,
+        chat_url=openai_api_call.request.normalize_url(chat_url),
+        max_requests=job['max_requests'], ncoroutines=job['concurrency'],
+        timeout=timeout, timeinterval=job['timeinterval'],
+        rate=job['rate'], budget=job['budget'], spent=spent,
+        model=job['model'], **job['options']))
+    click.echo(f"Completed: {summary['completed']}, failed: {summary['failed']}, "
+               f"skipped: {summary['skipped']}, total cost: ${summary['cost']:.4f}, "
+               f"time elapsed: {time.time() - t:.2f}s")
+    if summary['exhausted']:
+        click.echo("Budget is exhausted, use `resume` with a larger `--budget` to continue.")
+    if summary['expired']:
+        click.echo("Deadline has passed, use `resume` to continue.")
+    return summary
+
+@click.group()
 def main(args=None):
-    """Console script for openai_api_call."""
-    click.echo("Replace this message by putting your code into "
-               "openai_api_call.cli.main")
-    click.echo("See click documentation at https://click.palletsprojects.com/")
-    return 0
+    """Batch tools for the OpenAI chat completion API."""
+    pass
+
+api_key_option = click.option('--api-key', envvar='OPENAI_API_KEY', default=None,
+                              help='API key, read from OPENAI_API_KEY by default.')
+
+@main.command()
+@click.argument('input', type=click.Path(exists=True, dir_okay=False))
+@click.option('-o', '--chkpoint', required=True, help='Checkpoint file of the results.')
+@click.option('-m', '--model', default='gpt-3.5-turbo', show_default=True, help='Model to use.')
+@click.option('-c', '--concurrency', default=1, show_default=True, help='Number of concurrent requests.')
+@click.option('--rate', type=float, default=None, help='Maximum number of requests per minute.')
+@click.option('--budget', type=float, default=None, help='Maximum cost in dollars.')
+@click.option('--max-requests', default=1, show_default=True, help='Maximum number of tries of each chat.')
+@click.option('--timeout', default=0, show_default=True, help='Timeout of each request, 0 for no timeout.')
+@click.option('--timeinterval', default=0, show_default=True, help='Time interval between two tries.')
+@click.option('--deadline', type=float, default=None, help='Seconds to stop the requests and retries of each run.')
+@click.option('--chat-url', default=None, help='Chat completion url.')
+@click.option('--option', 'options', multiple=True, help='Request option as KEY=VALUE, e.g. temperature=0.')
+@click.option('--clear', is_flag=True, help='Clear the checkpoint before running.')
+@api_key_option
+def run(input, chkpoint, model, concurrency, rate, budget, max_requests,
+        timeout, timeinterval, deadline, chat_url, options, clear, api_key):
+    """Complete the chats in the JSONL file INPUT.
+
+    Each line is a chat log, a message, or an object with the key `chatlog`
+    and an optional `chatid`. The job is saved next to the checkpoint to `resume` it.
+    """
+    options = parse_options(options)
+    if clear and os.path.exists(chkpoint):
+        os.remove(chkpoint)
+    job = { "input": os.path.abspath(input), "chkpoint": os.path.abspath(chkpoint), "model": model
+          , "concurrency": concurrency, "rate": rate, "budget": budget
+          , "max_requests": max_requests, "timeout": timeout, "timeinterval": timeinterval
+          , "deadline": deadline, "chat_url": chat_url, "options": options}
+    with open(job_path(chkpoint), 'w', encoding='utf-8') as f:
+        json.dump(job, f, indent=2)
+    run_job(job, api_key or openai_api_call.api_key)
+
+@main.command()
+@click.argument('chkpoint')
+@click.option('-c', '--concurrency', type=int, default=None, help='Override the number of concurrent requests.')
+@click.option('--rate', type=float, default=None, help='Override the maximum number of requests per minute.')
+@click.option('--budget', type=float, default=None, help='Override the maximum cost in dollars.')
+@click.option('--deadline', type=float, default=None, help='Override the seconds to stop the run.')
+@api_key_option
+def resume(chkpoint, concurrency, rate, budget, deadline, api_key):
+    """Resume the job of the checkpoint CHKPOINT."""
+    if not os.path.exists(job_path(chkpoint)):
+        raise click.ClickException(f"job file {job_path(chkpoint)} does not exist, use `run` instead")
+    with open(job_path(chkpoint), 'r', encoding='utf-8') as f:
+        job = json.load(f)
+    for key, value in [('concurrency', concurrency), ('rate', rate), ('budget', budget),
+                       ('deadline', deadline)]:
+        if value is not None: job[key] = value
+    run_job(job, api_key or openai_api_call.api_key)
+
+@main.command()
+@click.argument('chkpoint')
+def status(chkpoint):
+    """Show the progress and cost of the checkpoint CHKPOINT."""
+    info = checkpoint_status(chkpoint)
+    total = None
+    if os.path.exists(job_path(chkpoint)):
+        with open(job_path(chkpoint), 'r', encoding='utf-8') as f:
+            job = json.load(f)
+        if os.path.exists(job['input']):
+            total = sum(1 for _ in iter_jsonl(job['input']))
+    if total:
+        click.echo(f"Progress:\t{info['completed']}/{total} ({100 * info['completed'] / total:.1f}%)")
+    else:
+        click.echo(f"Progress:\t{info['completed']}")
+    click.echo(f"Prompt tokens:\t{info['prompt_tokens']} ({info['cached_tokens']} cached)")
+    click.echo(f"Completion tokens:\t{info['completion_tokens']}")
+    click.echo(f"Cost:\t${info['cost']:.4f}")
+
+@main.command()
+@click.argument('input', type=click.Path(exists=True, dir_okay=False))
+@click.option('-m', '--model', default='gpt-3.5-turbo', show_default=True, help='Model to use.')
+@click.option('--max-tokens', default=0, show_default=True, help='Expected completion tokens of each chat.')
+@click.option('-p', '--processes', type=int, default=None, help='Number of processes, the number of CPUs by default.')
+@click.option('--chunk-size', default=1000, show_default=True, help='Number of lines sent to a process at once.')
+@click.option('--estimate', is_flag=True, help='Use the fast estimation instead of tiktoken.')
+def preflight(input, model, max_tokens, processes, chunk_size, estimate):
+    """Count the prompt tokens and project the cost of the chats in INPUT."""
+    report = preflight_report(input, model=model, completion_tokens=max_tokens, exact=not estimate,
+                              nprocs=processes, chunksize=chunk_size)
+    click.echo(f"Chats:\t{report['nchats']}")
+    click.echo(f"Prompt tokens:\t{report['prompt_tokens']} (max {report['max_tokens']})")
+    click.echo(f"Completion tokens:\t{report['completion_tokens']}")
+    if report['cost'] is not None:
+        click.echo(f"Projected cost:\t${report['cost']:.4f}")
+    click.echo("Prompt sizes:")
+    for bucket, nchats in report['histogram'].items():
+        click.echo(f"  <= {bucket}\t{nchats}")
+    if report['context_window'] is not None:
+        over_limit = report['over_limit']
+        click.echo(f"Over the context window ({report['context_window']}):\t{len(over_limit)}")
+        if over_limit:
+            more = ", ..." if len(over_limit) > 10 else ""
+            click.echo(f"  chat ids: {', '.join(map(str, over_limit[:10]))}{more}")
+
+@main.command()
+@click.argument('input', type=click.Path(exists=True, dir_okay=False))
+@click.argument('queue')
+@click.option('--chunk-size', default=100, show_default=True, help='Number of chats of a chunk.')
+def enqueue(input, queue, chunk_size):
+    """Split the chats in INPUT into the chunks of the work queue QUEUE.
+
+    The queue is a SQLite database on the shared filesystem, see `work`.
+    """
+    queue = WorkQueue(queue)
+    try:
+        nchunks = queue.populate(input, chunksize=chunk_size)
+        status = queue.status()
+    finally:
+        queue.close()
+    click.echo(f"Chunks:\t{status['done']}/{nchunks} done, {status['leased']} leased, "
+               f"{status['expired']} expired")
+
+@main.command()
+@click.argument('queue', type=click.Path(exists=True, dir_okay=False))
+@click.option('-o', '--outdir', required=True, help='Directory of the shards of the workers.')
+@click.option('-w', '--worker', default=None, help='Name of the worker, the host and the process id by default.')
+@click.option('-m', '--model', default='gpt-3.5-turbo', show_default=True, help='Model to use.')
+@click.option('-c', '--concurrency', default=1, show_default=True, help='Number of concurrent requests.')
+@click.option('--rate', type=float, default=None, help='Maximum number of requests per minute of the worker.')
+@click.option('--lease', default=600.0, show_default=True, help='Seconds of the lease of a chunk.')
+@click.option('--max-requests', default=1, show_default=True, help='Maximum number of tries of each chat.')
+@click.option('--timeout', default=0, show_default=True, help='Timeout of each request, 0 for no timeout.')
+@click.option('--timeinterval', default=0, show_default=True, help='Time interval between two tries.')
+@click.option('--chat-url', default=None, help='Chat completion url.')
+@click.option('--option', 'options', multiple=True, help='Request option as KEY=VALUE, e.g. temperature=0.')
+@api_key_option
+def work(queue, outdir, worker, model, concurrency, rate, lease, max_requests,
+         timeout, timeinterval, chat_url, options, api_key):
+    """Complete the chunks of the work queue QUEUE until none is left.
+
+    Run it on several nodes sharing the filesystem, then `merge` the shards in OUTDIR.
+    """
+    api_key = api_key or openai_api_call.api_key
+    if api_key is None:
+        raise click.ClickException("API key is not provided!")
+    queue = WorkQueue(queue, lease=lease)
+    t = time.time()
+    try:
+        summary = asyncio.run(arun_worker(
+            queue, outdir, worker=worker, api_key=api_key, chat_url=chat_url,
+            max_requests=max_requests, ncoroutines=concurrency, timeout=timeout,
+            timeinterval=timeinterval, rate=rate, model=model, **parse_options(options)))
+        status = queue.status()
+    finally:
+        queue.close()
+    click.echo(f"Chunks: {summary['chunks']}, completed: {summary['completed']}, "
+               f"failed: {summary['failed']}, skipped: {summary['skipped']}, "
+               f"total cost: ${summary['cost']:.4f}, time elapsed: {time.time() - t:.2f}s")
+    click.echo(f"Queue: {status['done']}/{status['total']} chunks done")
+
+@main.command()
+@click.argument('output')
+@click.argument('chkpoints', nargs=-1, required=True)
+def merge(output, chkpoints):
+    """Merge the checkpoints CHKPOINTS into OUTPUT, sorted by chat id."""
+    nchats = merge_checkpoints(output, list(chkpoints))
+    click.echo(f"Merged {nchats} chats into {output}")
+
+@main.command()
+@click.option('-n', '--nrequests', default=10, show_default=True, help='Number of requests.')
+@click.option('-c', '--concurrency', default=1, show_default=True, help='Number of concurrent requests.')
+@click.option('-m', '--model', default='gpt-3.5-turbo', show_default=True, help='Model to use.')
+@click.option('--prompt', default='hello', show_default=True, help='Prompt of the requests.')
+@click.option('--max-tokens', type=int, default=None, help='Maximum number of completion tokens.')
+@click.option('--chat-url', default=None, help='Chat completion url.')
+@api_key_option
+def bench(nrequests, concurrency, model, prompt, max_tokens, chat_url, api_key):
+    """Benchmark the latency and throughput of the endpoint."""
+    api_key = api_key or openai_api_call.api_key
+    if api_key is None:
+        raise click.ClickException("API key is not provided!")
+    options = {} if max_tokens is None else {"max_tokens": max_tokens}
+    latencies, failures = [], []
+
+    async def request(chat, sem, session):
+        async with sem:
+            start = time.time()
+            try:
+                await chat.agetresponse(update=False, session=session, **options)
+                latencies.append(time.time() - start)
+            except Exception as e:
+                failures.append(e)
+
+    async def run_bench():
+        sem = asyncio.Semaphore(concurrency)
+        chat = openai_api_call.Chat(prompt, api_key=api_key, chat_url=chat_url, model=model)
+        async with aiohttp.ClientSession() as session:
+            await asyncio.gather(*[request(chat, sem, session) for _ in range(nrequests)])
+
+    t = time.time()
+    asyncio.run(run_bench())
+    elapsed = time.time() - t
+    click.echo(f"Requests:\t{len(latencies)} succeeded, {len(failures)} failed")
+    click.echo(f"Throughput:\t{len(latencies) / elapsed:.2f} requests/s")
+    latencies.sort()
+    for q in [50, 90, 99]:
+        if latencies:
+            latency = latencies[min(len(latencies) - 1, int(len(latencies) * q / 100))]
+            click.echo(f"Latency p{q}:\t{latency:.3f}s")
+
+@main.command()
+@click.option('-d', '--cache-dir', required=True, help='Directory to keep the encoding files.')
+@click.option('-e', '--encoding', 'encodings', multiple=True, default=['cl100k_base'],
+              show_default=True, help='Encodings to prefetch.')
+def prefetch(cache_dir, encodings):
+    """Download the tiktoken encodings for offline token counting.
 
+    Set TIKTOKEN_CACHE_DIR to the cache directory at runtime to use them.
+    """
+    try:
+        paths = prefetch_encodings(encodings, path=cache_dir)
+    except (ValueError, RuntimeError) as e:
+        raise click.ClickException(str(e))
+    for path in paths:
+        click.echo(f"Cached:\t{path}")
+    click.echo(f"Encodings available in {cache_dir}: {', '.join(cached_encodings(cache_dir))}")
 
 if __name__ == "__main__":
     sys.exit(main())  # pragma: no cover
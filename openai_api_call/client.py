@@ -0,0 +1,95 @@
+# Immutable configuration of the API calls
+
+import threading
+from types import MappingProxyType
+from typing import Dict, List, Union, Callable
+from urllib.parse import urlparse
+import openai_api_call
+from .request import normalize_url
+
+class Client():
+    __slots__ = ( "api_key", "base_url", "chat_url", "model", "proxies"
+                , "default_prompt", "options", "_session", "_lock")
+
+    def __init__( self
+                , api_key:Union[str, None]=None
+                , base_url:Union[str, None]=None
+                , chat_url:Union[str, None]=None
+                , model:str='gpt-3.5-turbo'
+                , proxies:Union[Dict[str, str], None]=None
+                , default_prompt:Union[Callable[[str], List[Dict]], None]=None
+                , options:Union[Dict, None]=None):
+        """Immutable configuration of the API calls, bound to the chats by `Chat(client=...)`
+
+        The chats of a client never read the module globals, and its proxies apply to its
+        own sessions rather than `os.environ`, so clients of different tenants can run
+        concurrently in one process. Use `replace` to derive a new client.
+
+        Args:
+            api_key (Union[str, None], optional): API key. Defaults to None(`openai_api_call.api_key`
+              at the creation).
+            base_url (Union[str, None], optional): base url. Defaults to None(`openai_api_call.base_url`
+              at the creation).
+            chat_url (Union[str, None], optional): chat completion url. Defaults to None(derived from
+              `base_url`).
+            model (str, optional): default model. Defaults to 'gpt-3.5-turbo'.
+            proxies (Union[Dict[str, str], None], optional): proxies of the scheme, e.g.
+              {"https": "http://127.0.0.1:7890"}. Defaults to None(use the environment).
+            default_prompt (Callable, optional): function to convert a string into the chat log.
+              Defaults to None(a user message).
+            options (Union[Dict, None], optional): default options of the requests, like
+              `temperature`. Defaults to None.
+        """
+        base_url = openai_api_call.base_url if base_url is None else normalize_url(base_url)
+        if chat_url is None:
+            chat_url = base_url.rstrip('/') + '/v1/chat/completions'
+        setattr_ = super().__setattr__
+        setattr_("api_key", openai_api_call.api_key if api_key is None else api_key)
+        setattr_("base_url", base_url)
+        setattr_("chat_url", chat_url)
+        setattr_("model", model)
+        setattr_("proxies", None if proxies is None else MappingProxyType(dict(proxies)))
+        setattr_("default_prompt", default_prompt)
+        setattr_("options", MappingProxyType(dict(options or {})))
+        setattr_("_session", None)
+        setattr_("_lock", threading.Lock())
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Client is immutable, use `replace` to derive a new one")
+
+    def replace(self, **changes) -> "Client":
+        """New client with the fields changed"""
+        fields = { "api_key": self.api_key, "base_url": self.base_url, "chat_url": self.chat_url
+                 , "model": self.model, "proxies": self.proxies
+                 , "default_prompt": self.default_prompt, "options": self.options}
+        if "base_url" in changes and "chat_url" not in changes:
+            fields["chat_url"] = None # derive from the new base url
+        fields.update(changes)
+        return Client(**fields)
+
+    def session(self):
+        """Pooled `requests.Session` of the client, with its own proxies"""
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    import requests
+                    session = requests.Session()
+                    if self.proxies is not None:
+                        session.trust_env = False # ignore the proxies of the environment
+                        session.proxies.update(self.proxies)
+                    super().__setattr__("_session", session)
+        return self._session
+
+    def proxy(self, url:str) -> Union[str, None]:
+        """Proxy of the url for `aiohttp`, None to connect directly"""
+        if self.proxies is None:
+            return None
+        return self.proxies.get(urlparse(url).scheme)
+
+    def chat(self, msg:Union[List[Dict], None, str]=None, **kwargs):
+        """Create a chat bound to the client"""
+        from .chattool import Chat
+        return Chat(msg, client=self, **kwargs)
+
+    def __repr__(self) -> str:
+        return f"<Client of {self.chat_url} with model {self.model}>"
@@ -0,0 +1,114 @@
+# Fit the chat log into the context window of the model
+
+from typing import List, Dict, Union, Callable
+from .tokencalc import num_tokens_from_message, model_context_window
+
+class ContextWindow():
+    def __init__( self
+                , max_tokens:Union[int, None]=None
+                , policy:str='drop_oldest'
+                , keep_last:Union[int, None]=None
+                , summarize:Union[Callable[[List[Dict]], Union[str, Dict]], None]=None
+                , counter:Union[Callable[[Dict, str], int], None]=None):
+        """Context window budget of the chat log
+
+        Args:
+            max_tokens (Union[int, None], optional): size of the context window. Defaults to None(look up
+              `model_context_window` by the model).
+            policy (str, optional): policy to truncate the chat log, 'drop_oldest', 'keep_system'
+              or 'summarize'. Defaults to 'drop_oldest'.
+            keep_last (Union[int, None], optional): maximum number of latest non-system messages to keep,
+              used by 'keep_system'. Defaults to None(no limit).
+            summarize (Callable, optional): function to summarize the dropped messages, used by 'summarize'.
+              It should return the summary text or a message. Defaults to None.
+            counter (Callable, optional): function to count the tokens of a message. Defaults to None(use
+              `num_tokens_from_message`, which caches the counts of each message).
+
+        Raises:
+            ValueError: unknown policy or missing `summarize` function
+        """
+        if policy not in ['drop_oldest', 'keep_system', 'summarize']:
+            raise ValueError("policy should be 'drop_oldest', 'keep_system' or 'summarize'")
+        if policy == 'summarize' and summarize is None:
+            raise ValueError("`summarize` function is required by the 'summarize' policy")
+        self.max_tokens, self.policy = max_tokens, policy
+        self.keep_last, self.summarize = keep_last, summarize
+        self.counter = num_tokens_from_message if counter is None else counter
+
+    def window_size(self, model:str) -> int:
+        """Size of the context window for the model"""
+        if self.max_tokens is not None:
+            return self.max_tokens
+        if model in model_context_window:
+            return model_context_window[model]
+        # fall back to the base model, e.g. "gpt-4-1106" -> "gpt-4"
+        for name in sorted(model_context_window, key=len, reverse=True):
+            if model.startswith(name):
+                return model_context_window[name]
+        raise ValueError(f"Context window of model {model} is not known, please set `max_tokens`")
+
+    def count(self, messages:List[Dict], model:str='gpt-3.5-turbo') -> int:
+        """Number of prompt tokens of the messages"""
+        # every reply is primed with <|start|>assistant<|message|>
+        return sum(self.counter(msg, model) for msg in messages) + 3
+
+    def fit( self
+           , messages:List[Dict]
+           , model:str='gpt-3.5-turbo'
+           , reserve:int=0
+           , counts:Union[List[int], None]=None) -> List[Dict]:
+        """Truncate the messages to fit the context window
+
+        Args:
+            messages (List[Dict]): chat log
+            model (str, optional): model to use. Defaults to 'gpt-3.5-turbo'.
+            reserve (int, optional): tokens reserved for the completion. Defaults to 0.
+            counts (Union[List[int], None], optional): token counts of the messages if known. Defaults to None.
+
+        Raises:
+            ValueError: the latest message alone exceeds the context window
+
+        Returns:
+            List[Dict]: messages to send, the original list if it fits
+        """
+        budget = self.window_size(model) - reserve - 3
+        if counts is None:
+            counts = [self.counter(msg, model) for msg in messages]
+        if sum(counts) <= budget:
+            return messages
+        if self.policy == 'drop_oldest':
+            keep, fixed = list(range(len(messages))), []
+        else: # system messages are always kept
+            fixed = [i for i, msg in enumerate(messages) if msg['role'] == 'system']
+            keep = [i for i, msg in enumerate(messages) if msg['role'] != 'system']
+            if self.policy == 'keep_system' and self.keep_last is not None:
+                keep = keep[max(len(keep) - self.keep_last, 0):]
+        budget -= sum(counts[i] for i in fixed)
+        # drop the oldest messages until the rest fits
+        total, start = sum(counts[i] for i in keep), 0
+        while start < len(keep) and total > budget:
+            total -= counts[keep[start]]
+            start += 1
+        if self.policy == 'summarize' and start > 0:
+            return self._fit_summary(messages, model, budget, counts, fixed, keep, start)
+        if start == len(keep):
+            raise ValueError("The latest message exceeds the context window!")
+        return [messages[i] for i in sorted(fixed + keep[start:])]
+
+    def _fit_summary(self, messages, model, budget, counts, fixed, keep, start):
+        """Replace the dropped messages by their summary"""
+        while start < len(keep):
+            summary = self.summarize([messages[i] for i in keep[:start]])
+            if isinstance(summary, str):
+                summary = {"role": "system", "content": summary}
+            if self.counter(summary, model) + sum(counts[i] for i in keep[start:]) <= budget:
+                break
+            start += 1
+        else:
+            raise ValueError("The latest message exceeds the context window!")
+        # put the summary after the leading system messages
+        kept = [messages[i] for i in sorted(fixed + keep[start:])]
+        nlead = 0
+        while nlead < len(kept) and kept[nlead]['role'] == 'system':
+            nlead += 1
+        return kept[:nlead] + [summary] + kept[nlead:]
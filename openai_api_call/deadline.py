@@ -0,0 +1,101 @@
+# Deadline-based timeouts of the requests
+
+import time
+from typing import Union, Tuple
+
+class Timeout():
+    def __init__( self
+                , total:Union[float, None]=None
+                , connect:Union[float, None]=None
+                , first_byte:Union[float, None]=None
+                , per_token:float=0
+                , deadline:Union[float, None]=None):
+        """Timeouts of a request, scaled by the expected output length
+
+        The response of a non-streaming request arrives after the whole completion
+        is generated, so both `first_byte` and `total` grow with `max_tokens` by
+        `per_token`, while the first chunk of a stream only waits for `first_byte`.
+        The deadline is shared by the retries, and every timeout is clipped to it.
+
+        Args:
+            total (Union[float, None], optional): total time of a request in seconds. Defaults to None(no limit).
+            connect (Union[float, None], optional): time to connect in seconds. Defaults to None(no limit).
+            first_byte (Union[float, None], optional): time to the first byte of the response, and
+              between two reads of a stream. Defaults to None(no limit).
+            per_token (float, optional): extra seconds per token of `max_tokens`. Defaults to 0.
+            deadline (Union[float, None], optional): seconds from now to give up the request and its
+              retries, e.g. the deadline of the job. Defaults to None(no deadline).
+        """
+        for value in [total, connect, first_byte, deadline]:
+            assert value is None or value > 0, "timeouts should be positive!"
+        assert per_token >= 0, "per_token should be non-negative!"
+        self.total, self.connect, self.first_byte = total, connect, first_byte
+        self.per_token = per_token
+        self.deadline = None if deadline is None else time.monotonic() + deadline
+
+    def remaining(self) -> Union[float, None]:
+        """Seconds before the deadline, None if there is no deadline"""
+        if self.deadline is None:
+            return None
+        return max(0., self.deadline - time.monotonic())
+
+    def expired(self) -> bool:
+        """Whether the deadline has passed"""
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def clip(self, seconds:Union[float, None]) -> Union[float, None]:
+        """Clip the seconds to the deadline"""
+        remaining = self.remaining()
+        if remaining is None: return seconds
+        remaining = max(remaining, 1e-3) # 0 means no timeout for aiohttp
+        return remaining if seconds is None else min(seconds, remaining)
+
+    def budget( self
+              , max_tokens:Union[int, None]=0
+              , stream:bool=False) -> Tuple[Union[float, None], ...]:
+        """Timeouts of the next request, clipped to the deadline
+
+        Args:
+            max_tokens (Union[int, None], optional): maximum number of completion tokens. Defaults to 0.
+            stream (bool, optional): whether the response is streamed. Defaults to False.
+
+        Returns:
+            Tuple[Union[float, None], ...]: connect, first byte and total timeouts
+        """
+        extra = self.per_token * (max_tokens or 0)
+        total = None if self.total is None else self.total + extra
+        first_byte = self.first_byte
+        if first_byte is not None and not stream:
+            first_byte += extra
+        return self.clip(self.connect), self.clip(first_byte), self.clip(total)
+
+    def aiohttp(self, max_tokens:Union[int, None]=0, stream:bool=False):
+        """Timeouts of the next request as `aiohttp.ClientTimeout`"""
+        import aiohttp
+        connect, first_byte, total = self.budget(max_tokens, stream)
+        return aiohttp.ClientTimeout(total=total, sock_connect=connect, sock_read=first_byte)
+
+    def requests(self, max_tokens:Union[int, None]=0):
+        """Timeouts of the next request for `requests` as (connect, read)
+
+        `requests` has no total timeout, so `total` only acts as the timeout of each read
+        of the socket when `first_byte` is not set, and a slowly streamed response may
+        take longer. The connect timeout falls back to the read timeout if not set.
+        """
+        connect, first_byte, total = self.budget(max_tokens)
+        read = first_byte if first_byte is not None else total
+        if connect is None: connect = read
+        if connect is None: return None
+        return (connect, read)
+
+    def __repr__(self) -> str:
+        return f"<Timeout with total {self.total}s, connect {self.connect}s, first byte {self.first_byte}s>"
+
+def as_timeout(timeout:Union[float, Timeout, None]) -> Timeout:
+    """Convert the timeout in seconds to `Timeout`, 0 or None for no timeout"""
+    if isinstance(timeout, Timeout):
+        return timeout
+    return Timeout(total=timeout if timeout else None)
+
+class DeadlineExceeded(TimeoutError):
+    """The deadline passed before the request succeeded"""
@@ -0,0 +1,178 @@
+# Batched embeddings of the texts
+
+import asyncio, aiohttp
+import json, os, warnings
+from typing import List, Dict, Union, Iterator, Tuple, Sequence
+import openai_api_call
+from .asynctool import async_post
+from .checkpoint import iter_jsonl
+from .deadline import Timeout
+from .ratelimit import RateLimiter
+from .tokencalc import estimate_tokens
+
+def pack_batches( texts:Sequence[str]
+                , model:str='text-embedding-ada-002'
+                , max_tokens:int=8000
+                , max_inputs:int=2048) -> Iterator[Tuple[int, int]]:
+    """Pack the texts into batches by the token budget, in the input order
+
+    The tokens are counted by the upper bound of the fast estimation, so a batch
+    rarely exceeds the budget. A text over the budget is sent alone.
+
+    Args:
+        texts (Sequence[str]): texts to embed
+        model (str, optional): embedding model. Defaults to 'text-embedding-ada-002'.
+        max_tokens (int, optional): maximum number of tokens of a batch. Defaults to 8000.
+        max_inputs (int, optional): maximum number of texts of a batch. Defaults to 2048.
+
+    Yields:
+        Tuple[int, int]: start and end indexes of the batch
+    """
+    assert max_tokens > 0 and max_inputs > 0, "max_tokens and max_inputs must be greater than 0!"
+    start, ntokens = 0, 0
+    for ind, text in enumerate(texts):
+        size = estimate_tokens(text, model, bounds=True)[2]
+        if ind > start and (ntokens + size > max_tokens or ind - start >= max_inputs):
+            yield start, ind
+            start, ntokens = ind, 0
+        ntokens += size
+    if start < len(texts):
+        yield start, len(texts)
+
+def _new_output(path:Union[str, None], shape:Tuple[int, int]):
+    """Matrix of the embeddings, memory-mapped if the path is given"""
+    import numpy as np
+    if path is None:
+        return np.zeros(shape, dtype=np.float32)
+    from numpy.lib.format import open_memmap
+    return open_memmap(path, mode='w+', dtype=np.float32, shape=shape)
+
+def _resume_output(path:Union[str, None], finished:List[Dict], ntexts:int):
+    """Matrix of the embeddings of the finished batches, None if there is none"""
+    import numpy as np
+    if not finished:
+        return None
+    if path is None: # embeddings are kept in the checkpoint
+        matrix = _new_output(None, (ntexts, len(finished[0]['embedding'][0])))
+        for batch in finished:
+            matrix[batch['start']:batch['end']] = batch['embedding']
+        return matrix
+    from numpy.lib.format import open_memmap
+    matrix = open_memmap(path, mode='r+')
+    assert matrix.dtype == np.float32 and len(matrix) == ntexts, \
+        f"{path} has shape {matrix.shape} of {matrix.dtype}, expected {ntexts} rows of float32"
+    return matrix
+
+async def aembed( texts:Sequence[str]
+                , model:str='text-embedding-ada-002'
+                , api_key:Union[str, None]=None
+                , embed_url:Union[str, None]=None
+                , output:Union[str, None]=None
+                , chkpoint:Union[str, None]=None
+                , max_tokens:int=8000
+                , max_inputs:int=2048
+                , ncoroutines:int=1
+                , rate:Union[float, None]=None
+                , max_requests:int=1
+                , timeout:Union[int, Timeout]=0
+                , timeinterval:int=0
+                , **options):
+    """Embed the texts with concurrent batched requests
+
+    Args:
+        texts (Sequence[str]): texts to embed
+        model (str, optional): embedding model. Defaults to 'text-embedding-ada-002'.
+        api_key (Union[str, None], optional): API key. Defaults to None.
+        embed_url (Union[str, None], optional): embeddings url. Defaults to None(derived from `base_url`).
+        output (Union[str, None], optional): path of the `.npy` file to write the embeddings to by
+          memory mapping, for the runs larger than the memory. Defaults to None(in memory).
+        chkpoint (Union[str, None], optional): checkpoint file of the finished batches, which keeps the
+          embeddings too if `output` is not given. Defaults to None(no checkpoint).
+        max_tokens (int, optional): maximum number of tokens of a batch. Defaults to 8000.
+        max_inputs (int, optional): maximum number of texts of a batch. Defaults to 2048.
+        ncoroutines (int, optional): number of concurrent requests. Defaults to 1.
+        rate (Union[float, None], optional): maximum number of requests per minute. Defaults to None.
+        max_requests (int, optional): maximum number of requests to make. Defaults to 1.
+        timeout (Union[int, Timeout], optional): timeout in seconds or `Timeout`. Defaults to 0(no timeout).
+        timeinterval (int, optional): time interval between two API calls. Defaults to 0.
+        options (dict, optional): other options like `dimensions`.
+
+    Raises:
+        RuntimeError: some batches failed, the finished ones are kept in the checkpoint
+
+    Returns:
+        numpy.ndarray: float32 matrix of the embeddings in the input order, a `numpy.memmap` if
+          `output` is given
+    """
+    import numpy as np
+    assert ncoroutines > 0, "ncoroutines must be greater than 0!"
+    if api_key is None: api_key = openai_api_call.api_key
+    assert api_key is not None, "API key is not provided!"
+    if embed_url is None:
+        embed_url = os.path.join(openai_api_call.base_url, "v1/embeddings")
+    embed_url = openai_api_call.request.normalize_url(embed_url)
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": "Bearer " + api_key
+    }
+    # finished batches of the previous runs
+    finished = list(iter_jsonl(chkpoint)) if chkpoint is not None and os.path.exists(chkpoint) else []
+    done = {(batch['start'], batch['end']) for batch in finished}
+    # new matrix is allocated when the dimension is known
+    matrix = _resume_output(output, finished, len(texts))
+    batches = (batch for batch in pack_batches(texts, model, max_tokens, max_inputs)
+               if batch not in done)
+    limiter = RateLimiter(rate) if rate else None
+    sem, failed = asyncio.Semaphore(ncoroutines), []
+
+    async def worker(session):
+        nonlocal matrix
+        for start, end in batches: # shared by the workers
+            if limiter is not None: await limiter.acquire()
+            data = json.dumps({"model": model, "input": list(texts[start:end]), **options})
+            text = await async_post( session=session, sem=sem, url=embed_url, data=data
+                                   , headers=headers, max_requests=max_requests
+                                   , timeinterval=timeinterval, timeout=timeout)
+            try:
+                response = json.loads(text) if text is not None else {}
+            except json.JSONDecodeError: # e.g. the HTML page of a gateway error
+                warnings.warn(f"Invalid response: {text[:200]}")
+                response = {}
+            if 'data' not in response:
+                if 'error' in response: warnings.warn(f"Invalid response: {response['error']}")
+                failed.append((start, end))
+                continue
+            vectors = [None] * (end - start)
+            for item in response['data']: # the items may be out of order
+                vectors[item['index']] = item['embedding']
+            if matrix is None:
+                matrix = _new_output(output, (len(texts), len(vectors[0])))
+            matrix[start:end] = vectors
+            if chkpoint is not None:
+                if output is not None: matrix.flush() # save before marking it done
+                batch = {"start": start, "end": end}
+                if output is None: batch["embedding"] = vectors
+                with open(chkpoint, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(batch) + '\n')
+
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*[worker(session) for _ in range(ncoroutines)])
+    if failed:
+        raise RuntimeError(f"{len(failed)} batches failed, run again with the checkpoint to resume them")
+    if matrix is None: # no text
+        return np.zeros((len(texts), 0), dtype=np.float32)
+    if output is not None: matrix.flush()
+    return matrix
+
+def embed(texts:Sequence[str], **kwargs):
+    """Embed the texts with concurrent batched requests, see `aembed` for the arguments
+
+    Returns:
+        numpy.ndarray: float32 matrix of the embeddings in the input order
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError: # no running event loop
+        return asyncio.run(aembed(texts, **kwargs))
+    raise RuntimeError("`embed` can not be called inside a running event loop, " +
+                       "use `await aembed(...)` instead.")
@@ -0,0 +1,222 @@
+# Hedged requests to cut the tail latency
+
+import threading
+from typing import List, Union, Callable
+from .request import stats as request_stats
+
+class Hedge():
+    def __init__( self
+                , percentile:float=95
+                , delay:Union[float, None]=None
+                , min_delay:float=0.05
+                , min_samples:int=20
+                , max_ratio:float=0.1
+                , budget:Union[float, None]=None
+                , chat_urls:Union[List[str], None]=None
+                , stats=None):
+        """Policy of the hedged requests
+
+        A duplicate request is sent if the first one has no response(or no first chunk
+        when streaming) after the hedging delay, and the first to finish is taken.
+
+        Args:
+            percentile (float, optional): latency percentile used as the hedging delay. Defaults to 95.
+            delay (Union[float, None], optional): fixed hedging delay in seconds. Defaults to None(use
+              the latency percentile of `stats`).
+            min_delay (float, optional): lower bound of the hedging delay. Defaults to 0.05.
+            min_samples (int, optional): number of latencies recorded before hedging with the
+              percentile delay. Defaults to 20.
+            max_ratio (float, optional): maximum number of duplicates per request, which caps the
+              extra spend of hedging. Defaults to 0.1.
+            budget (Union[float, None], optional): maximum extra cost of the duplicates in dollars,
+              each duplicate is charged the cost of the response. The streamed responses have no
+              usage, so their duplicates are only capped by `max_ratio`. Defaults to None(no limit).
+            chat_urls (Union[List[str], None], optional): endpoints of the duplicates, used in turn.
+              Defaults to None(the endpoint of the first request).
+            stats (RequestStats, optional): latency metrics. Defaults to None(`request.stats`).
+        """
+        assert 0 <= percentile <= 100, "percentile should be in [0, 100]!"
+        assert max_ratio >= 0, "max_ratio should be non-negative!"
+        self.percentile, self.fixed_delay, self.min_delay = percentile, delay, min_delay
+        self.min_samples, self.max_ratio, self.budget = min_samples, max_ratio, budget
+        self.chat_urls = list(chat_urls) if chat_urls else []
+        self.stats = request_stats if stats is None else stats
+        self._lock = threading.Lock()
+        self.nrequests, self.nhedged, self.nwins, self.spent = 0, 0, 0, 0.0
+
+    def delay(self) -> Union[float, None]:
+        """Hedging delay in seconds, None if there is no latency to learn from"""
+        if self.fixed_delay is not None:
+            return self.fixed_delay
+        if len(self.stats.latencies) < self.min_samples:
+            return None
+        return max(self.min_delay, self.stats.percentile(self.percentile))
+
+    def acquire(self) -> bool:
+        """Whether a duplicate is allowed by the spend caps, reserve it if so"""
+        with self._lock:
+            if self.nhedged + 1 > self.max_ratio * self.nrequests:
+                return False
+            if self.budget is not None and self.spent >= self.budget:
+                return False
+            self.nhedged += 1
+            return True
+
+    def chat_url(self, chat_url:Union[str, None]) -> Union[str, None]:
+        """Endpoint of the next duplicate"""
+        if not self.chat_urls:
+            return chat_url
+        with self._lock:
+            return self.chat_urls[self.nhedged % len(self.chat_urls)]
+
+    def _start(self):
+        with self._lock:
+            self.nrequests += 1
+
+    def _finish(self, hedged:bool, won:bool, cost:float=0):
+        if not hedged: return
+        with self._lock:
+            self.nwins += won
+            self.spent += cost
+
+    def __repr__(self) -> str:
+        return f"<Hedge with {self.nhedged} duplicates of {self.nrequests} requests>"
+
+def _response_cost(response) -> float:
+    """Cost of the response, 0 if unknown"""
+    from .response import Resp
+    try:
+        return Resp(response).cost()
+    except Exception:
+        return 0
+
+def hedged_call( hedge:Hedge
+               , call:Callable
+               , chat_url:Union[str, None]=None):
+    """Call `call(chat_url)` in threads, with a duplicate after the hedging delay
+
+    The threads can not be cancelled, so the slower call finishes in the background.
+
+    Args:
+        hedge (Hedge): hedging policy
+        call (Callable): function that sends the request to the endpoint
+        chat_url (Union[str, None], optional): endpoint of the first request. Defaults to None.
+
+    Returns:
+        Dict: the first successful response
+    """
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+    hedge._start()
+    executor = ThreadPoolExecutor(max_workers=2)
+    try:
+        first = executor.submit(call, chat_url)
+        delay = hedge.delay()
+        if delay is None or wait([first], timeout=delay).done or not hedge.acquire():
+            return first.result()
+        second = executor.submit(call, hedge.chat_url(chat_url))
+        pending = {first, second}
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            succeeded = [future for future in done if future.exception() is None]
+            if succeeded or not pending:
+                future = (succeeded or list(done))[0]
+                response = future.result() # raise if both failed
+                hedge._finish(True, future is second, _response_cost(response))
+                return response
+    finally:
+        executor.shutdown(wait=False)
+
+async def ahedged_call( hedge:Hedge
+                      , call:Callable
+                      , chat_url:Union[str, None]=None):
+    """Await `call(chat_url)` with a duplicate after the hedging delay (asyncio version)
+
+    The slower request is cancelled once the other one succeeds.
+
+    Args:
+        hedge (Hedge): hedging policy
+        call (Callable): coroutine function that sends the request to the endpoint
+        chat_url (Union[str, None], optional): endpoint of the first request. Defaults to None.
+
+    Returns:
+        Dict: the first successful response
+    """
+    import asyncio
+    hedge._start()
+    first = asyncio.ensure_future(call(chat_url))
+    delay = hedge.delay()
+    if delay is not None:
+        await asyncio.wait([first], timeout=delay)
+    if delay is None or first.done() or not hedge.acquire():
+        return await first
+    second = asyncio.ensure_future(call(hedge.chat_url(chat_url)))
+    pending = {first, second}
+    try:
+        while True:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            succeeded = [task for task in done if task.exception() is None]
+            if succeeded or not pending:
+                task = (succeeded or list(done))[0]
+                response = task.result() # raise if both failed
+                hedge._finish(True, task is second, _response_cost(response))
+                return response
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+async def ahedged_stream( hedge:Hedge
+                        , stream:Callable
+                        , chat_url:Union[str, None]=None):
+    """Stream from `stream(chat_url)`, with a duplicate if the first chunk is late
+
+    The stream delivering the first chunk is kept and the other one is closed. The chunks
+    carry no usage, so nothing is added to `hedge.spent` and the `budget` of the hedge does
+    not apply to the streams.
+
+    Args:
+        hedge (Hedge): hedging policy
+        stream (Callable): function that returns the async iterator of the chunks
+        chat_url (Union[str, None], optional): endpoint of the first request. Defaults to None.
+
+    Yields:
+        Dict: chunk of the response
+    """
+    import asyncio
+    hedge._start()
+    streams = [stream(chat_url).__aiter__()]
+    tasks = {asyncio.ensure_future(streams[0].__anext__()): 0}
+    delay, winner, first = hedge.delay(), None, None
+    try:
+        if delay is not None:
+            await asyncio.wait(list(tasks), timeout=delay)
+        if delay is not None and not any(task.done() for task in tasks) and hedge.acquire():
+            streams.append(stream(hedge.chat_url(chat_url)).__aiter__())
+            tasks[asyncio.ensure_future(streams[1].__anext__())] = 1
+        pending = set(tasks)
+        while winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            succeeded = [task for task in done if task.exception() is None
+                         or isinstance(task.exception(), StopAsyncIteration)]
+            if succeeded or not pending:
+                task = (succeeded or list(done))[0]
+                error, winner = task.exception(), tasks[task]
+                if error is not None and not isinstance(error, StopAsyncIteration):
+                    raise error # all requests failed
+                first = None if error is not None else task.result()
+    finally:
+        cancelled = [task for task in tasks if not task.done()]
+        for task in cancelled:
+            task.cancel()
+        await asyncio.gather(*cancelled, return_exceptions=True)
+        for ind, iterator in enumerate(streams):
+            if ind != winner and hasattr(iterator, 'aclose'):
+                await iterator.aclose()
+    hedge._finish(len(streams) > 1, winner == 1)
+    if first is None: return # empty stream
+    try:
+        yield first
+        async for chunk in streams[winner]:
+            yield chunk
+    finally:
+        await streams[winner].aclose()
@@ -0,0 +1,177 @@
+# Multi-step chats of the items, run concurrently across the items
+
+import asyncio, aiohttp
+import json, os
+from typing import List, Dict, Union, Callable, Iterable, Any
+from .chattool import Chat
+from .asynctool import _post_chatlog, _resp_cost, _endpoint
+from .checkpoint import iter_jsonl
+from .deadline import Timeout, as_timeout
+from .ratelimit import RateLimiter
+
+class Step():
+    def __init__( self
+                , name:str
+                , prompt:Callable[[Any, Dict[str, Chat]], Union[str, List[Dict]]]
+                , after:Union[List[str], None]=None
+                , chat:Union[str, None]=None
+                , **options):
+        """Step of a pipeline
+
+        Args:
+            name (str): name of the step
+            prompt (Callable): function of the item and the chats of the finished steps, which
+              returns the message or the chat log to send
+            after (Union[List[str], None], optional): steps to wait for. Defaults to None(the
+              previous step of the pipeline), use `[]` to start with the item.
+            chat (Union[str, None], optional): step whose chat is continued by the message,
+              which is waited for too. Defaults to None(a new chat).
+            options (dict, optional): options of the request, like `temperature`, which
+              override those of the pipeline.
+        """
+        self.name, self.prompt, self.chat, self.options = name, prompt, chat, options
+        self.after = None if after is None else list(after)
+
+    def __repr__(self) -> str:
+        return f"<Step {self.name}>"
+
+def _resolve_steps(steps:List[Step]) -> Dict[str, List[str]]:
+    """Dependencies of the steps, which must be defined before them"""
+    depends = {}
+    for ind, step in enumerate(steps):
+        assert step.name not in depends, f"Duplicated step {step.name}!"
+        after = step.after
+        if after is None:
+            after = [steps[ind - 1].name] if ind > 0 else []
+        if step.chat is not None and step.chat not in after:
+            after = after + [step.chat]
+        for name in after:
+            assert name in depends, f"Step {step.name} depends on {name}, which is not defined before it!"
+        depends[step.name] = after
+    return depends
+
+def _load_steps(chkpoint:Union[str, None]) -> Dict[int, Dict[str, List[Dict]]]:
+    """Chat logs of the finished steps of each item in the checkpoint"""
+    finished = {}
+    if chkpoint is None or not os.path.exists(chkpoint):
+        return finished
+    for data in iter_jsonl(chkpoint):
+        finished.setdefault(data['chatid'], {})[data['step']] = data['chatlog']
+    return finished
+
+async def arun_pipeline( items:Iterable[Any]
+                       , steps:List[Step]
+                       , chkpoint:Union[str, None]=None
+                       , model:str='gpt-3.5-turbo'
+                       , api_key:Union[str, None]=None
+                       , chat_url:Union[str, None]=None
+                       , max_requests:int=1
+                       , ncoroutines:int=1
+                       , nitems:Union[int, None]=None
+                       , rate:Union[float, None]=None
+                       , timeout:Union[int, Timeout]=0
+                       , timeinterval:int=0
+                       , **options) -> List[Dict[str, Chat]]:
+    """Run the steps of a pipeline on each item
+
+    Each item runs through the steps as an independent coroutine, and the steps of an item
+    run as soon as the steps they wait for finish, so the steps of different items overlap.
+    All the requests share one concurrency limit, rate limit and deadline. Each finished step
+    is saved to the checkpoint, and skipped when the pipeline is run again.
+
+    Example:
+        steps = [ Step("draft", lambda item, chats: f"Write a poem about {item}")
+                , Step("critique", lambda item, chats: "Critique the poem", chat="draft")
+                , Step("revise", lambda item, chats: "Revise the poem by the critique", chat="critique")]
+        results = asyncio.run(arun_pipeline(["cats", "dogs"], steps, ncoroutines=10))
+
+    Args:
+        items (Iterable[Any]): items to process, numbered by their order
+        steps (List[Step]): steps of the pipeline, defined after the steps they wait for
+        chkpoint (Union[str, None], optional): checkpoint file of the finished steps.
+          Defaults to None(no checkpoint).
+        model (str, optional): model to use. Defaults to 'gpt-3.5-turbo'.
+        api_key (Union[str, None], optional): API key. Defaults to None.
+        chat_url (Union[str, None], optional): chat completion url. Defaults to None.
+        max_requests (int, optional): maximum number of requests to make. Defaults to 1.
+        ncoroutines (int, optional): number of concurrent requests. Defaults to 1.
+        nitems (Union[int, None], optional): number of items in progress. Defaults to None(twice
+          `ncoroutines`).
+        rate (Union[float, None], optional): maximum number of requests per minute. Defaults to None.
+        timeout (Union[int, Timeout], optional): timeout in seconds, or `Timeout` whose deadline
+          also stops the retries and the new requests. Defaults to 0(no timeout).
+        timeinterval (int, optional): time interval between two API calls. Defaults to 0.
+
+    Returns:
+        List[Dict[str, Chat]]: chats of the finished steps of each item, the steps failed or
+          waiting for a failed step are missing
+    """
+    assert ncoroutines > 0, "ncoroutines must be greater than 0!"
+    depends = _resolve_steps(steps)
+    api_key, chat_url = _endpoint(api_key, chat_url)
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": "Bearer " + api_key
+    }
+    options["model"] = model
+    timeout = as_timeout(timeout)
+    finished = _load_steps(chkpoint)
+    limiter = RateLimiter(rate) if rate else None
+    sem = asyncio.Semaphore(ncoroutines)
+    items, results = enumerate(items), []
+
+    async def run_step(session, chatid, item, step, chats, waits):
+        if not all(await asyncio.gather(*waits)): # some step failed
+            return False
+        chatlog = finished.get(chatid, {}).get(step.name)
+        if chatlog is None:
+            msg = step.prompt(item, chats)
+            if step.chat is None:
+                chatlog = Chat(msg).chat_log
+            else: # continue the chat
+                chatlog = chats[step.chat].chat_log + Chat(msg).chat_log
+            if limiter is not None: await limiter.acquire()
+            resp = await _post_chatlog( session, sem, chat_url, headers, chatlog
+                                      , max_requests, timeinterval, timeout
+                                      , {**options, **step.options})
+            if resp is None:
+                return False
+            chatlog = chatlog + [resp.message]
+            if chkpoint is not None:
+                with open(chkpoint, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps({ "chatid": chatid, "step": step.name, "chatlog": chatlog
+                                       , "usage": resp.usage, "cost": _resp_cost(resp)}
+                                       , ensure_ascii=False) + '\n')
+        chats[step.name] = Chat(chatlog)
+        return True
+
+    async def worker(session):
+        # workers share the iterator, `next` never runs concurrently in the event loop
+        for chatid, item in items:
+            chats, tasks = {}, {}
+            results.append(chats)
+            for step in steps: # steps are defined after those they wait for
+                waits = [tasks[name] for name in depends[step.name]]
+                tasks[step.name] = asyncio.ensure_future(
+                    run_step(session, chatid, item, step, chats, waits))
+            try:
+                await asyncio.gather(*tasks.values())
+            finally:
+                for task in tasks.values(): task.cancel()
+
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*[worker(session) for _ in range(nitems or 2 * ncoroutines)])
+    return results
+
+def run_pipeline(items:Iterable[Any], steps:List[Step], **kwargs) -> List[Dict[str, Chat]]:
+    """Run the steps of a pipeline on each item, see `arun_pipeline` for the arguments
+
+    Returns:
+        List[Dict[str, Chat]]: chats of the finished steps of each item
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError: # no running event loop
+        return asyncio.run(arun_pipeline(items, steps, **kwargs))
+    raise RuntimeError("`run_pipeline` can not be called inside a running event loop, " +
+                       "use `await arun_pipeline(...)` instead.")
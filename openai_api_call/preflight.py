@@ -0,0 +1,116 @@
+# Pre-flight estimation of the prompt tokens and the cost of a job
+
+import json, os
+from collections import deque
+from itertools import islice
+from typing import List, Dict, Union, Iterator, Tuple
+from .checkpoint import parse_chatlog
+from .context import ContextWindow
+from .tokencalc import num_tokens_from_messages, estimate_tokens_from_messages, \
+    model_cost_perktoken, token2cost
+
+def _iter_chunks(path:str, chunksize:int) -> Iterator[Tuple[int, List[str]]]:
+    """Raw lines of the file in chunks, with the index of the first line"""
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = (line for line in f if line.strip())
+        start = 0
+        while True:
+            chunk = list(islice(lines, chunksize))
+            if not chunk: return
+            yield start, chunk
+            start += len(chunk)
+
+def _bucket(ntokens:int) -> int:
+    """Upper bound of the histogram bucket, a power of 2"""
+    return 1 << max(ntokens - 1, 0).bit_length()
+
+def _count_chunk(args) -> Dict:
+    """Count the tokens of a chunk, run in the worker processes"""
+    start, lines, model, exact, limit = args
+    count = num_tokens_from_messages if exact else estimate_tokens_from_messages
+    total, largest, histogram, over_limit = 0, 0, {}, []
+    for ind, line in enumerate(lines, start):
+        chatid, chatlog = parse_chatlog(json.loads(line), ind)
+        ntokens = count(chatlog, model)
+        total += ntokens
+        largest = max(largest, ntokens)
+        bucket = _bucket(ntokens)
+        histogram[bucket] = histogram.get(bucket, 0) + 1
+        if limit is not None and ntokens > limit:
+            over_limit.append(chatid)
+    return { "nchats": len(lines), "prompt_tokens": total, "max_tokens": largest
+           , "histogram": histogram, "over_limit": over_limit}
+
+def preflight_report( path:str
+                    , model:str='gpt-3.5-turbo'
+                    , completion_tokens:int=0
+                    , exact:bool=True
+                    , nprocs:Union[int, None]=None
+                    , chunksize:int=1000
+                    , context_window:Union[ContextWindow, None]=None) -> Dict:
+    """Estimate the prompt tokens and the cost of the chats in a JSONL file before a job
+
+    The file is read in chunks of raw lines, which are parsed and counted in a process
+    pool, so neither the file nor the token counts are kept in memory.
+
+    Args:
+        path (str): path to the input file, see `iter_chatlogs` for the format
+        model (str, optional): model to use. Defaults to 'gpt-3.5-turbo'.
+        completion_tokens (int, optional): expected completion tokens of each chat, e.g. `max_tokens`.
+          Defaults to 0.
+        exact (bool, optional): whether to count the tokens exactly by tiktoken, otherwise use the
+          fast estimation. Defaults to True.
+        nprocs (Union[int, None], optional): number of processes, 1 to count in this process.
+          Defaults to None(the number of CPUs).
+        chunksize (int, optional): number of lines sent to a process at once. Defaults to 1000.
+        context_window (Union[ContextWindow, None], optional): context window to check the chats
+          against. Defaults to None(the context window of the model).
+
+    Returns:
+        Dict: number of chats, prompt and completion tokens, the largest prompt, histogram of the
+          prompt sizes by the power-of-2 upper bound, projected cost(None if the price is not known),
+          context window and the ids of the chats over it
+    """
+    assert chunksize > 0, "chunksize must be greater than 0!"
+    if context_window is None: context_window = ContextWindow()
+    try:
+        window = context_window.window_size(model)
+    except ValueError:
+        window = None
+    limit = None if window is None else window - completion_tokens
+    tasks = ((start, lines, model, exact, limit)
+             for start, lines in _iter_chunks(path, chunksize))
+    if nprocs is None: nprocs = os.cpu_count() or 1
+    report = { "nchats": 0, "prompt_tokens": 0, "completion_tokens": 0, "max_tokens": 0
+             , "histogram": {}, "cost": None, "context_window": window, "over_limit": []}
+    if nprocs == 1:
+        _merge_counts(report, map(_count_chunk, tasks))
+    else:
+        from multiprocessing import Pool
+        with Pool(nprocs) as pool:
+            _merge_counts(report, _bounded_map(pool, _count_chunk, tasks, 2 * nprocs))
+    report["histogram"] = dict(sorted(report["histogram"].items()))
+    report["completion_tokens"] = completion_tokens * report["nchats"]
+    if model in model_cost_perktoken:
+        report["cost"] = token2cost(model, report["prompt_tokens"], report["completion_tokens"])
+    return report
+
+def _bounded_map(pool, func, tasks, maxsize:int):
+    """`pool.imap` reading at most `maxsize` tasks ahead, which `imap` does not limit"""
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.apply_async(func, (task,)))
+        if len(pending) >= maxsize:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+def _merge_counts(report:Dict, counts:Iterator[Dict]):
+    """Merge the counts of the chunks into the report, in the order of the file"""
+    for count in counts:
+        report["nchats"] += count["nchats"]
+        report["prompt_tokens"] += count["prompt_tokens"]
+        report["max_tokens"] = max(report["max_tokens"], count["max_tokens"])
+        for bucket, nchats in count["histogram"].items():
+            report["histogram"][bucket] = report["histogram"].get(bucket, 0) + nchats
+        report["over_limit"].extend(count["over_limit"])
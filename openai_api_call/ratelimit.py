@@ -0,0 +1,41 @@
+# Rate limiter for the asynchronous requests
+
+import asyncio, time
+
+class RateLimiter():
+    def __init__(self, rate:float, burst:int=1):
+        """Token bucket rate limiter
+
+        Args:
+            rate (float): maximum number of requests per minute
+            burst (int, optional): maximum number of requests sent at once. Defaults to 1.
+        """
+        assert rate > 0, "rate must be greater than 0!"
+        assert burst >= 1, "burst must be at least 1!"
+        self.rate, self.burst = rate, burst
+        self._tokens, self._updated = float(burst), time.monotonic()
+        self._lock = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate / 60)
+        self._updated = now
+
+    async def acquire(self, tokens:float=1):
+        """Wait until the request is allowed
+
+        Args:
+            tokens (float, optional): weight of the request. Defaults to 1.
+        """
+        tokens = min(tokens, self.burst)
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock: # first come, first served
+            self._refill()
+            while self._tokens < tokens:
+                await asyncio.sleep((tokens - self._tokens) * 60 / self.rate)
+                self._refill()
+            self._tokens -= tokens
+
+    def __repr__(self) -> str:
+        return f"<RateLimiter with {self.rate} requests per minute>"
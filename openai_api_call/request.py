@@ -1,9 +1,138 @@
 # rewrite the request function
 
 from typing import List, Dict, Union
-import requests, json, os
+import json, os, time, threading
+from collections import deque
+from contextlib import contextmanager
 from urllib.parse import urlparse, urlunparse
 import openai_api_call
+from .deadline import Timeout, as_timeout
+# `requests` and `aiohttp` are imported on first use to keep the package import fast
+
+class RequestStats():
+    """Request metrics shared by the sync and async paths"""
+
+    def __init__(self, maxlen:int=1000):
+        self._lock = threading.Lock()
+        self._maxlen = maxlen
+        self.reset()
+
+    def reset(self):
+        """Reset the metrics"""
+        with self._lock:
+            self.nrequests, self.nfailures = 0, 0
+            self.latencies = deque(maxlen=self._maxlen)
+
+    def record(self, latency:float, success:bool=True):
+        """Record a finished request
+
+        Args:
+            latency (float): time elapsed in seconds
+            success (bool, optional): whether the request succeeded. Defaults to True.
+        """
+        with self._lock:
+            self.nrequests += 1
+            if success:
+                self.latencies.append(latency)
+            else:
+                self.nfailures += 1
+
+    def percentile(self, q:float) -> Union[float, None]:
+        """Latency percentile of the successful requests
+
+        Args:
+            q (float): percentile in [0, 100]
+
+        Returns:
+            Union[float, None]: latency in seconds, None if no request is recorded
+        """
+        with self._lock:
+            latencies = sorted(self.latencies)
+        if not latencies: return None
+        ind = min(len(latencies) - 1, int(len(latencies) * q / 100))
+        return latencies[ind]
+
+    def __repr__(self) -> str:
+        return f"<RequestStats with {self.nrequests} requests, {self.nfailures} failures>"
+
+# metrics of all requests made by the package
+stats = RequestStats()
+
+# transport to record or replay the requests, see `transport.record` and `transport.replay`
+transport = None
+
+def sync_session(session):
+    """Session of the sync requests, wrapped by the transport if any"""
+    return session if transport is None else transport.wrap(session)
+
+def async_session(session):
+    """Session of the async requests, wrapped by the transport if any"""
+    return session if transport is None else transport.awrap(session)
+
+# shared scheduler of the requests, see `scheduler.Scheduler`
+scheduler = None
+
+@contextmanager
+def sync_slot(priority:str='interactive'):
+    """Slot of the scheduler held by a sync request, if any"""
+    if scheduler is None:
+        yield
+    else:
+        with scheduler.slot(priority):
+            yield
+
+class async_slot():
+    """Slot of the scheduler held by an async request, if any"""
+    def __init__(self, priority:str='interactive'):
+        self._slot = None if scheduler is None else scheduler.aslot(priority)
+
+    async def __aenter__(self):
+        if self._slot is not None: await self._slot.__aenter__()
+        return self
+
+    async def __aexit__(self, *args):
+        if self._slot is not None: await self._slot.__aexit__(*args)
+        return False
+
+# pooled session for the sync path
+_session, _session_lock = None, threading.Lock()
+
+def get_session():
+    """Get the pooled session(`requests.Session`) of the sync requests"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                _session = requests.Session()
+    return _session
+
+# pooled sessions for the async path, one per event loop
+_asessions = {}
+
+async def _asession_closer(loop, session):
+    """Close the session when the loop shuts down its async generators, e.g. at the end of `asyncio.run`"""
+    try:
+        yield
+    finally:
+        if loop in _asessions and _asessions[loop][0] is session:
+            del _asessions[loop]
+        await session.close()
+
+async def get_asession():
+    """Get the pooled session(`aiohttp.ClientSession`) of the async requests
+
+    A session is bound to its event loop, so each loop has its own, which is closed
+    when the loop shuts down, like at the end of `asyncio.run`.
+    """
+    import asyncio, aiohttp
+    loop = asyncio.get_running_loop()
+    if loop not in _asessions or _asessions[loop][0].closed:
+        session = aiohttp.ClientSession()
+        closer = _asession_closer(loop, session)
+        await closer.__anext__() # registered to the loop, and referenced here to stay alive
+        _asessions[loop] = (session, closer)
+    return _asessions[loop][0]
 
 def is_valid_url(url: str) -> bool:
     """Check if the given URL is valid.
@@ -44,7 +173,8 @@ def chat_completion( api_key:str
                    , messages:List[Dict]
                    , model:str
                    , chat_url:Union[str, None]=None
-                   , timeout:int = 0
+                   , timeout:Union[int, Timeout] = 0
+                   , session=None
                    , **options) -> Dict:
     """Chat completion API call
     
@@ -53,11 +183,37 @@ def chat_completion( api_key:str
         messages (List[Dict]): prompt message
         model (str): model to use
         chat_url (Union[str, None], optional): chat url. Defaults to None.
+        timeout (Union[int, Timeout], optional): timeout in seconds or `Timeout`. Defaults to 0(no timeout).
+        session (requests.Session, optional): session to use. Defaults to None(the pooled session).
         **options : options inherited from the `openai.ChatCompletion.create` function.
     
     Returns:
         Dict: API response
     """
+    chat_url, headers, data = _prepare_request(api_key, messages, model, chat_url, **options)
+    # get response
+    timeout = as_timeout(timeout).requests(options.get('max_tokens'))
+    if session is None: session = get_session()
+    with sync_slot('interactive'): # the waiting time is not recorded
+        start = time.time()
+        try:
+            response = sync_session(session).post(
+                chat_url, headers=headers, data=data, timeout=timeout)
+            if response.status_code != 200:
+                raise Exception(response.text)
+            response = response.json()
+        except Exception:
+            stats.record(time.time() - start, success=False)
+            raise
+    stats.record(time.time() - start)
+    return response
+
+def _prepare_request( api_key:str
+                    , messages:List[Dict]
+                    , model:str
+                    , chat_url:Union[str, None]=None
+                    , **options):
+    """Prepare the url, headers and data of the chat completion request"""
     # request data
     payload = {
         "model": model,
@@ -74,19 +230,106 @@ def chat_completion( api_key:str
     if chat_url is None:
         base_url = openai_api_call.base_url
         chat_url = os.path.join(base_url, "v1/chat/completions")
-    
     chat_url = normalize_url(chat_url)
-    # get response
-    if timeout <= 0: timeout = None
-    response = requests.post(
-        chat_url, headers=headers, 
-        data=json.dumps(payload), timeout=timeout)
+    return chat_url, headers, json.dumps(payload)
 
-    if response.status_code != 200:
-        raise Exception(response.text)
-    return response.json()
+async def achat_completion( api_key:str
+                          , messages:List[Dict]
+                          , model:str
+                          , chat_url:Union[str, None]=None
+                          , timeout:Union[int, Timeout] = 0
+                          , session=None
+                          , proxy:Union[str, None]=None
+                          , **options) -> Dict:
+    """Chat completion API call (asyncio version)
+
+    Args:
+        api_key (str): API key
+        messages (List[Dict]): prompt message
+        model (str): model to use
+        chat_url (Union[str, None], optional): chat url. Defaults to None.
+        timeout (Union[int, Timeout], optional): timeout in seconds or `Timeout`. Defaults to 0(no timeout).
+        session (aiohttp.ClientSession, optional): session to use. Defaults to None(the pooled session).
+        proxy (Union[str, None], optional): proxy of the request. Defaults to None.
+        **options : options inherited from the `openai.ChatCompletion.create` function.
+
+    Returns:
+        Dict: API response
+    """
+    chat_url, headers, data = _prepare_request(api_key, messages, model, chat_url, **options)
+    timeout = as_timeout(timeout).aiohttp(options.get('max_tokens'))
+    if session is None: session = await get_asession()
+    return await _apost(session, chat_url, headers, data, timeout, proxy)
+
+async def _apost(session, url, headers, data, timeout, proxy=None):
+    """Post the request and record the metrics"""
+    async with async_slot('interactive'):
+        start = time.time()
+        try:
+            async with async_session(session).post( url, headers=headers, data=data
+                                   , timeout=timeout, proxy=proxy) as response:
+                text = await response.text()
+                if response.status != 200:
+                    raise Exception(text)
+            response = json.loads(text)
+        except Exception:
+            stats.record(time.time() - start, success=False)
+            raise
+    stats.record(time.time() - start)
+    return response
+
+async def astream_completion( api_key:str
+                            , messages:List[Dict]
+                            , model:str
+                            , chat_url:Union[str, None]=None
+                            , timeout:Union[int, Timeout] = 0
+                            , session=None
+                            , proxy:Union[str, None]=None
+                            , **options):
+    """Stream the chat completion chunks (asyncio version)
+
+    Args:
+        api_key (str): API key
+        messages (List[Dict]): prompt message
+        model (str): model to use
+        chat_url (Union[str, None], optional): chat url. Defaults to None.
+        timeout (Union[int, Timeout], optional): timeout in seconds or `Timeout`. Defaults to 0(no timeout).
+        session (aiohttp.ClientSession, optional): session to use. Defaults to None(the pooled session).
+        proxy (Union[str, None], optional): proxy of the request. Defaults to None.
+
+    Yields:
+        Dict: chunk of the response
+    """
+    chat_url, headers, data = _prepare_request(
+        api_key, messages, model, chat_url, stream=True, **options)
+    timeout = as_timeout(timeout).aiohttp(options.get('max_tokens'), stream=True)
+    if session is None: session = await get_asession()
+    async with async_slot('interactive'): # held until the stream ends
+        start, success = time.time(), True
+        try:
+            async with async_session(session).post( chat_url, headers=headers, data=data
+                                   , timeout=timeout, proxy=proxy) as response:
+                if response.status != 200:
+                    raise Exception(await response.text())
+                while True:
+                    line = await response.content.readline()
+                    if not line: break
+                    strline = line.decode().strip()
+                    if strline.startswith('data:'):
+                        strline = strline[len('data:'):].strip()
+                    if not strline: continue
+                    if strline == '[DONE]': break
+                    yield json.loads(strline)
+        except Exception:
+            success = False
+            raise
+        finally: # recorded also when the consumer stops early
+            stats.record(time.time() - start, success=success)
 
-def valid_models(api_key:str, gpt_only:bool=True, base_url:Union[str, None]=None):
+def valid_models( api_key:str
+                , gpt_only:bool=True
+                , base_url:Union[str, None]=None
+                , session=None):
     """Get valid models
     Request url: https://api.openai.com/v1/models
 
@@ -94,6 +337,7 @@ def valid_models(api_key:str, gpt_only:bool=True, base_url:Union[str, None]=None
         api_key (str): API key
         gpt_only (bool, optional): whether to return only GPT models. Defaults to True.
         url (Union[str, None], optional): base url. Defaults to None.
+        session (requests.Session, optional): session to use. Defaults to None(the pooled session).
 
     Returns:
         List[str]: list of valid models
@@ -104,7 +348,8 @@ def valid_models(api_key:str, gpt_only:bool=True, base_url:Union[str, None]=None
     }
     if base_url is None: base_url = openai_api_call.base_url
     models_url = normalize_url(os.path.join(base_url, "v1/models"))
-    models_response = requests.get(models_url, headers=headers)
+    if session is None: session = get_session()
+    models_response = sync_session(session).get(models_url, headers=headers)
     if models_response.status_code == 200:
         data = models_response.json()
         model_list = [model.get("id") for model in data.get("data")]
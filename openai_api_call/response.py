@@ -5,16 +5,26 @@ from .tokencalc import token2cost
 
 class Resp():
     
-    def __init__(self, response:Dict) -> None:
+    def __init__(self, response:Dict, index:int=0) -> None:
+        """Response of the API call
+
+        Args:
+            response (Dict): response data
+            index (int, optional): index of the choice used by `message`, `content`, etc. Defaults to 0.
+        """
         self.response = response
+        self.index = index
+        self.cached = False # returned by a cache without a request
+        self.share = 1 # fraction of the usage charged to this response, see `split`
     
     def is_valid(self):
         """Check if the response is an error"""
         return 'error' not in self.response
     
     def cost(self):
-        """Calculate the cost of the response"""
-        return token2cost(self.model, self.prompt_tokens, self.completion_tokens)
+        """Calculate the cost of the response, 0 if it is cached"""
+        if self.cached: return 0
+        return self.share * token2cost(self.model, self.prompt_tokens, self.completion_tokens, self.cached_tokens)
     
     def __repr__(self) -> str:
         return "<Resp with finished reason: " + self.finish_reason + ">"
@@ -49,25 +59,62 @@ class Resp():
         """Number of tokens in the prompt"""
         return self.usage['prompt_tokens']
     
+    @property
+    def cached_tokens(self):
+        """Number of prompt tokens read from the prompt cache"""
+        details = self.usage.get('prompt_tokens_details') or {}
+        return details.get('cached_tokens') or 0
+
     @property
     def completion_tokens(self):
         """Number of tokens of the response"""
         return self.usage['completion_tokens']
     
+    @property
+    def choices(self):
+        """All choices of the response"""
+        return self.response['choices']
+
+    @property
+    def n(self):
+        """Number of choices"""
+        return len(self.choices)
+
+    @property
+    def contents(self):
+        """Contents of all choices"""
+        return [choice['message']['content'] for choice in self.choices]
+
+    def split(self):
+        """Split the response into one Resp for each choice
+
+        The choices keep the usage of the whole response, e.g. `prompt_tokens`, while
+        `cost` charges each of them an equal share, so the costs add up to the total.
+        """
+        resps = [Resp(self.response, index=ind) for ind in range(self.n)]
+        for resp in resps:
+            resp.cached, resp.share = self.cached, self.share / len(resps)
+        return resps
+
     @property
     def message(self):
         """Message"""
-        return self.response['choices'][0]['message']
+        return self.choices[self.index]['message']
     
     @property
     def content(self):
         """Content of the response"""
         return self.message['content']
     
+    @property
+    def tool_calls(self):
+        """Tool calls of the response, empty if none"""
+        return self.message.get('tool_calls') or []
+
     @property
     def delta_content(self):
         """Content of stream response"""
-        return self.response['choices'][0]['delta']['content']
+        return self.choices[self.index]['delta'].get('content')
     
     @property
     def object(self):
@@ -101,4 +148,4 @@ class Resp():
     @property
     def finish_reason(self):
         """Finish reason"""
-        return self.response['choices'][0]['finish_reason']
+        return self.choices[self.index]['finish_reason']
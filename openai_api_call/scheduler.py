@@ -0,0 +1,199 @@
+# Shared scheduler of the requests, with priority classes and fair queuing of the tenants
+
+import asyncio, heapq, itertools, threading, time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Dict, Union
+from .request import RequestStats
+
+# tenant and priority of the requests made in the context, see `tenant`
+_current = ContextVar("openai_api_call_scheduler", default=(None, None))
+
+@contextmanager
+def tenant(name:Union[str, None]=None, priority:Union[str, None]=None):
+    """Tenant and priority class of the requests made in the context
+
+    Example:
+        with tenant("alice", priority="batch"):
+            chat.getresponse()
+
+    Args:
+        name (Union[str, None], optional): tenant of the requests. Defaults to None(unchanged).
+        priority (Union[str, None], optional): priority class of the requests. Defaults to
+          None(unchanged, 'interactive' for the chats and 'batch' for the batch functions).
+    """
+    old = _current.get()
+    token = _current.set((name or old[0], priority or old[1]))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+class _Waiter():
+    __slots__ = ("wake", "granted", "cancelled")
+
+    def __init__(self, wake):
+        self.wake, self.granted, self.cancelled = wake, False, False
+
+class Scheduler():
+    def __init__( self
+                , concurrency:int=8
+                , rate:Union[float, None]=None
+                , classes:List[str]=('interactive', 'batch')
+                , weights:Union[Dict[str, float], None]=None):
+        """Scheduler of the requests shared by the threads and the event loops of the process
+
+        A request waits for one of the `concurrency` slots. The free slot goes to the waiting
+        request of the highest priority class, so the interactive requests always go ahead of
+        the batch work. Within a class, the tenants share the slots by weighted fair queuing.
+        Set `openai_api_call.request.scheduler` to use it for all requests.
+
+        Args:
+            concurrency (int, optional): maximum number of requests in flight. Defaults to 8.
+            rate (Union[float, None], optional): maximum number of requests per minute.
+              Defaults to None(no limit).
+            classes (List[str], optional): priority classes from the highest, which should contain
+              'interactive' and 'batch' used by the package. Defaults to ('interactive', 'batch').
+            weights (Union[Dict[str, float], None], optional): weights of the tenants, a tenant gets
+              the slots in proportion to its weight. Defaults to None(1 for each tenant).
+        """
+        assert concurrency > 0, "concurrency must be greater than 0!"
+        assert rate is None or rate > 0, "rate must be greater than 0!"
+        assert 'interactive' in classes and 'batch' in classes, \
+            "classes should contain 'interactive' and 'batch'"
+        self.concurrency, self.rate, self.classes = concurrency, rate, list(classes)
+        self.weights = dict(weights or {})
+        self._lock = threading.Lock()
+        self._free, self._seq = concurrency, itertools.count()
+        # per class: queue of (finish tag, seq, waiter), virtual time, finish tag of each tenant
+        self._queues = [[] for _ in self.classes]
+        self._vtime = [0.0] * len(self.classes)
+        self._finish = [{} for _ in self.classes]
+        self._tokens, self._updated, self._timer = 1.0, time.monotonic(), None
+        self.waits = {name: RequestStats() for name in self.classes} # waiting time of each class
+
+    def _enqueue(self, priority:str, tenant:str, cost:float, wake) -> _Waiter:
+        if priority not in self.classes:
+            raise ValueError(f"Unknown priority class {priority}, should be one of {self.classes}")
+        level, waiter = self.classes.index(priority), _Waiter(wake)
+        with self._lock:
+            # start of the tenant is the later of the virtual time and its last finish
+            start = max(self._vtime[level], self._finish[level].get(tenant, 0))
+            finish = start + cost / self.weights.get(tenant, 1)
+            self._finish[level][tenant] = finish
+            heapq.heappush(self._queues[level], (finish, next(self._seq), waiter))
+        self._dispatch()
+        return waiter
+
+    def _refill(self) -> bool:
+        """Whether a request is allowed by the rate, called with the lock"""
+        if self.rate is None:
+            return True
+        now = time.monotonic()
+        self._tokens = min(1.0, self._tokens + (now - self._updated) * self.rate / 60)
+        self._updated = now
+        if self._tokens >= 1:
+            return True
+        if self._timer is None: # dispatch again when a token is available
+            self._timer = threading.Timer((1 - self._tokens) * 60 / self.rate, self._on_timer)
+            self._timer.daemon = True
+            self._timer.start()
+        return False
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+        self._dispatch()
+
+    def _dispatch(self):
+        """Grant the free slots to the waiters, by the class and then the finish tag"""
+        wakes = []
+        with self._lock:
+            while self._free > 0:
+                level = next((level for level, queue in enumerate(self._queues) if queue), None)
+                if level is None: break
+                finish, _, waiter = self._queues[level][0]
+                if waiter.cancelled:
+                    heapq.heappop(self._queues[level])
+                    continue
+                if not self._refill(): break
+                heapq.heappop(self._queues[level])
+                self._vtime[level] = max(self._vtime[level], finish)
+                if self.rate is not None: self._tokens -= 1
+                self._free -= 1
+                waiter.granted = True
+                wakes.append(waiter.wake)
+        for wake in wakes:
+            wake()
+
+    def _release(self):
+        with self._lock:
+            self._free += 1
+        self._dispatch()
+
+    def _context(self, priority:str) -> tuple:
+        """Tenant and priority of the request, the context overrides the default priority"""
+        name, context_priority = _current.get()
+        return name or "default", context_priority or priority
+
+    @contextmanager
+    def slot(self, priority:str='interactive', cost:float=1):
+        """Wait for a slot in the thread, held in the context
+
+        Args:
+            priority (str, optional): default priority class. Defaults to 'interactive'.
+            cost (float, optional): cost of the request in the fair queuing. Defaults to 1.
+        """
+        name, priority = self._context(priority)
+        event, start = threading.Event(), time.time()
+        self._enqueue(priority, name, cost, event.set)
+        event.wait()
+        self.waits[priority].record(time.time() - start)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def aslot(self, priority:str='batch', cost:float=1) -> "_AsyncSlot":
+        """Wait for a slot in the event loop, used by `async with`, see `slot`"""
+        return _AsyncSlot(self, priority, cost)
+
+    @property
+    def nwaiting(self) -> int:
+        """Number of the waiting requests"""
+        with self._lock:
+            return sum(1 for queue in self._queues for _, _, waiter in queue if not waiter.cancelled)
+
+    @property
+    def nrunning(self) -> int:
+        """Number of the requests in flight"""
+        return self.concurrency - self._free
+
+    def __repr__(self) -> str:
+        return f"<Scheduler with {self.nrunning}/{self.concurrency} slots in use, {self.nwaiting} waiting>"
+
+class _AsyncSlot():
+    def __init__(self, scheduler:Scheduler, priority:str, cost:float):
+        self._scheduler, self._priority, self._cost = scheduler, priority, cost
+
+    async def __aenter__(self):
+        scheduler = self._scheduler
+        name, priority = scheduler._context(self._priority)
+        loop, start = asyncio.get_running_loop(), time.time()
+        future = loop.create_future()
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+        waiter = scheduler._enqueue(priority, name, self._cost, wake)
+        try:
+            await future
+        except asyncio.CancelledError:
+            with scheduler._lock:
+                granted, waiter.cancelled = waiter.granted, True
+            if granted: scheduler._release()
+            raise
+        scheduler.waits[priority].record(time.time() - start)
+        return self
+
+    async def __aexit__(self, *args):
+        self._scheduler._release()
+        return False
@@ -0,0 +1,189 @@
+# Semantic cache of the responses, keyed by the embedding similarity of the prompts
+
+import hashlib, json, threading, time
+from typing import List, Dict, Union, Callable, Tuple
+from .request import RequestStats
+from .response import Resp
+
+class BruteForceIndex():
+    def __init__(self):
+        """Exact nearest neighbor search over the normalized vectors by NumPy"""
+        self._matrix, self.size = None, 0
+
+    def add(self, vector):
+        """Add a normalized vector, its id is the order of addition"""
+        import numpy as np
+        if self._matrix is None:
+            self._matrix = np.zeros((16, len(vector)), dtype=np.float32)
+        elif self.size == len(self._matrix): # grow by doubling
+            self._matrix = np.concatenate([self._matrix, np.zeros_like(self._matrix)])
+        self._matrix[self.size] = vector
+        self.size += 1
+
+    def search(self, vector) -> Tuple[int, float]:
+        """Id and cosine similarity of the nearest vector, (-1, -1) if empty"""
+        if self.size == 0:
+            return -1, -1.
+        scores = self._matrix[:self.size] @ vector
+        ind = int(scores.argmax())
+        return ind, float(scores[ind])
+
+class FaissIndex():
+    def __init__(self, hnsw:int=32):
+        """Approximate nearest neighbor search by faiss(optional dependency)
+
+        Args:
+            hnsw (int, optional): number of neighbors of the HNSW graph, 0 for the exact
+              flat index. Defaults to 32.
+        """
+        import faiss # raise ImportError if not installed
+        self._faiss, self._hnsw, self._index, self.size = faiss, hnsw, None, 0
+
+    def add(self, vector):
+        if self._index is None:
+            dim, faiss = len(vector), self._faiss
+            self._index = faiss.IndexHNSWFlat(dim, self._hnsw, faiss.METRIC_INNER_PRODUCT) \
+                if self._hnsw else faiss.IndexFlatIP(dim)
+        self._index.add(vector.reshape(1, -1))
+        self.size += 1
+
+    def search(self, vector) -> Tuple[int, float]:
+        if self.size == 0:
+            return -1, -1.
+        scores, inds = self._index.search(vector.reshape(1, -1), 1)
+        return int(inds[0][0]), float(scores[0][0])
+
+def _default_embed(texts:List[str], **kwargs):
+    from .embedding import embed
+    return embed(texts, **kwargs)
+
+class SemanticCache():
+    def __init__( self
+                , threshold:float=0.95
+                , embed:Union[Callable[[List[str]], "numpy.ndarray"], None]=None
+                , index:Union[Callable[[], object], None]=None
+                , **embed_options):
+        """Cache of the responses, hit by the prompts similar to an earlier one
+
+        The last user message is embedded and searched among the earlier prompts with the
+        same context, i.e. the same messages before it, such as the system prompt, the same
+        model and the same request options, like `tools` and `response_format`. The cached
+        responses are returned with `cached` set, and cost nothing.
+
+        Args:
+            threshold (float, optional): minimum cosine similarity of a hit. Defaults to 0.95.
+            embed (Callable, optional): function to embed a list of texts into a matrix.
+              Defaults to None(`embed` of the embeddings API, with `embed_options`).
+            index (Callable, optional): factory of the vector index of each context, e.g.
+              `FaissIndex` for the approximate search. Defaults to None(`BruteForceIndex`).
+            embed_options (dict, optional): options of the default `embed`, like `api_key`.
+        """
+        assert -1 <= threshold <= 1, "threshold should be in [-1, 1]!"
+        self.threshold = threshold
+        self._embed = embed or (lambda texts: _default_embed(texts, **embed_options))
+        self._new_index = index or BruteForceIndex
+        self._indexes, self._resps, self._pending = {}, {}, {}
+        self._lock = threading.Lock()
+        self.nhits, self.nmisses = 0, 0
+        self.latency = RequestStats() # latency of the lookups
+
+    @staticmethod
+    def split( messages:List[Dict]
+             , model:Union[str, None]=None
+             , options:Union[Dict, None]=None) -> Union[Tuple[str, str], None]:
+        """Hash of the context and the text of the last user message, None if not cacheable
+
+        Args:
+            messages (List[Dict]): chat log
+            model (Union[str, None], optional): model of the request. Defaults to None.
+            options (Union[Dict, None], optional): options of the request, which are part of
+              the context except `user`. Defaults to None.
+        """
+        if not messages or messages[-1].get('role') != 'user':
+            return None
+        options = {key: value for key, value in (options or {}).items() if key != 'user'}
+        context = json.dumps([model, options, messages[:-1]], sort_keys=True, default=str).encode()
+        return hashlib.sha1(context).hexdigest(), str(messages[-1]['content'])
+
+    def _vector(self, text:str):
+        import numpy as np
+        vector = np.asarray(self._embed([text])[0], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def lookup( self
+              , messages:List[Dict]
+              , model:Union[str, None]=None
+              , options:Union[Dict, None]=None) -> Union[Resp, None]:
+        """Cached response of a similar prompt, None if missed
+
+        Args:
+            messages (List[Dict]): chat log to send
+            model (Union[str, None], optional): model of the request. Defaults to None.
+            options (Union[Dict, None], optional): options of the request. Defaults to None.
+
+        Returns:
+            Union[Resp, None]: cached response, with `cached` set
+        """
+        key = self.split(messages, model, options)
+        if key is None:
+            return None
+        start = time.time()
+        context, text = key
+        vector = self._vector(text)
+        with self._lock:
+            index = self._indexes.get(context)
+            ind, score = index.search(vector) if index is not None else (-1, -1.)
+            hit = ind >= 0 and score >= self.threshold
+            if hit:
+                self.nhits += 1
+            else:
+                self.nmisses += 1
+                if len(self._pending) >= 1024: # drop the prompts never stored
+                    self._pending.clear()
+                self._pending[key] = vector # reused by `store`
+        self.latency.record(time.time() - start)
+        if not hit:
+            return None
+        cached = self._resps[context][ind]
+        resp = Resp(cached.response, cached.index)
+        resp.cached = True # no request is made, so no cost
+        return resp
+
+    def store( self
+             , messages:List[Dict]
+             , resp:Resp
+             , model:Union[str, None]=None
+             , options:Union[Dict, None]=None):
+        """Store the response of the prompt
+
+        Args:
+            messages (List[Dict]): chat log sent
+            resp (Resp): response of the chat log
+            model (Union[str, None], optional): model of the request. Defaults to None.
+            options (Union[Dict, None], optional): options of the request. Defaults to None.
+        """
+        key = self.split(messages, model, options)
+        if key is None:
+            return
+        with self._lock:
+            vector = self._pending.pop(key, None)
+        if vector is None:
+            vector = self._vector(key[1])
+        with self._lock:
+            if key[0] not in self._indexes:
+                self._indexes[key[0]], self._resps[key[0]] = self._new_index(), []
+            self._indexes[key[0]].add(vector)
+            self._resps[key[0]].append(resp)
+
+    @property
+    def hit_rate(self) -> Union[float, None]:
+        """Ratio of the hits among the lookups, None if no lookup"""
+        nlookups = self.nhits + self.nmisses
+        return self.nhits / nlookups if nlookups else None
+
+    def __len__(self) -> int:
+        return sum(len(resps) for resps in self._resps.values())
+
+    def __repr__(self) -> str:
+        return f"<SemanticCache with {len(self)} responses, {self.nhits} hits, {self.nmisses} misses>"
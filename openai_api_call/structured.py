@@ -0,0 +1,240 @@
+# Structured output: incremental validation of the streamed JSON
+
+import json, re
+from typing import Dict, Union, List
+
+_number_prefix = re.compile(r'-?(?:0|[1-9]\d*)?$|-?(?:0|[1-9]\d*)\.\d*$|-?(?:0|[1-9]\d*)(?:\.\d+)?[eE][+-]?\d*$')
+_number = re.compile(r'-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?$')
+_literals = {'t': 'true', 'f': 'false', 'n': 'null'}
+_literal_types = {'true': 'boolean', 'false': 'boolean', 'null': 'null'}
+_escapes = set('"\\/bfnrtu')
+
+def response_format(schema:Union[Dict, None]=None, name:str='output') -> Dict:
+    """`response_format` option of the JSON output
+
+    Args:
+        schema (Union[Dict, None], optional): JSON schema of the output. Defaults to None(any JSON object).
+        name (str, optional): name of the schema. Defaults to 'output'.
+
+    Returns:
+        Dict: `json_schema` format if the schema is given, otherwise `json_object`
+    """
+    if schema is None:
+        return {"type": "json_object"}
+    return {"type": "json_schema", "json_schema": {"name": name, "schema": schema}}
+
+def _types(schema:Dict) -> Union[List[str], None]:
+    """Types allowed by the schema, None for any"""
+    types = schema.get('type')
+    if types is None: return None
+    types = [types] if isinstance(types, str) else list(types)
+    if 'number' in types: types.append('integer')
+    return types
+
+class JSONStreamValidator():
+    def __init__(self, schema:Union[Dict, None]=None):
+        """Validate a JSON text as it is streamed, character by character
+
+        The text is rejected as soon as no continuation can be valid JSON. The schema is
+        checked on the fly for the keywords `type`, `properties`, `required`,
+        `additionalProperties`, `items` and the `enum` of strings, the others are ignored.
+
+        Args:
+            schema (Union[Dict, None], optional): JSON schema of the text. Defaults to None(any JSON).
+        """
+        self.schema, self.error = schema or {}, None
+        self._chunks, self._pos = [], 0
+        # containers: [kind, schema, state, keys, key], kinds are 'object' and 'array'
+        self._stack, self._done = [], False
+        self._token, self._token_kind, self._token_schema = None, None, None
+        self._escape = 0 # 1 after a backslash, 2 to 5 in the \uXXXX
+
+    @property
+    def text(self) -> str:
+        """Text fed so far"""
+        return ''.join(self._chunks)
+
+    @property
+    def valid(self) -> bool:
+        """Whether the text so far can be continued into a valid JSON"""
+        return self.error is None
+
+    def _fail(self, message:str) -> bool:
+        self.error = f"{message} at position {self._pos}"
+        return False
+
+    def feed(self, text:str) -> bool:
+        """Feed the next chunk of the text
+
+        Args:
+            text (str): chunk of the text
+
+        Returns:
+            bool: False if the text can no longer be valid
+        """
+        if self.error is not None: return False
+        self._chunks.append(text)
+        for char in text:
+            if not self._char(char): return False
+            self._pos += 1
+        return True
+
+    def finish(self) -> bool:
+        """Whether the whole text is a valid JSON, call at the end of the stream"""
+        if self.error is not None: return False
+        if self._token_kind == 'number' and not self._end_number():
+            return False
+        if self._token is not None:
+            return self._fail("Unterminated " + self._token_kind)
+        if self._stack or not self._done:
+            return self._fail("Incomplete JSON")
+        return True
+
+    # scanning of the characters
+    def _char(self, char:str) -> bool:
+        kind = self._token_kind
+        if kind == 'string':
+            return self._string_char(char)
+        if kind == 'literal':
+            self._token += char
+            word = _literals[self._token[0]]
+            if not word.startswith(self._token):
+                return self._fail(f"Invalid literal {self._token!r}")
+            if self._token == word:
+                self._token, self._token_kind = None, None
+                self._end_value()
+            return True
+        if kind == 'number':
+            if char in '0123456789+-.eE':
+                self._token += char
+                if not _number_prefix.match(self._token):
+                    return self._fail(f"Invalid number {self._token!r}")
+                if char in '.eE' and self._token_schema is not None and 'number' not in self._token_schema \
+                    and 'integer' in self._token_schema:
+                    return self._fail("Expected an integer")
+                return True
+            if not self._end_number(): return False
+        if char in ' \t\n\r':
+            return True
+        return self._structure(char)
+
+    def _end_number(self) -> bool:
+        if not _number.match(self._token):
+            return self._fail(f"Invalid number {self._token!r}")
+        self._token, self._token_kind = None, None
+        self._end_value()
+        return True
+
+    def _string_char(self, char:str) -> bool:
+        if self._escape == 1:
+            if char not in _escapes: return self._fail(f"Invalid escape \\{char}")
+            self._escape = 2 if char == 'u' else 0
+        elif self._escape >= 2:
+            if char not in '0123456789abcdefABCDEF': return self._fail("Invalid unicode escape")
+            self._escape = 0 if self._escape == 5 else self._escape + 1
+        elif char == '\\':
+            self._escape = 1
+        elif char == '"':
+            return self._end_string()
+        elif ord(char) < 0x20:
+            return self._fail("Control character in string")
+        self._token += char
+        enum = self._token_schema
+        if enum is not None and '\\' not in self._token and \
+            not any(isinstance(value, str) and value.startswith(self._token) for value in enum):
+            return self._fail(f"String {self._token!r} not in the enum")
+        return True
+
+    def _end_string(self) -> bool:
+        token, enum = json.loads('"' + self._token + '"'), self._token_schema
+        self._token, self._token_kind, self._token_schema = None, None, None
+        if self._stack and self._stack[-1][0] == 'object' and self._stack[-1][2] == 'key':
+            return self._key(token)
+        if enum is not None and token not in enum:
+            return self._fail(f"String {token!r} not in the enum")
+        self._end_value()
+        return True
+
+    def _key(self, key:str) -> bool:
+        frame = self._stack[-1]
+        schema, properties = frame[1], frame[1].get('properties', {})
+        additional = schema.get('additionalProperties', True)
+        if key not in properties and additional is False:
+            return self._fail(f"Unexpected key {key!r}")
+        frame[3].add(key)
+        frame[2], frame[4] = 'colon', properties.get(key, additional if isinstance(additional, dict) else {})
+        return True
+
+    # structure of the containers
+    def _structure(self, char:str) -> bool:
+        if self._done:
+            return self._fail(f"Unexpected {char!r} after the JSON")
+        if not self._stack:
+            return self._value(char, self.schema)
+        frame = self._stack[-1]
+        kind, state = frame[0], frame[2]
+        if kind == 'object':
+            if char == '}' and state in ('key_or_end', 'comma_or_end'):
+                missing = [key for key in frame[1].get('required', []) if key not in frame[3]]
+                if missing: return self._fail(f"Missing required keys {missing}")
+                self._stack.pop()
+                self._end_value()
+                return True
+            if char == '"' and state in ('key_or_end', 'key'):
+                frame[2] = 'key'
+                self._token, self._token_kind, self._token_schema = '', 'string', None
+                return True
+            if char == ':' and state == 'colon':
+                frame[2] = 'value'
+                return True
+            if char == ',' and state == 'comma_or_end':
+                frame[2] = 'key'
+                return True
+            if state == 'value':
+                return self._value(char, frame[4])
+            return self._fail(f"Unexpected {char!r} in object")
+        if char == ']' and state in ('value_or_end', 'comma_or_end'):
+            self._stack.pop()
+            self._end_value()
+            return True
+        if char == ',' and state == 'comma_or_end':
+            frame[2] = 'value'
+            return True
+        if state in ('value_or_end', 'value'):
+            items = frame[1].get('items')
+            return self._value(char, items if isinstance(items, dict) else {})
+        return self._fail(f"Unexpected {char!r} in array")
+
+    def _value(self, char:str, schema:Dict) -> bool:
+        """Start of a value"""
+        if char == '{': kind = 'object'
+        elif char == '[': kind = 'array'
+        elif char == '"': kind = 'string'
+        elif char in _literals: kind = _literal_types[_literals[char]]
+        elif char == '-' or char.isdigit(): kind = 'number'
+        else: return self._fail(f"Unexpected {char!r}")
+        types = _types(schema)
+        if types is not None and kind not in types and not (kind == 'number' and 'integer' in types):
+            return self._fail(f"Expected {' or '.join(types)}, got {kind}")
+        if kind in ('object', 'array'):
+            start = 'key_or_end' if kind == 'object' else 'value_or_end'
+            self._stack.append([kind, schema, start, set(), None])
+        elif kind == 'string':
+            enum = schema.get('enum')
+            self._token, self._token_kind, self._token_schema = '', 'string', enum
+        elif kind == 'number':
+            self._token, self._token_kind, self._token_schema = char, 'number', types
+            if not _number_prefix.match(char): return self._fail(f"Invalid number {char!r}")
+        else:
+            self._token, self._token_kind = char, 'literal'
+        return True
+
+    def _end_value(self):
+        if not self._stack:
+            self._done = True
+        else:
+            self._stack[-1][2] = 'comma_or_end'
+
+    def __repr__(self) -> str:
+        state = "invalid" if self.error else "valid"
+        return f"<JSONStreamValidator with {len(self.text)} characters, {state}>"
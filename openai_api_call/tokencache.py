@@ -0,0 +1,198 @@
+# Prefetch and prewarm the tiktoken encodings
+
+import os, json, subprocess, sys, threading
+from typing import List, Union, Callable, Iterable, Dict
+
+# manifest of the encodings fetched into a cache directory, with their files
+manifest_name = "openai_api_call_encodings.json"
+
+def cache_dir() -> str:
+    """Cache directory of the encoding files, the same as tiktoken"""
+    if "TIKTOKEN_CACHE_DIR" in os.environ:
+        return os.environ["TIKTOKEN_CACHE_DIR"]
+    if "DATA_GYM_CACHE_DIR" in os.environ:
+        return os.environ["DATA_GYM_CACHE_DIR"]
+    import tempfile
+    return os.path.join(tempfile.gettempdir(), "data-gym-cache")
+
+def use_cache_dir(path:str):
+    """Pin the cache directory of the encoding files
+
+    Args:
+        path (str): cache directory, e.g. the one filled by `prefetch_encodings`
+    """
+    os.environ["TIKTOKEN_CACHE_DIR"] = os.path.abspath(path)
+
+def _as_list(names:Iterable[str]) -> List[str]:
+    return [names] if isinstance(names, str) else list(names)
+
+def _check_names(names:Iterable[str]) -> List[str]:
+    import tiktoken
+    names, known = _as_list(names), tiktoken.list_encoding_names()
+    for name in names:
+        if name not in known:
+            raise ValueError(f"Unknown encoding {name}, expected one of {known}")
+    return names
+
+# load the encoding, printing the cache keys of the files it reads, see `tiktoken.load.read_file_cached`
+_fetch_script = """
+import sys, hashlib, tiktoken, tiktoken.load as load
+read_file_cached = load.read_file_cached
+def read_and_print(blobpath, *args, **kwargs):
+    print(hashlib.sha1(blobpath.encode()).hexdigest())
+    return read_file_cached(blobpath, *args, **kwargs)
+load.read_file_cached = read_and_print
+tiktoken.get_encoding(sys.argv[1])
+"""
+
+def _fetch(name:str, path:str) -> List[str]:
+    """Load the encoding in a new process, which downloads its files into the directory
+
+    The encodings loaded by this process are kept in memory by tiktoken, and never read
+    from the directory again.
+
+    Returns:
+        List[str]: names of all files of the encoding, including those already in the directory
+    """
+    try:
+        result = subprocess.run([sys.executable, "-c", _fetch_script, name],
+                                env={**os.environ, "TIKTOKEN_CACHE_DIR": path}, check=True,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except subprocess.CalledProcessError as e:
+        lines = e.stderr.decode(errors='replace').strip().splitlines()
+        raise RuntimeError(f"Failed to load the encoding {name}: {lines[-1] if lines else e}") from e
+    return sorted(set(result.stdout.decode().split()))
+
+def _read_manifest(path:str) -> Dict[str, List[str]]:
+    manifest = os.path.join(path, manifest_name)
+    if not os.path.exists(manifest):
+        return {}
+    with open(manifest, encoding='utf-8') as f:
+        return json.load(f)
+
+def _cached(manifest:Dict[str, List[str]], path:str) -> List[str]:
+    """Encodings of the manifest whose files are all in the directory"""
+    return [name for name, files in manifest.items()
+            if all(os.path.exists(os.path.join(path, file)) for file in files)]
+
+def prefetch_encodings( names:Iterable[str]=("cl100k_base",)
+                      , path:Union[str, None]=None) -> List[str]:
+    """Download the encoding files into the cache directory by `tiktoken.get_encoding`
+
+    Args:
+        names (Iterable[str], optional): names of the encodings. Defaults to ("cl100k_base",).
+        path (Union[str, None], optional): cache directory to pin, see `use_cache_dir`.
+          Defaults to None(the current cache directory).
+
+    Raises:
+        RuntimeError: the encoding fails to load, e.g. without network
+
+    Returns:
+        List[str]: paths of the files downloaded
+    """
+    names = _check_names(names)
+    if path is not None: use_cache_dir(path)
+    path = cache_dir()
+    os.makedirs(path, exist_ok=True)
+    manifest, paths = _read_manifest(path), []
+    for name in names:
+        if name in _cached(manifest, path): continue
+        before = set(os.listdir(path))
+        manifest[name] = files = _fetch(name, path)
+        paths.extend(os.path.join(path, file) for file in files if file not in before)
+    with open(os.path.join(path, manifest_name), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return paths
+
+def cached_encodings(path:Union[str, None]=None) -> List[str]:
+    """Names of the encodings fetched into the cache directory by `prefetch_encodings`
+
+    Args:
+        path (Union[str, None], optional): cache directory. Defaults to None(the current one).
+    """
+    path = cache_dir() if path is None else path
+    return _cached(_read_manifest(path), path)
+
+# state of the encodings loaded in the background
+_done, _errors, _lock = {}, {}, threading.Lock()
+
+def prewarm_encodings( names:Iterable[str]=("cl100k_base",)
+                     , path:Union[str, None]=None
+                     , background:bool=True
+                     , callback:Union[Callable[[List[str]], None], None]=None
+                     ) -> Union[threading.Thread, None]:
+    """Load the encodings ahead of the first token counting
+
+    Args:
+        names (Iterable[str], optional): names of the encodings. Defaults to ("cl100k_base",).
+        path (Union[str, None], optional): cache directory to pin. Defaults to None.
+        background (bool, optional): whether to load in a daemon thread. Defaults to True.
+        callback (Callable, optional): called with the names when all encodings are loaded. Defaults to None.
+
+    Returns:
+        Union[threading.Thread, None]: the loading thread if `background`, the unknown
+          encodings fail with ValueError in `wait_encodings`
+    """
+    names = _as_list(names) # tiktoken is imported by the loading thread
+    if path is not None: use_cache_dir(path)
+    with _lock:
+        for name in names:
+            if name not in _done or name in _errors: # retry the failed ones
+                _done[name] = threading.Event()
+
+    def load():
+        for name in names:
+            try:
+                import tiktoken
+                tiktoken.get_encoding(_check_names(name)[0])
+                error = None
+            except Exception as e:
+                error = e
+            with _lock:
+                if error is None: _errors.pop(name, None)
+                else: _errors[name] = error
+                _done[name].set()
+        if callback is not None and encodings_ready(names):
+            callback(names)
+
+    if not background:
+        load()
+        return None
+    thread = threading.Thread(target=load, name="prewarm-encodings", daemon=True)
+    thread.start()
+    return thread
+
+def encodings_ready(names:Union[Iterable[str], None]=None) -> bool:
+    """Whether the prewarmed encodings are loaded
+
+    Args:
+        names (Union[Iterable[str], None], optional): names of the encodings. Defaults to None(all prewarmed).
+    """
+    names = list(_done) if names is None else _check_names(names)
+    with _lock:
+        return all(name in _done and _done[name].is_set() and name not in _errors
+                   for name in names)
+
+def wait_encodings( names:Union[Iterable[str], None]=None
+                  , timeout:Union[float, None]=None) -> bool:
+    """Wait for the prewarmed encodings
+
+    Args:
+        names (Union[Iterable[str], None], optional): names of the encodings. Defaults to None(all prewarmed).
+        timeout (Union[float, None], optional): timeout in seconds. Defaults to None.
+
+    Raises:
+        Exception: error raised when loading the encoding
+
+    Returns:
+        bool: whether the encodings are ready
+    """
+    names = list(_done) if names is None else _check_names(names)
+    for name in names:
+        if name not in _done or not _done[name].wait(timeout):
+            return False
+        with _lock:
+            error = _errors.get(name)
+        if error is not None:
+            raise error
+    return True
@@ -1,8 +1,11 @@
-import tiktoken
+import math, json
+from functools import lru_cache
+from typing import List, Dict, Union, Tuple
 
 # model cost($ per 1K tokens)
 ## Refernece: https://openai.com/pricing
-## model | input | output
+## model | input | output | cached input(optional, only listed for the models with a
+##   discounted price of the prompt cache, the input price if missing)
 model_cost_perktoken ={
     "gpt-3.5-turbo": (0.0015, 0.002),
     "gpt-3.5-turbo-0613" : (0.0015, 0.002),
@@ -16,28 +19,139 @@ model_cost_perktoken ={
     "gpt-4-32k": (0.06, 0.12),
 }
 
-def token2cost(model:str, prompt_tokens:int, completion_tokens:int=0):
+# context window of the models(number of tokens)
+model_context_window = {
+    "gpt-3.5-turbo": 4096,
+    "gpt-3.5-turbo-0613" : 4096,
+    "gpt-3.5-turbo-0301" : 4096,
+    "gpt-3.5-turbo-16k-0613" : 16384,
+    "gpt-3.5-turbo-16k" : 16384,
+    "gpt-4": 8192,
+    "gpt-4-0613": 8192,
+    "gpt-4-0301": 8192,
+    "gpt-4-32k-0613": 32768,
+    "gpt-4-32k": 32768,
+}
+
+def _prices(model:str) -> Tuple[float, float, float]:
+    """Input, output and cached input prices of the model"""
+    assert model in model_cost_perktoken, f"Model {model} is not known!"
+    prices = model_cost_perktoken[model]
+    return tuple(prices[:3]) if len(prices) > 2 else (prices[0], prices[1], prices[0])
+
+def token2cost(model:str, prompt_tokens:int, completion_tokens:int=0, cached_tokens:int=0):
     """Calculate the cost of the response
 
     Args:
         model (str): model name
         prompt_tokens (int): number of tokens in the prompt
         completion_tokens (int): number of tokens of the response
+        cached_tokens (int): number of prompt tokens read from the prompt cache, billed at
+          the cached input price of the model
 
     Returns:
         float: cost of the response
     """
-    assert model in model_cost_perktoken, f"Model {model} is not known!"
-    input_price, output_price = model_cost_perktoken[model]
-    return (input_price * prompt_tokens + output_price * completion_tokens) / 1000
+    input_price, output_price, cached_price = _prices(model)
+    return (input_price * (prompt_tokens - cached_tokens) + cached_price * cached_tokens
+            + output_price * completion_tokens) / 1000
 
-def num_tokens_from_messages(messages, model="gpt-3.5-turbo-0613"):
-    """Return the number of tokens used by a list of messages."""
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        print("Warning: model not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
+def token2cost_bulk( models
+                   , prompt_tokens
+                   , completion_tokens=0
+                   , cached_tokens=0
+                   , use_numpy:Union[bool, None]=None):
+    """Calculate the costs of many responses in one pass
+
+    Args:
+        models (Union[str, Sequence[str]]): model name, or model names of the responses
+        prompt_tokens (Sequence[int]): numbers of tokens in the prompts
+        completion_tokens (Union[int, Sequence[int]], optional): numbers of tokens of the
+          responses. Defaults to 0.
+        cached_tokens (Union[int, Sequence[int]], optional): numbers of prompt tokens read
+          from the prompt cache. Defaults to 0.
+        use_numpy (Union[bool, None], optional): whether to use NumPy. Defaults to None(use it
+          if installed).
+
+    Returns:
+        Tuple[Sequence[float], Dict[str, Dict]]: costs of the responses(a NumPy array if NumPy
+          is used), and the number of responses, tokens and cost of each model
+    """
+    if use_numpy is None:
+        try:
+            import numpy
+            use_numpy = True
+        except ImportError:
+            use_numpy = False
+    nresps = len(prompt_tokens)
+    if isinstance(completion_tokens, int):
+        completion_tokens = [completion_tokens] * nresps
+    if isinstance(cached_tokens, int):
+        cached_tokens = [cached_tokens] * nresps
+    if use_numpy:
+        return _token2cost_numpy(models, prompt_tokens, completion_tokens, cached_tokens)
+    if isinstance(models, str):
+        models = [models] * nresps
+    assert len(models) == nresps and len(completion_tokens) == nresps \
+        and len(cached_tokens) == nresps, "the columns should have the same length"
+    prices = {model: _prices(model) for model in set(models)}
+    costs = [(prices[model][0] * (prompt - cached) + prices[model][2] * cached
+              + prices[model][1] * completion) / 1000
+             for model, prompt, completion, cached
+             in zip(models, prompt_tokens, completion_tokens, cached_tokens)]
+    sums = {model: [0, 0, 0, 0] for model in prices}
+    for model, prompt, completion, cost in zip(models, prompt_tokens, completion_tokens, costs):
+        agg = sums[model]
+        agg[0] += 1; agg[1] += prompt; agg[2] += completion; agg[3] += cost
+    aggregates = {
+        model: {"count": agg[0], "prompt_tokens": agg[1], "completion_tokens": agg[2], "cost": agg[3]}
+        for model, agg in sums.items()}
+    return costs, aggregates
+
+def _token2cost_numpy(models, prompt_tokens, completion_tokens, cached_tokens):
+    """NumPy version of `token2cost_bulk`"""
+    import numpy as np
+    nresps = len(prompt_tokens)
+    if isinstance(models, str):
+        names, inverse = [models], np.zeros(nresps, dtype=np.int64)
+    else: # encode the models by a dict, which is much faster than sorting the strings
+        codes = {}
+        inverse = np.fromiter((codes.setdefault(model, len(codes)) for model in models),
+                              dtype=np.int64, count=len(models))
+        names = list(codes)
+    assert len(inverse) == nresps and len(completion_tokens) == nresps \
+        and len(cached_tokens) == nresps, "the columns should have the same length"
+    prices = np.array([_prices(model) for model in names], dtype=np.float64)
+    prompt_tokens = np.asarray(prompt_tokens, dtype=np.int64)
+    completion_tokens = np.asarray(completion_tokens, dtype=np.int64)
+    cached_tokens = np.asarray(cached_tokens, dtype=np.int64)
+    costs = (prices[inverse, 0] * (prompt_tokens - cached_tokens) + prices[inverse, 2] * cached_tokens
+             + prices[inverse, 1] * completion_tokens) / 1000
+    nmodels = len(names)
+    counts = np.bincount(inverse, minlength=nmodels)
+    prompts = np.bincount(inverse, weights=prompt_tokens, minlength=nmodels)
+    completions = np.bincount(inverse, weights=completion_tokens, minlength=nmodels)
+    model_costs = np.bincount(inverse, weights=costs, minlength=nmodels)
+    aggregates = {
+        str(model): { "count": int(counts[i]), "prompt_tokens": int(prompts[i])
+                    , "completion_tokens": int(completions[i]), "cost": float(model_costs[i])}
+        for i, model in enumerate(names)}
+    return costs, aggregates
+
+_warned_models = set()
+
+def _warn_once(model:str, msg:str):
+    """Print the warning only once for each model"""
+    if model not in _warned_models:
+        _warned_models.add(model)
+        print(msg)
+
+def _message_format(model:str):
+    """Get the pinned model and the extra tokens of each message
+
+    Returns:
+        Tuple[str, int, int]: model, tokens per message, tokens per name
+    """
     if model in {
         "gpt-3.5-turbo-0613",
         "gpt-3.5-turbo-16k-0613",
@@ -52,21 +166,188 @@ def num_tokens_from_messages(messages, model="gpt-3.5-turbo-0613"):
         tokens_per_message = 4  # every message follows <|start|>{role/name}\n{content}<|end|>\n
         tokens_per_name = -1  # if there's a name, the role is omitted
     elif "gpt-3.5-turbo" in model:
-        print("Warning: gpt-3.5-turbo may update over time. Returning num tokens assuming gpt-3.5-turbo-0613.")
-        return num_tokens_from_messages(messages, model="gpt-3.5-turbo-0613")
+        _warn_once(model, "Warning: gpt-3.5-turbo may update over time. Returning num tokens assuming gpt-3.5-turbo-0613.")
+        return _message_format("gpt-3.5-turbo-0613")
     elif "gpt-4" in model:
-        print("Warning: gpt-4 may update over time. Returning num tokens assuming gpt-4-0613.")
-        return num_tokens_from_messages(messages, model="gpt-4-0613")
+        _warn_once(model, "Warning: gpt-4 may update over time. Returning num tokens assuming gpt-4-0613.")
+        return _message_format("gpt-4-0613")
     else:
         raise NotImplementedError(
             f"""num_tokens_from_messages() is not implemented for model {model}. See https://github.com/openai/openai-python/blob/main/chatml.md for information on how messages are converted to tokens."""
         )
+    return model, tokens_per_message, tokens_per_name
+
+@lru_cache(maxsize=None)
+def _get_encoding(model:str):
+    import tiktoken # loading tiktoken is slow, import it on first use
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        print("Warning: model not found. Using cl100k_base encoding.")
+        return tiktoken.get_encoding("cl100k_base")
+
+@lru_cache(maxsize=65536)
+def _num_tokens_from_items(items:tuple, model:str):
+    """Number of tokens of a message given as a tuple of items, with pinned model"""
+    _, tokens_per_message, tokens_per_name = _message_format(model)
+    encoding = _get_encoding(model)
+    num_tokens = tokens_per_message
+    for key, value in items:
+        num_tokens += len(encoding.encode(value))
+        if key == "name":
+            num_tokens += tokens_per_name
+    return num_tokens
+
+def _message_items(message:Dict) -> tuple:
+    """Items of a message with the text values, e.g. `tool_calls` in JSON"""
+    return tuple((key, value if isinstance(value, str) else json.dumps(value))
+                 for key, value in message.items() if value is not None)
+
+def num_tokens_from_message(message:Dict, model="gpt-3.5-turbo-0613"):
+    """Return the number of tokens used by a single message, excluding the reply priming.
+
+    The counts are cached by the content of the message, so counting a growing
+    chat log does not encode the same message twice.
+    """
+    model = _message_format(model)[0]
+    return _num_tokens_from_items(_message_items(message), model)
+
+def num_tokens_from_messages(messages:List[Dict], model="gpt-3.5-turbo-0613"):
+    """Return the number of tokens used by a list of messages."""
+    model = _message_format(model)[0]
     num_tokens = 0
     for message in messages:
-        num_tokens += tokens_per_message
-        for key, value in message.items():
-            num_tokens += len(encoding.encode(value))
-            if key == "name":
-                num_tokens += tokens_per_name
+        num_tokens += _num_tokens_from_items(_message_items(message), model)
     num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
     return num_tokens
+
+# Fast token estimation
+## tokens per character of each character class, fitted to tiktoken by
+## `benchmarks/bench_tokens.py --fit` on chunks of at least 300 characters of the Python
+## documentation and standard library (English and code), and the gettext catalogs of the
+## GNU tools and Django (Chinese, Japanese, Korean, Russian, Ukrainian and Greek)
+## - cyrillic: characters of U+0400 - U+04FF
+## - other: the other characters of 2 bytes in UTF-8, e.g. Greek, Arabic, accented letters
+## - cjk: characters of 3 or 4 bytes in UTF-8 except Hangul, e.g. Chinese, Japanese, emoji
+## - hangul: characters of U+A000 - U+DFFF, mostly the Korean syllables
+estimator_params = {
+    "cl100k_base": {"letter": 0.202, "space": 0.164, "digit": 1.24, "punct": 0.589,
+                    "cyrillic": 0.539, "other": 1.069, "cjk": 1.188, "hangul": 1.186},
+    "o200k_base": {"letter": 0.198, "space": 0.16, "digit": 1.138, "punct": 0.684,
+                   "cyrillic": 0.334, "other": 0.436, "cjk": 0.867, "hangul": 0.761},
+    "p50k_base": {"letter": 0.205, "space": 0.23, "digit": 1.206, "punct": 0.905,
+                  "cyrillic": 1.305, "other": 1.363, "cjk": 1.859, "hangul": 2.925},
+}
+## relative error of the tokens of the ascii, cjk(with hangul) and other(with cyrillic) characters,
+## the 99th percentile of the fitted chunks, so the exact count is within the bounds for about
+## 98% of the held-out chunks of each language, and the short texts may be out of them
+estimator_error = {
+    "cl100k_base": {"ascii": 0.42, "cjk": 0.59, "other": 0.54},
+    "o200k_base": {"ascii": 0.46, "cjk": 0.45, "other": 0.69},
+    "p50k_base": {"ascii": 0.44, "cjk": 0.48, "other": 0.16},
+}
+
+_punctuation = b'!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~'
+_not_lead = bytes(range(0xc0)) # ascii and continuation bytes of UTF-8
+_lead2 = bytes(range(0xc0, 0xe0)) # characters of 2 bytes
+_lead_cyrillic = bytes(range(0xd0, 0xd4)) # U+0400 - U+04FF
+_lead_hangul = bytes(range(0xea, 0xee)) # U+A000 - U+DFFF, mostly the Hangul syllables
+
+def _encoding_name(model:str) -> str:
+    """Name of the encoding used by the model, without loading tiktoken"""
+    if model in estimator_params:
+        return model
+    if "gpt-4o" in model:
+        return "o200k_base"
+    if "gpt-3.5" in model or "gpt-4" in model or "embedding" in model:
+        return "cl100k_base"
+    if "davinci" in model or "curie" in model or "babbage" in model or "ada" in model:
+        return "p50k_base"
+    return "cl100k_base"
+
+def _class_counts(text:str) -> Tuple[int, ...]:
+    """Numbers of the characters of each class of `estimator_params`, in its order"""
+    ascii_text = text.encode('ascii', 'ignore')
+    # count the classes by deleting them, which runs in C
+    nascii = len(ascii_text)
+    nspace = nascii - len(ascii_text.translate(None, b' \t\r\n'))
+    ndigit = nascii - len(ascii_text.translate(None, b'0123456789'))
+    npunct = nascii - len(ascii_text.translate(None, _punctuation))
+    nletter = nascii - nspace - ndigit - npunct
+    ncyrillic = nother = ncjk = nhangul = 0
+    if nascii < len(text): # non-ascii characters, classified by the leading byte in UTF-8
+        lead = text.encode('utf-8').translate(None, _not_lead)
+        n2 = len(lead) - len(lead.translate(None, _lead2))
+        ncyrillic = len(lead) - len(lead.translate(None, _lead_cyrillic))
+        nhangul = len(lead) - len(lead.translate(None, _lead_hangul))
+        nother = n2 - ncyrillic
+        ncjk = len(lead) - n2 - nhangul
+    return nletter, nspace, ndigit, npunct, ncyrillic, nother, ncjk, nhangul
+
+def _estimate(text:str, encoding:str):
+    """Estimated tokens and absolute error of the text"""
+    params, errors = estimator_params[encoding], estimator_error[encoding]
+    nletter, nspace, ndigit, npunct, ncyrillic, nother, ncjk, nhangul = _class_counts(text)
+    ascii_tokens = params["letter"] * nletter + params["space"] * nspace \
+        + params["digit"] * ndigit + params["punct"] * npunct
+    cjk_tokens = params["cjk"] * ncjk + params["hangul"] * nhangul
+    other_tokens = params["cyrillic"] * ncyrillic + params["other"] * nother
+    estimate = ascii_tokens + cjk_tokens + other_tokens
+    error = errors["ascii"] * ascii_tokens + errors["cjk"] * cjk_tokens + errors["other"] * other_tokens
+    return estimate, error
+
+def estimate_tokens(text:str, model:str="gpt-3.5-turbo", bounds:bool=False):
+    """Estimate the number of tokens of the text without encoding it
+
+    The estimation is based on the counts of letters, digits, punctuations and
+    non-ascii characters, which is orders of magnitude faster than the exact counting.
+
+    Args:
+        text (str): text to estimate
+        model (str, optional): model or encoding name. Defaults to "gpt-3.5-turbo".
+        bounds (bool, optional): whether to return the error bounds. Defaults to False.
+
+    Returns:
+        Union[int, Tuple[int, int, int]]: estimated tokens, or (estimate, lower bound, upper bound)
+    """
+    estimate, error = _estimate(text, _encoding_name(model))
+    if not bounds:
+        return max(round(estimate), 1 if text else 0)
+    return (max(round(estimate), 1 if text else 0),
+            max(int(estimate - error), 1 if text else 0),
+            math.ceil(estimate + error))
+
+def estimate_tokens_from_message(message:Dict, model:str="gpt-3.5-turbo", bounds:bool=False):
+    """Estimate the number of tokens of a message, see `estimate_tokens`
+
+    It can be used as the `counter` of `ContextWindow`.
+    """
+    encoding = _encoding_name(model)
+    estimate, error = 3, 0 # tokens per message
+    for key, value in _message_items(message):
+        if key == "role":
+            estimate += 1
+        else:
+            est, err = _estimate(value, encoding)
+            estimate, error = estimate + est, error + err
+            if key == "name": estimate += 1
+    if not bounds:
+        return round(estimate)
+    return round(estimate), int(estimate - error), math.ceil(estimate + error)
+
+def estimate_tokens_from_messages(messages:List[Dict], model:str="gpt-3.5-turbo", bounds:bool=False):
+    """Estimate the number of tokens used by a list of messages, see `estimate_tokens`
+
+    Args:
+        messages (List[Dict]): chat log
+        model (str, optional): model to use. Defaults to "gpt-3.5-turbo".
+        bounds (bool, optional): whether to return the error bounds. Defaults to False.
+
+    Returns:
+        Union[int, Tuple[int, int, int]]: estimated tokens, or (estimate, lower bound, upper bound)
+    """
+    estimate, lower, upper = 3, 3, 3 # every reply is primed with <|start|>assistant<|message|>
+    for message in messages:
+        est, low, up = estimate_tokens_from_message(message, model, bounds=True)
+        estimate, lower, upper = estimate + est, lower + low, upper + up
+    return (estimate, lower, upper) if bounds else estimate
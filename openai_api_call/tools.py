@@ -0,0 +1,173 @@
+# Tools called by the model, run concurrently
+
+import asyncio, inspect, json, time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import List, Dict, Union, Callable, Tuple
+from .request import RequestStats
+
+_json_types = {str: "string", int: "integer", float: "number", bool: "boolean",
+               list: "array", dict: "object"}
+
+def _parameters(func:Callable) -> Dict:
+    """JSON schema of the parameters by the signature of the function"""
+    properties, required = {}, []
+    for name, param in inspect.signature(func).parameters.items():
+        if param.kind in (param.VAR_POSITIONAL, param.VAR_KEYWORD): continue
+        jtype = _json_types.get(param.annotation)
+        properties[name] = {"type": jtype} if jtype is not None else {}
+        if param.default is param.empty:
+            required.append(name)
+    return {"type": "object", "properties": properties, "required": required}
+
+def _timed_call(func:Callable, arguments:Dict) -> Tuple[float, object, Union[Exception, None]]:
+    """Latency, result and error of the call, run in the threads"""
+    start = time.time()
+    try:
+        if inspect.iscoroutinefunction(func):
+            result = asyncio.run(func(**arguments))
+        else:
+            result = func(**arguments)
+    except Exception as e:
+        return time.time() - start, None, e
+    return time.time() - start, result, None
+
+class Tools():
+    def __init__(self, timeout:Union[float, None]=None, max_workers:Union[int, None]=None):
+        """Registry of the tools offered to the model
+
+        The tool calls of a response run concurrently, coroutine functions on the event loop
+        and the others in a thread pool. A tool that fails or times out returns the error
+        to the model instead of raising. The latency of each tool is kept in `stats`.
+
+        Example:
+            tools = Tools(timeout=10)
+
+            @tools.register
+            def weather(city:str):
+                \"\"\"Get the weather of a city\"\"\"
+                return "sunny"
+
+            resp = chat.run_tools(tools)
+
+        Args:
+            timeout (Union[float, None], optional): default timeout of a tool call in seconds.
+              Defaults to None(no timeout).
+            max_workers (Union[int, None], optional): number of threads to run the tools.
+              Defaults to None(the default of `ThreadPoolExecutor`).
+        """
+        self.timeout, self.max_workers = timeout, max_workers
+        self._tools, self.stats = {}, {}
+
+    def register( self
+                , func:Union[Callable, None]=None
+                , name:Union[str, None]=None
+                , description:Union[str, None]=None
+                , parameters:Union[Dict, None]=None
+                , timeout:Union[float, None]=None):
+        """Register a function as a tool, can be used as a decorator
+
+        Args:
+            func (Callable): function called with the arguments of the tool call
+            name (Union[str, None], optional): name of the tool. Defaults to None(the function name).
+            description (Union[str, None], optional): description of the tool. Defaults to None(the
+              docstring of the function).
+            parameters (Union[Dict, None], optional): JSON schema of the parameters. Defaults to
+              None(derived from the signature).
+            timeout (Union[float, None], optional): timeout of the tool in seconds. Defaults to
+              None(the default timeout).
+
+        Returns:
+            Callable: the function
+        """
+        if func is None: # used as `@tools.register(...)`
+            return lambda func: self.register(func, name, description, parameters, timeout)
+        name = name or func.__name__
+        spec = {"name": name, "parameters": parameters or _parameters(func)}
+        description = description or inspect.getdoc(func)
+        if description: spec["description"] = description
+        self._tools[name] = (func, spec, timeout if timeout is not None else self.timeout)
+        self.stats[name] = RequestStats()
+        return func
+
+    def schema(self) -> List[Dict]:
+        """Tools of the request, the `tools` option"""
+        return [{"type": "function", "function": spec} for _, spec, _ in self._tools.values()]
+
+    def _parse(self, tool_call:Dict) -> Tuple[Union[Callable, None], Dict, Union[str, None]]:
+        """Function, arguments and the error of a tool call"""
+        function = tool_call['function']
+        if function['name'] not in self._tools:
+            return None, {}, f"Error: unknown tool {function['name']}"
+        try:
+            arguments = json.loads(function.get('arguments') or '{}')
+        except json.JSONDecodeError as e:
+            return None, {}, f"Error: invalid arguments: {e}"
+        return self._tools[function['name']][0], arguments, None
+
+    def _result(self, name:str, latency:float, result=None, error:Union[Exception, None]=None) -> str:
+        """Content of the tool message, and record the latency"""
+        self.stats[name].record(latency, success=error is None)
+        if isinstance(error, (asyncio.TimeoutError, FutureTimeoutError)):
+            return f"Error: {name} timed out after {self._tools[name][2]} seconds"
+        if error is not None:
+            return f"Error: {error!r}"
+        return result if isinstance(result, str) else json.dumps(result, ensure_ascii=False)
+
+    def run(self, tool_calls:List[Dict]) -> List[Tuple[str, str]]:
+        """Run the tool calls concurrently in threads
+
+        Args:
+            tool_calls (List[Dict]): tool calls of the response, see `Resp.tool_calls`
+
+        Returns:
+            List[Tuple[str, str]]: id and result of each tool call, in the order of the calls
+        """
+        executor = ThreadPoolExecutor(self.max_workers)
+        try:
+            futures, start = [], time.time()
+            for tool_call in tool_calls:
+                func, arguments, error = self._parse(tool_call)
+                futures.append(executor.submit(_timed_call, func, arguments) if error is None else error)
+            results = []
+            for tool_call, future in zip(tool_calls, futures):
+                name = tool_call['function']['name']
+                if isinstance(future, str): # invalid tool call
+                    results.append((tool_call['id'], future))
+                    continue
+                # the timeout counts from the submission, as the tools run together
+                timeout = self._tools[name][2]
+                if timeout is not None: timeout = max(0, start + timeout - time.time())
+                try:
+                    result = self._result(name, *future.result(timeout))
+                except FutureTimeoutError as e:
+                    result = self._result(name, time.time() - start, error=e)
+                results.append((tool_call['id'], result))
+            return results
+        finally: # the tools timed out keep running in the background
+            executor.shutdown(wait=False)
+
+    async def arun(self, tool_calls:List[Dict]) -> List[Tuple[str, str]]:
+        """Run the tool calls concurrently, the functions other than coroutines run in the
+        default executor of the event loop, see `run`"""
+        loop = asyncio.get_running_loop()
+        async def call(tool_call):
+            func, arguments, error = self._parse(tool_call)
+            if error is not None:
+                return tool_call['id'], error
+            name, start = tool_call['function']['name'], time.time()
+            try:
+                if inspect.iscoroutinefunction(func):
+                    task = func(**arguments)
+                else:
+                    task = loop.run_in_executor(None, lambda: func(**arguments))
+                result = await asyncio.wait_for(task, self._tools[name][2])
+            except Exception as e:
+                return tool_call['id'], self._result(name, time.time() - start, error=e)
+            return tool_call['id'], self._result(name, time.time() - start, result)
+        return list(await asyncio.gather(*[call(tool_call) for tool_call in tool_calls]))
+
+    def __len__(self) -> int:
+        return len(self._tools)
+
+    def __repr__(self) -> str:
+        return f"<Tools {list(self._tools)}>"
@@ -0,0 +1,222 @@
+# Record and replay the HTTP requests, for offline benchmarking and profiling
+
+import gzip, hashlib, json, threading, time, asyncio
+from contextlib import contextmanager
+from typing import Dict, Union
+from . import request
+
+def _request_key(method:str, url:str, data:Union[str, bytes, None]) -> str:
+    """Key of a request by its method, url and body, the headers(API key) are not kept"""
+    if isinstance(data, str): data = data.encode()
+    return f"{method} {url} {hashlib.sha1(data or b'').hexdigest()}"
+
+class Recorder():
+    def __init__(self, path:str):
+        """Record the responses and their timing to a gzipped JSONL archive
+
+        Args:
+            path (str): path to the archive, e.g. "trace.jsonl.gz"
+        """
+        self.path, self.nrecords = path, 0
+        self._file = gzip.open(path, 'wt', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def add(self, entry:Dict):
+        with self._lock:
+            self._file.write(json.dumps(entry) + '\n')
+            self.nrecords += 1
+
+    def close(self):
+        self._file.close()
+
+    def wrap(self, session):
+        """Session of the sync requests"""
+        return _RecordingSession(self, session)
+
+    def awrap(self, session):
+        """Session of the async requests"""
+        return _ARecordingSession(self, session)
+
+class _RecordingSession():
+    def __init__(self, recorder:Recorder, session):
+        self._recorder, self._session = recorder, session
+
+    def _send(self, method, url, data=None, **kwargs):
+        start = time.time()
+        response = getattr(self._session, method.lower())(url, data=data, **kwargs)
+        self._recorder.add({
+            "key": _request_key(method, url, data), "status": response.status_code,
+            "latency": time.time() - start, "body": response.text})
+        return response
+
+    def post(self, url, data=None, **kwargs):
+        return self._send("POST", url, data, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self._send("GET", url, **kwargs)
+
+class _ARecordingSession():
+    def __init__(self, recorder:Recorder, session):
+        self._recorder, self._session = recorder, session
+
+    def post(self, url, data=None, **kwargs):
+        return _ARecordingResponse(self._recorder, self._session.post(url, data=data, **kwargs),
+                                   _request_key("POST", url, data))
+
+class _ARecordingResponse():
+    """Recorder of the response, used by `async with session.post(...)`"""
+    def __init__(self, recorder, context, key):
+        self._recorder, self._context, self._key = recorder, context, key
+        self._start, self._body, self._chunks = time.time(), None, []
+        self.content = self # `response.content.readline()`
+
+    async def __aenter__(self):
+        self._response = await self._context.__aenter__()
+        self.status = self._response.status
+        return self
+
+    async def __aexit__(self, *args):
+        entry = {"key": self._key, "status": self.status, "latency": time.time() - self._start}
+        if self._body is not None:
+            entry["body"] = self._body
+        else: # offsets of the chunks from the start
+            entry["chunks"] = self._chunks
+        self._recorder.add(entry)
+        return await self._context.__aexit__(*args)
+
+    async def text(self):
+        self._body = await self._response.text()
+        return self._body
+
+    async def readline(self):
+        line = await self._response.content.readline()
+        if line: self._chunks.append([time.time() - self._start, line.decode()])
+        return line
+
+class Replayer():
+    def __init__(self, path:str, scale:float=1.0):
+        """Replay the recorded responses instead of sending the requests
+
+        The responses of the same request are replayed in the recorded order,
+        and the last one is repeated once they are used up.
+
+        Args:
+            path (str): path to the archive written by `Recorder`
+            scale (float, optional): scale of the recorded latencies, 0 to replay at full
+              speed. Defaults to 1.0.
+        """
+        assert scale >= 0, "scale must be non-negative!"
+        self.path, self.scale = path, scale
+        self._entries, self._used = {}, {}
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                entry = json.loads(line)
+                self._entries.setdefault(entry.pop("key"), []).append(entry)
+        self._lock = threading.Lock()
+
+    def next(self, method:str, url:str, data) -> Dict:
+        """Recorded response of the request"""
+        key = _request_key(method, url, data)
+        if key not in self._entries:
+            raise LookupError(f"No recorded response of {method} {url} with the same body")
+        with self._lock:
+            ind = self._used.get(key, 0)
+            self._used[key] = ind + 1
+        entries = self._entries[key]
+        return entries[min(ind, len(entries) - 1)]
+
+    def close(self):
+        pass
+
+    def wrap(self, session):
+        return _ReplaySession(self)
+
+    def awrap(self, session):
+        return _AReplaySession(self)
+
+class _ReplaySession():
+    def __init__(self, replayer:Replayer):
+        self._replayer = replayer
+
+    def _send(self, method, url, data=None):
+        import requests
+        entry = self._replayer.next(method, url, data)
+        if self._replayer.scale: time.sleep(entry["latency"] * self._replayer.scale)
+        response = requests.Response()
+        response.status_code, response.url, response.encoding = entry["status"], url, 'utf-8'
+        response._content = entry.get("body", "").encode()
+        return response
+
+    def post(self, url, data=None, **kwargs):
+        return self._send("POST", url, data)
+
+    def get(self, url, **kwargs):
+        return self._send("GET", url)
+
+class _AReplaySession():
+    def __init__(self, replayer:Replayer):
+        self._replayer = replayer
+
+    def post(self, url, data=None, **kwargs):
+        return _AReplayResponse(self._replayer, self._replayer.next("POST", url, data))
+
+class _AReplayResponse():
+    """Recorded response, used by `async with session.post(...)`"""
+    def __init__(self, replayer, entry):
+        self._scale, self._entry, self._ind = replayer.scale, entry, 0
+        self._start = time.time()
+        self.status, self.content = entry["status"], self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def _wait(self, offset:float):
+        if self._scale:
+            await asyncio.sleep(max(0, self._start + offset * self._scale - time.time()))
+
+    async def text(self):
+        await self._wait(self._entry["latency"])
+        return self._entry.get("body", "")
+
+    async def readline(self):
+        chunks = self._entry.get("chunks", [])
+        if self._ind >= len(chunks):
+            return b''
+        offset, line = chunks[self._ind]
+        self._ind += 1
+        await self._wait(offset)
+        return line.encode()
+
+@contextmanager
+def record(path:str):
+    """Record the requests made in the context to the archive
+
+    Example:
+        with record("trace.jsonl.gz"):
+            chat.getresponse()
+    """
+    recorder = Recorder(path)
+    request.transport = recorder
+    try:
+        yield recorder
+    finally:
+        request.transport = None
+        recorder.close()
+
+@contextmanager
+def replay(path:str, scale:float=1.0):
+    """Replay the recorded responses to the requests made in the context, see `Replayer`
+
+    Example:
+        with replay("trace.jsonl.gz", scale=0):
+            chat.getresponse()
+    """
+    replayer = Replayer(path, scale)
+    request.transport = replayer
+    try:
+        yield replayer
+    finally:
+        request.transport = None
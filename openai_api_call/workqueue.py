@@ -0,0 +1,272 @@
+# Work queue of the chunks of a job, shared by the workers on several nodes
+
+import asyncio, json, os, socket, sqlite3, threading, time
+from typing import Dict, Union, Iterator, Tuple, Iterable
+from .asynctool import async_process_stream, _endpoint
+from .checkpoint import parse_chatlog, checkpoint_ids
+from .deadline import Timeout
+
+class WorkQueue():
+    def __init__(self, path:str, lease:float=600, timeout:float=60):
+        """Queue of the chunks of chat ids, coordinated by a SQLite database
+
+        A worker claims a chunk with a lease, renews it while working and completes it.
+        The chunks of the expired leases, e.g. of the crashed workers, are claimed again.
+        The database should be on a filesystem with working locks, and the clocks of the
+        nodes should be roughly in sync.
+
+        Args:
+            path (str): path to the database, created if not exists
+            lease (float, optional): seconds of a lease. Defaults to 600.
+            timeout (float, optional): seconds to wait for the lock of the database. Defaults to 60.
+        """
+        assert lease > 0, "lease must be greater than 0!"
+        self.path, self.lease = path, lease
+        # the leases are renewed in the executor threads, so the connection is locked
+        self._conn = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._lock = threading.RLock()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks (start INTEGER PRIMARY KEY, end INTEGER, "
+            "offset INTEGER, owner TEXT, expires REAL, done INTEGER DEFAULT 0, nclaims INTEGER DEFAULT 0)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def _transaction(self):
+        """Transaction holding the write lock, so the claims never race"""
+        conn, lock = self._conn, self._lock
+        class Transaction():
+            def __enter__(self):
+                lock.acquire()
+                try:
+                    conn.execute("BEGIN IMMEDIATE")
+                except BaseException:
+                    lock.release()
+                    raise
+                return conn
+            def __exit__(self, exc_type, *args):
+                try:
+                    conn.execute("COMMIT" if exc_type is None else "ROLLBACK")
+                finally:
+                    lock.release()
+        return Transaction()
+
+    @property
+    def input(self) -> Union[str, None]:
+        """Path to the input file, None if not populated"""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'input'").fetchone()
+        return None if row is None else row[0]
+
+    def populate(self, input:str, chunksize:int=100) -> int:
+        """Split the input file into chunks of lines, done once for a queue
+
+        Args:
+            input (str): path to the input file, see `iter_chatlogs` for the format
+            chunksize (int, optional): number of chats of a chunk. Defaults to 100.
+
+        Returns:
+            int: number of chunks
+        """
+        assert chunksize > 0, "chunksize must be greater than 0!"
+        input = os.path.abspath(input)
+        with self._transaction() as conn:
+            if self.input is not None: # populated by another worker
+                assert self.input == input, f"queue {self.path} is populated from {self.input}"
+            else:
+                conn.executemany("INSERT INTO chunks (start, end, offset) VALUES (?, ?, ?)",
+                                 _chunk_offsets(input, chunksize))
+                conn.execute("INSERT INTO meta VALUES ('input', ?)", (input,))
+            return conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def claim(self, worker:str, skip:Iterable[int]=()) -> Union[Tuple[int, int, int], None]:
+        """Claim a pending chunk, or an expired one
+
+        Args:
+            worker (str): name of the worker
+            skip (Iterable[int], optional): start lines of the chunks not to claim. Defaults to ().
+
+        Returns:
+            Union[Tuple[int, int, int], None]: start and end line of the chunk, and the byte offset
+              of the start, None if no chunk is left
+        """
+        now, skip = time.time(), list(skip)
+        skipped = f" AND start NOT IN ({', '.join('?' * len(skip))})" if skip else ""
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT start, end, offset FROM chunks WHERE done = 0 AND "
+                f"(owner IS NULL OR expires < ?){skipped} ORDER BY start LIMIT 1", [now] + skip).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE chunks SET owner = ?, expires = ?, nclaims = nclaims + 1 "
+                         "WHERE start = ?", (worker, now + self.lease, row[0]))
+        return row
+
+    def renew(self, start:int, worker:str) -> bool:
+        """Extend the lease of the chunk, False if the lease is lost"""
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE chunks SET expires = ? WHERE start = ? AND owner = ? AND done = 0",
+                (time.time() + self.lease, start, worker)).rowcount == 1
+
+    def release(self, start:int, worker:str) -> bool:
+        """Give up the lease of the chunk, so it is claimed again at once, False if the lease is lost"""
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE chunks SET owner = NULL, expires = NULL WHERE start = ? AND owner = ? AND done = 0",
+                (start, worker)).rowcount == 1
+
+    def complete(self, start:int, worker:str) -> bool:
+        """Mark the chunk as done, False if the lease is lost to another worker"""
+        with self._transaction() as conn:
+            return conn.execute("UPDATE chunks SET done = 1 WHERE start = ? AND owner = ?",
+                                (start, worker)).rowcount == 1
+
+    def status(self) -> Dict:
+        """Number of chunks that are done, leased, expired and pending"""
+        now = time.time()
+        with self._lock:
+            total, done, leased, expired = self._conn.execute(
+                "SELECT COUNT(*), SUM(done), SUM(done = 0 AND owner IS NOT NULL AND expires >= ?), "
+                "SUM(done = 0 AND owner IS NOT NULL AND expires < ?) FROM chunks", (now, now)).fetchone()
+        done, leased, expired = done or 0, leased or 0, expired or 0
+        return { "total": total, "done": done, "leased": leased, "expired": expired
+               , "pending": total - done - leased - expired}
+
+    def close(self):
+        self._conn.close()
+
+    def __repr__(self) -> str:
+        status = self.status()
+        return f"<WorkQueue with {status['done']}/{status['total']} chunks done>"
+
+def _chunk_offsets(path:str, chunksize:int) -> Iterator[Tuple[int, int, int]]:
+    """Start and end line, and the byte offset of the start of each chunk"""
+    start, ind, offset = 0, 0, 0
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                if ind - start == chunksize:
+                    yield start, ind, chunk_offset
+                    start = ind
+                if ind == start: chunk_offset = offset
+                ind += 1
+            offset += len(line)
+    if ind > start:
+        yield start, ind, chunk_offset
+
+def _iter_chunk(path:str, start:int, end:int, offset:int) -> Iterator[Tuple[int, list]]:
+    """Chat ids and chat logs of a chunk, read from its byte offset"""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        ind = start
+        for line in f:
+            if ind >= end: return
+            if line.strip():
+                yield parse_chatlog(json.loads(line), ind)
+                ind += 1
+
+def default_worker() -> str:
+    """Name of the worker by the host and the process"""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+async def arun_worker( queue:Union[str, WorkQueue]
+                     , outdir:str
+                     , worker:Union[str, None]=None
+                     , api_key:Union[str, None]=None
+                     , chat_url:Union[str, None]=None
+                     , max_requests:int=1
+                     , ncoroutines:int=1
+                     , timeout:Union[int, Timeout]=0
+                     , timeinterval:int=0
+                     , rate:Union[float, None]=None
+                     , **options) -> Dict:
+    """Claim and complete the chunks of the queue until none is left
+
+    The results are saved to the shard of the worker, `outdir/<worker>.jsonl`, which are
+    merged by `merge_checkpoints` at the end. A chunk reclaimed from an expired lease is
+    done again except the chats in the shard of this worker, so the shards may share a
+    few chats, and the merge keeps one of them. The lease of a chunk with failed chats is
+    released for the other workers, and the chunk is not claimed again in this run. The
+    work on a chunk stops when its lease is lost, and an error of the renewal is raised.
+
+    Args:
+        queue (Union[str, WorkQueue]): work queue or the path to its database, populated
+        outdir (str): directory of the shards
+        worker (Union[str, None], optional): name of the worker, unique among the running
+          workers. Defaults to None(the host and the process id).
+        api_key (Union[str, None], optional): API key. Defaults to None.
+        chat_url (Union[str, None], optional): chat completion url. Defaults to None.
+        max_requests (int, optional): maximum number of requests to make. Defaults to 1.
+        ncoroutines (int, optional): number of concurrent requests. Defaults to 1.
+        timeout (Union[int, Timeout], optional): timeout in seconds, or `Timeout` whose deadline
+          also stops the worker. Defaults to 0(no timeout).
+        timeinterval (int, optional): time interval between two API calls. Defaults to 0.
+        rate (Union[float, None], optional): maximum number of requests per minute of this worker.
+          Defaults to None.
+
+    Returns:
+        Dict: number of chunks done, released and lost, completed, failed and skipped chats,
+          and the total cost
+    """
+    if isinstance(queue, str):
+        queue = WorkQueue(queue)
+        try:
+            return await arun_worker( queue, outdir, worker, api_key, chat_url, max_requests
+                                    , ncoroutines, timeout, timeinterval, rate, **options)
+        finally:
+            queue.close()
+    assert queue.input is not None, f"queue {queue.path} is not populated!"
+    api_key, chat_url = _endpoint(api_key, chat_url)
+    worker = worker or default_worker()
+    os.makedirs(outdir, exist_ok=True)
+    shard = os.path.join(outdir, worker + ".jsonl")
+    done = checkpoint_ids(shard)
+    summary = { "chunks": 0, "released": 0, "lost": 0
+              , "completed": 0, "failed": 0, "skipped": 0, "cost": 0}
+    loop = asyncio.get_running_loop()
+
+    async def keep_lease(start):
+        """Renew the lease until it is lost"""
+        while True:
+            await asyncio.sleep(queue.lease / 3)
+            if not await loop.run_in_executor(None, queue.renew, start, worker):
+                return
+
+    released = [] # chunks with failures, left to the other workers and the next run
+    claimed = set() # chunks claimed in this run
+    while True:
+        chunk = queue.claim(worker, released)
+        if chunk is None: break
+        start, end, offset = chunk
+        if start in claimed: # claimed again after the lease is lost, skip the chats done since
+            done = checkpoint_ids(shard)
+        claimed.add(start)
+        work = asyncio.ensure_future(async_process_stream(
+            _iter_chunk(queue.input, start, end, offset), shard, api_key, chat_url,
+            max_requests=max_requests, ncoroutines=ncoroutines, timeout=timeout,
+            timeinterval=timeinterval, rate=rate, done=done, **options))
+        renewal = asyncio.ensure_future(keep_lease(start))
+        try:
+            await asyncio.wait([work, renewal], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            renewal.cancel()
+            if not work.done(): work.cancel()
+        if not work.done() or work.cancelled(): # the lease is lost, or the renewal failed
+            await asyncio.gather(work, return_exceptions=True)
+            renewal.result() # raise the error of the renewal
+            summary["lost"] += 1
+            continue
+        result = work.result()
+        for key in ["completed", "failed", "skipped"]:
+            summary[key] += result[key]
+        summary["cost"] += result["cost"]
+        if result["expired"]: break # the lease expires and the chunk is claimed again
+        if result["failed"]:
+            released.append(start)
+            if queue.release(start, worker): summary["released"] += 1
+        elif queue.complete(start, worker):
+            summary["chunks"] += 1
+    return summary
+
+def run_worker(queue:Union[str, WorkQueue], outdir:str, **kwargs) -> Dict:
+    """Claim and complete the chunks of the queue, see `arun_worker` for the arguments"""
+    return asyncio.run(arun_worker(queue, outdir, **kwargs))
@@ -13,6 +13,7 @@ requirements = [
     'Click>=7.0', 'requests>=2.20', "responses>=0.23",
     'tqdm>=4.60', 'aiohttp>=3.8', 'tiktoken>=0.4.0']
 test_requirements = ['pytest>=3', 'unittest']
+extra_requirements = {'numpy': ['numpy>=1.17']}
 
 setup(
     author="Rex Wang",
@@ -34,6 +35,7 @@ setup(
         ],
     },
     install_requires=requirements,
+    extras_require=extra_requirements,
     license="MIT license",
     long_description=readme,
     long_description_content_type='text/markdown',
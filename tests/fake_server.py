@@ -0,0 +1,119 @@
+"""A local fake of the OpenAI API, used to test without network access."""
+
+import asyncio, threading, json, time
+from aiohttp import web
+
+def default_reply(payload):
+    """Reply with the content of the last message"""
+    return "echo: " + str(payload["messages"][-1]["content"])
+
+class FakeServer():
+    def __init__(self, reply=default_reply, delay:float=0, support_n:bool=True, fail=None):
+        """Fake server of `/v1/chat/completions` running in a background thread
+
+        Args:
+            reply (Callable[[Dict], str], optional): function to generate the reply from the payload.
+            delay (Union[float, Callable[[Dict], float]], optional): delay of each response in
+              seconds, or a function to generate it from the payload. Defaults to 0.
+            support_n (bool, optional): whether to return `n` choices. Defaults to True.
+            fail (Callable[[Dict], bool], optional): function to decide whether to fail the
+              request. Defaults to None(never fail).
+        """
+        self.reply, self.delay, self.support_n = reply, delay, support_n
+        self.fail = fail or (lambda payload: False)
+        self.payloads = []
+        self._loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def chat_url(self):
+        return self.base_url + "/v1/chat/completions"
+
+    @property
+    def embed_url(self):
+        return self.base_url + "/v1/embeddings"
+
+    def response(self, payload, contents):
+        if not isinstance(contents, list): contents = [contents]
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": "gpt-3.5-turbo-0613",
+            "usage": {
+                "prompt_tokens": len(payload["messages"]),
+                "completion_tokens": len(contents),
+                "total_tokens": len(payload["messages"]) + len(contents)},
+            "choices": [{
+                "message": {"role": "assistant", "content": content}
+                    if not isinstance(content, dict) else content, # a full message
+                "finish_reason": "stop",
+                "index": ind} for ind, content in enumerate(contents)]}
+
+    async def _chat(self, request):
+        payload = await request.json()
+        self.payloads.append(payload)
+        delay = self.delay(payload) if callable(self.delay) else self.delay
+        if delay: await asyncio.sleep(delay)
+        if self.fail(payload):
+            return web.json_response({"error": {"message": "fake failure"}}, status=500)
+        if not payload.get("stream"):
+            n = payload.get("n", 1) if self.support_n else 1
+            contents = [self.reply(payload) for _ in range(n)]
+            return web.json_response(self.response(payload, contents))
+        content = self.reply(payload)
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+        deltas = [{"role": "assistant", "content": ""}] + \
+                 [{"content": word} for word in content.split(' ')] + [{}]
+        for ind, delta in enumerate(deltas):
+            chunk = {
+                "id": "chatcmpl-fake", "object": "chat.completion.chunk",
+                "created": int(time.time()), "model": "gpt-3.5-turbo-0613",
+                "choices": [{"delta": delta, "index": 0,
+                             "finish_reason": "stop" if not delta else None}]}
+            if 1 < ind < len(deltas) - 1: # add back the spaces
+                chunk["choices"][0]["delta"]["content"] = ' ' + delta["content"]
+            await resp.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        await resp.write(b"data: [DONE]\n\n")
+        return resp
+
+    async def _embeddings(self, request):
+        payload = await request.json()
+        self.payloads.append(payload)
+        if self.fail(payload):
+            return web.json_response({"error": {"message": "fake failure"}}, status=500)
+        # embedding of a text: its length, its first character, and 1
+        data = [{"object": "embedding", "index": ind,
+                 "embedding": [len(text), ord(text[0]) if text else 0, 1]}
+                for ind, text in enumerate(payload["input"])]
+        return web.json_response({"object": "list", "data": data[::-1], "model": payload["model"],
+                                  "usage": {"prompt_tokens": len(data), "total_tokens": len(data)}})
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self._chat)
+        app.router.add_post("/v1/embeddings", self._embeddings)
+        self._runner = web.AppRunner(app)
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        self._loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+
+    def __enter__(self):
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def __exit__(self, *args):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
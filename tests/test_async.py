@@ -1,6 +1,8 @@
-import openai_api_call, time
-from openai_api_call import Chat, process_chats, num_tokens_from_messages
-from openai_api_call.asynctool import async_chat_completion
+import openai_api_call, time, os, pytest
+from openai_api_call import Chat, Resp, process_chats, num_tokens_from_messages, load_chats
+from openai_api_call.asynctool import async_chat_completion, abatch_completion, schedule_order
+from openai_api_call.request import stats
+from .fake_server import FakeServer
 
 import asyncio
 
@@ -51,3 +53,253 @@ def test_tokencounter():
     chat = Chat(message)
     resp = chat.getresponse()
     assert resp.prompt_tokens == prompttoken
+
+def test_agetresponse():
+    with FakeServer() as server:
+        chat = Chat("hello", api_key="sk-test", chat_url=server.chat_url)
+        nrequests = stats.nrequests
+        resp = asyncio.run(chat.agetresponse())
+        assert resp.content == "echo: hello"
+        assert chat.chat_log[-1] == {"role": "assistant", "content": "echo: hello"}
+        assert stats.nrequests == nrequests + 1
+
+def test_astream():
+    async def show_resp(chat):
+        return [resp.delta_content async for resp in chat.astream()]
+    with FakeServer() as server:
+        chat = Chat("hello world", api_key="sk-test", chat_url=server.chat_url)
+        deltas = asyncio.run(show_resp(chat))
+        assert ''.join(deltas) == "echo: hello world"
+        assert chat.last_message() == "echo: hello world"
+        assert server.payloads[-1]["stream"]
+
+def test_abatch_completion(tmp_path):
+    chkpoint = str(tmp_path / "test_abatch.jsonl")
+    async def serve(chat_url):
+        # run inside an existing event loop
+        return await abatch_completion(
+            chatlogs, chkpoint, api_key="sk-test", chat_url=chat_url,
+            clearfile=True, ncoroutines=2)
+    with FakeServer() as server:
+        costs = asyncio.run(serve(server.chat_url))
+    assert len(costs) == len(chatlogs) and all(costs)
+    chats = load_chats(chkpoint, withid=True)
+    assert [chat[-1]["content"] for chat in chats] == \
+        ["echo: " + log[0]["content"] for log in chatlogs]
+
+def test_pooled_session():
+    from openai_api_call.request import get_asession
+    async def run(chat):
+        await chat.agetresponse(update=False)
+        session = await get_asession()
+        await chat.agetresponse(update=False)
+        assert await get_asession() is session and not session.closed
+        # the stream closed early by the consumer is recorded
+        nrequests, stream = stats.nrequests, chat.astream(update=False)
+        await stream.__anext__()
+        await stream.aclose()
+        assert stats.nrequests == nrequests + 1
+        return session
+    with FakeServer() as server:
+        chat = Chat("hello world", api_key="sk-test", chat_url=server.chat_url)
+        session = asyncio.run(run(chat))
+        assert session.closed # closed with the event loop
+        assert asyncio.run(run(chat)) is not session
+
+def test_schedule(tmp_path):
+    logs = [[{"role": "user", "content": "x" * n}] for n in [3, 10, 1, 10]]
+    costfunc = lambda log: len(log[0]["content"])
+    assert schedule_order(logs) == [0, 1, 2, 3]
+    assert schedule_order(logs, schedule=costfunc) == [1, 3, 0, 2]
+    # longest first, results are saved under the original chat ids
+    chkpoint = str(tmp_path / "test_schedule.jsonl")
+    with FakeServer() as server:
+        costs = async_chat_completion(
+            logs, chkpoint, api_key="sk-test", chat_url=server.chat_url,
+            clearfile=True, schedule=costfunc)
+        assert [len(p["messages"][0]["content"]) for p in server.payloads] == [10, 10, 3, 1]
+    assert all(costs)
+    chats = load_chats(chkpoint, withid=True)
+    assert [chat[0] for chat in chats] == [log[0] for log in logs]
+
+def test_prefix_schedule():
+    system = {"role": "system", "content": "long shared prefix"}
+    other = {"role": "system", "content": "another prefix"}
+    logs = [[system, {"role": "user", "content": "a"}],
+            [other, {"role": "user", "content": "b"}],
+            [system, {"role": "user", "content": "c"}],
+            [other],
+            [system, {"role": "user", "content": "a"}]]
+    # grouped by the prefix, in the order of first appearance
+    assert schedule_order(logs, schedule='prefix') == [0, 4, 2, 3, 1]
+    with pytest.raises(ValueError):
+        schedule_order(logs, schedule='unknown')
+
+def test_getresponses():
+    count = iter(range(100))
+    reply = lambda payload: str(next(count))
+    with FakeServer(reply=reply) as server:
+        chat = Chat("hello", api_key="sk-test", chat_url=server.chat_url)
+        chats = chat.getresponses(n=3)
+        assert len(server.payloads) == 1 and server.payloads[0]["n"] == 3
+        assert sorted(c.last_message() for c in chats) == ["0", "1", "2"]
+        assert all(c[0] is chat[0] for c in chats) # share the prefix
+        assert len(chat) == 1
+        resp = chats[1].latest_response()
+        assert resp.n == 3 and resp.contents == ["0", "1", "2"]
+        assert resp.content == "1"
+        # the branches share the cost of the request
+        total = Resp(resp.response).cost()
+        assert sum(c.latest_cost() for c in chats) == pytest.approx(total)
+        assert resp.cost() == pytest.approx(total / 3)
+    # fan out when `n` is not supported
+    with FakeServer(support_n=False) as server:
+        chat = Chat("hello", api_key="sk-test", chat_url=server.chat_url)
+        chats = chat.getresponses(n=3)
+        assert len(server.payloads) == 3
+        assert [c.last_message() for c in chats] == ["echo: hello"] * 3
+        chats = asyncio.run(chat.agetresponses(n=2, native=False))
+        assert len(server.payloads) == 5 and len(chats) == 2
+    # fan out when `n` is rejected
+    with FakeServer(fail=lambda payload: payload.get("n", 1) > 1) as server:
+        chat = Chat("hello", api_key="sk-test", chat_url=server.chat_url)
+        chats = chat.getresponses(n=3)
+        assert len(server.payloads) == 4 and len(chats) == 3
+        chats = asyncio.run(chat.agetresponses(n=2))
+        assert len(server.payloads) == 7 and len(chats) == 2
+
+def test_hedge():
+    from openai_api_call import Hedge
+    # the first request of each pair is slow
+    count = iter(range(100))
+    delay = lambda payload: 2 if next(count) % 2 == 0 else 0
+    with FakeServer(delay=delay) as server:
+        chat = Chat("hello", api_key="sk-test", chat_url=server.chat_url)
+        hedge = Hedge(delay=0.1, max_ratio=1)
+        start = time.time()
+        resp = chat.getresponse(update=False, hedge=hedge)
+        assert resp.content == "echo: hello" and time.time() - start < 1
+        assert hedge.nhedged == 1 and hedge.nwins == 1 and hedge.spent > 0
+        start = time.time()
+        resp = asyncio.run(chat.agetresponse(update=False, hedge=hedge))
+        assert resp.content == "echo: hello" and time.time() - start < 1
+        async def stream():
+            return [resp.delta_content async for resp in chat.astream(update=False, hedge=hedge)]
+        start = time.time()
+        assert "".join(asyncio.run(stream())) == "echo: hello"
+        assert time.time() - start < 1
+        assert hedge.nhedged == 3 and hedge.nwins == 3
+        # the spend cap
+        hedge = Hedge(delay=0.1, max_ratio=1, budget=0)
+        start = time.time()
+        chat.getresponse(update=False, hedge=hedge)
+        assert time.time() - start > 1 and hedge.nhedged == 0
+        # the budget is not charged by the streams
+        next(count) # the last request was not hedged
+        hedge = Hedge(delay=0.1, max_ratio=1, budget=1e-9)
+        assert "".join(asyncio.run(stream())) == "echo: hello"
+        assert "".join(asyncio.run(stream())) == "echo: hello"
+        assert hedge.nhedged == 2 and hedge.spent == 0
+    # no delay is learned yet
+    assert Hedge(stats=openai_api_call.request.RequestStats()).delay() is None
+
+def test_hedge_same_round():
+    from openai_api_call.hedge import Hedge, ahedged_call
+    # both requests finish in the same round, the first one fails
+    async def main():
+        ready = asyncio.Event()
+        asyncio.get_running_loop().call_later(0.2, ready.set)
+        async def call(chat_url):
+            await ready.wait()
+            if chat_url == "first": raise ValueError("failed")
+            return {"url": chat_url}
+        hedge = Hedge(delay=0.05, max_ratio=1, chat_urls=["second"])
+        return await ahedged_call(hedge, call, "first"), hedge
+    for _ in range(5):
+        resp, hedge = asyncio.run(main())
+        assert resp == {"url": "second"} and hedge.nwins == 1
+
+def test_timeout(tmp_path):
+    from openai_api_call import Timeout, DeadlineExceeded
+    from openai_api_call.deadline import as_timeout
+    timeout = Timeout(total=10, connect=1, first_byte=5, per_token=0.01)
+    assert timeout.budget(max_tokens=100) == (1, 6, 11)
+    assert timeout.budget(max_tokens=100, stream=True) == (1, 5, 11)
+    assert timeout.requests(100) == (1, 6) and timeout.aiohttp(100).total == 11
+    assert as_timeout(10).requests(None) == (10, 10) and as_timeout(0).requests() is None
+    assert Timeout(connect=1).requests() == (1, None)
+    assert Timeout(total=10, deadline=0.5).budget()[2] <= 0.5
+    with FakeServer(delay=1) as server:
+        chat = Chat("hello", api_key="sk-test", chat_url=server.chat_url)
+        # the deadline stops the retries
+        start = time.time()
+        with pytest.raises(DeadlineExceeded):
+            chat.getresponse(max_requests=10, timeout=Timeout(deadline=0.3))
+        assert time.time() - start < 1
+        with pytest.raises(DeadlineExceeded):
+            asyncio.run(chat.agetresponse(max_requests=10, timeout=Timeout(deadline=0.3)))
+        assert time.time() - start < 2
+        # timeout in seconds of the batch requests
+        chkpoint = str(tmp_path / "test_timeout.jsonl")
+        costs = async_chat_completion(
+            ["hello"], chkpoint, api_key="sk-test", chat_url=server.chat_url,
+            clearfile=True, timeout=0.3)
+        assert costs == [0] and not os.path.exists(chkpoint)
+
+def test_client():
+    from openai_api_call import Client
+    from concurrent.futures import ThreadPoolExecutor
+    with FakeServer(reply=lambda p: "a") as server_a, FakeServer(reply=lambda p: "b") as server_b:
+        client_a = Client(api_key="sk-a", chat_url=server_a.chat_url, options={"temperature": 0})
+        client_b = client_a.replace(api_key="sk-b", chat_url=server_b.chat_url,
+                                    default_prompt=lambda msg: [{"role": "system", "content": msg}])
+        with pytest.raises(AttributeError):
+            client_a.api_key = "sk-c"
+        # tenants run concurrently without touching the globals
+        def ask(client):
+            return client.chat("hello").getresponse().content
+        with ThreadPoolExecutor(8) as executor:
+            contents = list(executor.map(ask, [client_a, client_b] * 8))
+        assert contents == ["a", "b"] * 8
+        assert all(p["temperature"] == 0 for p in server_a.payloads + server_b.payloads)
+        assert server_b.payloads[0]["messages"][0]["role"] == "system"
+        chat = client_b.chat("hello", model="gpt-4")
+        assert chat.api_key == "sk-b" and chat.model == "gpt-4" and chat.copy().client is client_b
+        assert asyncio.run(chat.agetresponse(temperature=1)).content == "b"
+        assert server_b.payloads[-1]["temperature"] == 1
+    # proxies are set on the sessions instead of the environment
+    client = Client(api_key="sk-test", proxies={"https": "http://127.0.0.1:7890"})
+    session = client.session()
+    assert not session.trust_env and session.proxies["https"] == "http://127.0.0.1:7890"
+    assert client.proxy("https://api.openai.com") == "http://127.0.0.1:7890"
+    assert client.proxy("http://127.0.0.1") is None and client.session() is session
+
+def test_iter_completion(tmp_path):
+    from openai_api_call import aiter_completion, iter_completion
+    delay = lambda payload: 0.5 if payload["messages"][0]["content"] == "slow" else 0
+    logs = ["slow", "a", "b", [{"role": "user", "content": "c"}]]
+    with FakeServer(delay=delay) as server:
+        kwargs = dict(api_key="sk-test", chat_url=server.chat_url, ncoroutines=2)
+        async def collect():
+            return [(chatid, resp.content) async for chatid, resp in aiter_completion(logs, **kwargs)]
+        # the slow chat does not hold back the others
+        results = asyncio.run(collect())
+        assert results[-1] == (0, "echo: slow")
+        assert sorted(results) == [(0, "echo: slow"), (1, "echo: a"), (2, "echo: b"), (3, "echo: c")]
+        # sync version, the checkpoint skips the saved chats
+        chkpoint = str(tmp_path / "test_iter.jsonl")
+        Chat("a").savewithid(chkpoint, chatid=1)
+        results = dict(iter_completion(logs, chkpoint, **kwargs))
+        assert sorted(results) == [0, 2, 3] and results[2].content == "echo: b"
+        assert len(load_chats(chkpoint, withid=True)) == 4
+        # backpressure, the workers wait for the consumer
+        npayloads = len(server.payloads)
+        for chatid, resp in iter_completion(["x"] * 100, maxsize=1, **kwargs):
+            time.sleep(0.2)
+            break
+        assert len(server.payloads) - npayloads <= 6
+        # breaking early does not wait for the slow requests
+        start = time.time()
+        for chatid, resp in iter_completion(["slow", "a"], **kwargs):
+            break
+        assert chatid == 1 and time.time() - start < 0.5
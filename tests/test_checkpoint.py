@@ -1,4 +1,4 @@
-import os, responses
+import os, json, responses
 from openai_api_call import Chat, load_chats, process_chats, api_key
 
 def test_with_checkpoint():
@@ -57,4 +57,31 @@ def test_process_chats():
     continue_chats = process_chats(msgs, msg2chat, checkpath)
     assert len(continue_chats) == 6
     assert all(c1 == c2 for c1, c2 in zip(chats, continue_chats[:3]))
-    assert all([len(chat) == 3 for chat in continue_chats])
\ No newline at end of file
+    assert all([len(chat) == 3 for chat in continue_chats])
+
+
+def test_delta_checkpoint(tmp_path):
+    checkpath = str(tmp_path / "delta.jsonl")
+    chat = Chat("hello!")
+    chat.savedelta(checkpath, chatid=1)
+    chat.assistant("hi")
+    chat.savedelta(checkpath, chatid=1)
+    other = Chat("bye")
+    other.savedelta(checkpath, chatid=0)
+    # an edited message is saved again from its position
+    chat.user("how are you?")
+    chat.pop()
+    chat.user("what's up?")
+    chat.savedelta(checkpath, chatid=1, cost=0)
+    lines = open(checkpath).read().strip().split('\n')
+    assert [len(json.loads(line)["messages"]) for line in lines] == [1, 1, 1, 1]
+    chats = load_chats(checkpath, withid=True)
+    assert chats == [other, chat]
+    # the loaded chat continues saving the deltas
+    chats[1].assistant("nothing")
+    chats[1].savedelta(checkpath, chatid=1)
+    assert json.loads(open(checkpath).read().strip().split('\n')[-1])["offset"] == 3
+    assert len(load_chats(checkpath, withid=True)[1]) == 4
+    # a full chat log replaces the deltas
+    Chat("again").savewithid(checkpath, chatid=1)
+    assert load_chats(checkpath, withid=True)[1] == Chat("again")
@@ -0,0 +1,57 @@
+import pytest
+from openai_api_call import Chat, ContextWindow
+from .fake_server import FakeServer
+
+# count one token per character to run without the tokenizer
+counter = lambda msg, model: len(msg["content"])
+chatlog = [
+    {"role": "system", "content": "s" * 10},
+    {"role": "user", "content": "u" * 10},
+    {"role": "assistant", "content": "a" * 10},
+    {"role": "user", "content": "u" * 5}]
+
+def test_window_size():
+    window = ContextWindow()
+    assert window.window_size("gpt-4") == 8192
+    assert window.window_size("gpt-3.5-turbo-16k-0613") == 16384
+    assert window.window_size("gpt-4-32k-0314") == 32768
+    assert ContextWindow(max_tokens=100).window_size("gpt-4") == 100
+    with pytest.raises(ValueError):
+        window.window_size("unknown-model")
+
+def test_policies():
+    # fits the window
+    window = ContextWindow(max_tokens=38, counter=counter)
+    assert window.fit(chatlog) is chatlog
+    assert window.count(chatlog) == 38
+    # drop the oldest messages
+    window = ContextWindow(max_tokens=30, counter=counter)
+    assert window.fit(chatlog) == chatlog[1:]
+    assert window.fit(chatlog, reserve=10) == chatlog[2:]
+    with pytest.raises(ValueError):
+        window.fit(chatlog, reserve=25)
+    # keep the system message
+    window = ContextWindow(max_tokens=30, policy='keep_system', counter=counter)
+    assert window.fit(chatlog) == [chatlog[0], chatlog[2], chatlog[3]]
+    window = ContextWindow(max_tokens=35, policy='keep_system', keep_last=1, counter=counter)
+    assert window.fit(chatlog) == [chatlog[0], chatlog[3]]
+    # summarize the dropped messages
+    summarize = lambda msgs: "#" * len(msgs)
+    window = ContextWindow(max_tokens=30, policy='summarize', summarize=summarize, counter=counter)
+    assert window.fit(chatlog) == [
+        chatlog[0], {"role": "system", "content": "#"}, chatlog[2], chatlog[3]]
+    window.max_tokens = 25
+    assert window.fit(chatlog) == [
+        chatlog[0], {"role": "system", "content": "##"}, chatlog[3]]
+    with pytest.raises(ValueError):
+        ContextWindow(policy='summarize')
+
+def test_chat_with_window():
+    window = ContextWindow(max_tokens=30, policy='keep_system', counter=counter)
+    with FakeServer() as server:
+        chat = Chat(chatlog, api_key="sk-test", chat_url=server.chat_url, context_window=window)
+        chat.getresponse()
+        assert server.payloads[-1]["messages"] == [chatlog[0], chatlog[2], chatlog[3]]
+        # the chat log is kept as a whole
+        assert chat.chat_log[:-1] == chatlog
+        assert chat.copy().context_window is window
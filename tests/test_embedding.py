@@ -0,0 +1,55 @@
+import pytest
+from openai_api_call import embed, embedding
+from openai_api_call.embedding import pack_batches
+from .fake_server import FakeServer
+
+np = pytest.importorskip("numpy")
+
+def expected(texts):
+    return np.array([[len(t), ord(t[0]) if t else 0, 1] for t in texts], dtype=np.float32)
+
+def test_pack_batches():
+    texts = ["hello world " * n for n in range(1, 40)]
+    batches = list(pack_batches(texts, max_tokens=100, max_inputs=5))
+    assert batches[0][0] == 0 and batches[-1][1] == len(texts)
+    assert all(end == start for (_, end), (start, _) in zip(batches, batches[1:]))
+    assert all(0 < end - start <= 5 for start, end in batches)
+    # a text over the budget is sent alone
+    assert list(pack_batches(["x" * 1000, "y"], max_tokens=10)) == [(0, 1), (1, 2)]
+
+def test_embed(tmp_path):
+    texts = [chr(97 + i % 26) * (i + 1) for i in range(50)]
+    with FakeServer() as server:
+        kwargs = dict(api_key="sk-test", embed_url=server.embed_url, max_inputs=4, ncoroutines=3)
+        matrix = embed(texts, **kwargs)
+        assert matrix.dtype == np.float32 and (matrix == expected(texts)).all()
+        assert all(len(p["input"]) <= 4 for p in server.payloads)
+        # memory-mapped output
+        output = str(tmp_path / "emb.npy")
+        matrix = embed(texts, output=output, **kwargs)
+        assert isinstance(matrix, np.memmap)
+        assert (np.load(output) == expected(texts)).all()
+    # resume from the checkpoint, in memory and memory-mapped
+    for output in [None, str(tmp_path / "resume.npy")]:
+        chkpoint = str(tmp_path / f"chkpoint{output is None}.jsonl")
+        with FakeServer(fail=lambda p: p["input"][0] == texts[20]) as server:
+            with pytest.raises(RuntimeError):
+                embed(texts, chkpoint=chkpoint, output=output, **dict(kwargs, embed_url=server.embed_url))
+        with FakeServer() as server:
+            matrix = embed(texts, chkpoint=chkpoint, output=output, **dict(kwargs, embed_url=server.embed_url))
+            assert len(server.payloads) == 1 and server.payloads[0]["input"][0] == texts[20]
+        assert (matrix == expected(texts)).all()
+
+def test_embed_html_error(tmp_path, monkeypatch):
+    texts = ["a", "b", "c"]
+    # a non-JSON error body fails the batch, which is resumed from the checkpoint
+    async def bad_gateway(**kwargs):
+        return "<html><body>502 Bad Gateway</body></html>"
+    chkpoint = str(tmp_path / "chkpoint.jsonl")
+    with FakeServer() as server:
+        kwargs = dict(api_key="sk-test", embed_url=server.embed_url, chkpoint=chkpoint)
+        with monkeypatch.context() as m:
+            m.setattr(embedding, "async_post", bad_gateway)
+            with pytest.warns(UserWarning, match="Bad Gateway"), pytest.raises(RuntimeError):
+                embed(texts, **kwargs)
+        assert (embed(texts, **kwargs) == expected(texts)).all()
@@ -0,0 +1,23 @@
+import subprocess, sys
+
+def test_lazy_import():
+    """Heavy dependencies are not loaded by `import openai_api_call`"""
+    heavy = ["requests", "aiohttp", "tiktoken", "tqdm", "openai_api_call.asynctool"]
+    script = "import sys, openai_api_call; print(','.join(m for m in %r if m in sys.modules))" % heavy
+    output = subprocess.run([sys.executable, "-c", script], check=True,
+                            capture_output=True, text=True).stdout.strip()
+    assert output == ""
+
+def test_lazy_attributes():
+    import openai_api_call
+    from openai_api_call import async_chat_completion, abatch_completion, RateLimiter
+    from openai_api_call.asynctool import async_chat_completion as func
+    assert async_chat_completion is func
+    assert openai_api_call.asynctool.abatch_completion is abatch_completion
+    assert "async_chat_completion" in dir(openai_api_call)
+    try:
+        openai_api_call.not_exist
+    except AttributeError:
+        pass
+    else:
+        assert False
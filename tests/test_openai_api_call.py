@@ -3,20 +3,87 @@
 """Tests for `openai_api_call` package."""
 
 from click.testing import CliRunner
-import openai_api_call, json
+import openai_api_call, json, os, pytest
 from openai_api_call import cli
 from openai_api_call import Chat, Resp
+from .fake_server import FakeServer
 
 
 def test_command_line_interface():
     """Test the CLI."""
     runner = CliRunner()
-    result = runner.invoke(cli.main)
-    assert result.exit_code == 0
-    assert 'openai_api_call.cli.main' in result.output
     help_result = runner.invoke(cli.main, ['--help'])
     assert help_result.exit_code == 0
     assert '--help  Show this message and exit.' in help_result.output
+    for command in ['run', 'resume', 'status', 'merge', 'bench', 'preflight', 'enqueue', 'work']:
+        assert command in help_result.output
+
+def test_batch_cli(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    runner = CliRunner()
+    with FakeServer() as server:
+        with open("input.jsonl", "w") as f:
+            f.write(json.dumps("hello") + "\n")
+            f.write(json.dumps([{"role": "user", "content": "hi"}]) + "\n")
+            f.write(json.dumps({"chatid": 5, "chatlog": "bye"}) + "\n")
+        args = ['--api-key', 'sk-test', '--chat-url', server.chat_url]
+        # stop by the budget
+        result = runner.invoke(cli.main, ['run', 'input.jsonl', '-o', 'out.jsonl',
+                                          '--budget', '0.000001', '--option', 'temperature=0'] + args)
+        assert result.exit_code == 0, result.output
+        assert 'Budget is exhausted' in result.output
+        assert server.payloads[0]["temperature"] == 0
+        with open("out.jsonl.job.json") as f:
+            assert json.load(f)["chkpoint"] == os.path.abspath("out.jsonl")
+        # the arguments of the flags are not options
+        result = runner.invoke(cli.main, ['run', 'input.jsonl', '-o', 'other.jsonl',
+                                          '--option', 'model=gpt-4'] + args)
+        assert result.exit_code == 2 and "model is set by its own flag" in result.output
+        result = runner.invoke(cli.main, ['status', 'out.jsonl'])
+        assert 'Progress:\t1/3' in result.output
+        # resume the job, which needs the API key
+        monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+        monkeypatch.setattr(openai_api_call, "api_key", None)
+        result = runner.invoke(cli.main, ['resume', 'out.jsonl'])
+        assert result.exit_code == 1 and "API key is not provided!" in result.output
+        result = runner.invoke(cli.main, ['resume', 'out.jsonl', '--budget', '1', '-c', '2', '--api-key', 'sk-test'])
+        assert result.exit_code == 0, result.output
+        assert 'Completed: 2, failed: 0, skipped: 1' in result.output
+        assert len(server.payloads) == 3
+        # merge the checkpoints
+        Chat("hi").savewithid("shard.jsonl", chatid=1)
+        result = runner.invoke(cli.main, ['merge', 'merged.jsonl', 'out.jsonl', 'shard.jsonl'])
+        assert 'Merged 3 chats' in result.output
+        chats = openai_api_call.load_chats('merged.jsonl', withid=True)
+        assert chats[0].last_message() == "echo: hello"
+        assert chats[1] == Chat("hi") and chats[5].last_message() == "echo: bye"
+        # benchmark
+        result = runner.invoke(cli.main, ['bench', '-n', '4', '-c', '2'] + args)
+        assert 'Requests:\t4 succeeded, 0 failed' in result.output
+
+def test_preflight(tmp_path, monkeypatch):
+    from openai_api_call import preflight_report, ContextWindow, estimate_tokens_from_messages
+    assert openai_api_call.preflight.preflight_report is preflight_report # the module is not shadowed
+    monkeypatch.chdir(tmp_path)
+    logs = [[{"role": "user", "content": "hello " * n}] for n in range(0, 200, 7)]
+    with open("input.jsonl", "w") as f:
+        for ind, log in enumerate(logs):
+            f.write(json.dumps({"chatid": 10 * ind, "chatlog": log}) + "\n\n")
+    ntokens = [estimate_tokens_from_messages(log) for log in logs]
+    window = ContextWindow(max_tokens=100)
+    reports = [preflight_report("input.jsonl", completion_tokens=10, exact=False, nprocs=nprocs,
+                                chunksize=4, context_window=window) for nprocs in [1, 2]]
+    assert reports[0] == reports[1]
+    report = reports[0]
+    assert report["nchats"] == len(logs) and report["prompt_tokens"] == sum(ntokens)
+    assert report["completion_tokens"] == 10 * len(logs) and report["max_tokens"] == max(ntokens)
+    assert sum(report["histogram"].values()) == len(logs)
+    assert report["over_limit"] == [10 * ind for ind, n in enumerate(ntokens) if n > 90]
+    assert abs(report["cost"] - openai_api_call.token2cost(
+        "gpt-3.5-turbo", sum(ntokens), 10 * len(logs))) < 1e-12
+    result = CliRunner().invoke(cli.main, ['preflight', 'input.jsonl', '--estimate', '-p', '1'])
+    assert result.exit_code == 0, result.output
+    assert f"Chats:\t{len(logs)}" in result.output
 
 # test for the chat class
 def test_chat():
@@ -211,4 +278,115 @@ def test_show():
     resp = Resp(response=response)
     assert str(resp) == resp.content
     assert repr(resp) == "<Resp with finished reason: stop>"
-  
\ No newline at end of file
+  
+def test_token_cache(monkeypatch):
+    # count one token per character and record the encoded messages
+    encoded = []
+    def counter(msg, model):
+        encoded.append(msg["content"])
+        return len(msg["content"]) + 3
+    monkeypatch.setattr(openai_api_call.chattool, "num_tokens_from_message", counter)
+    chat = Chat("hello")
+    assert chat.prompt_token() == 5 + 3 + 3
+    chat.assistant("hi")
+    assert chat.prompt_token() == 8 + 5 + 3
+    assert encoded == ["hello", "hi"]
+    # copied chats share the counts
+    chat2 = chat.copy()
+    chat2.user("bye")
+    assert chat2.prompt_token() == 8 + 5 + 6 + 3
+    assert chat.prompt_token() == 8 + 5 + 3
+    assert encoded == ["hello", "hi", "bye"]
+    # pop, edit and clear
+    chat2.pop(0)
+    assert chat2.token_counts() == [5, 6]
+    chat2[0] = {"role": "assistant", "content": "hey!"}
+    assert chat2.token_counts() == [7, 6]
+    chat2.clear()
+    assert chat2.prompt_token() == 3
+    assert encoded == ["hello", "hi", "bye", "hey!", "bye"]
+
+def test_estimate_tokens():
+    from openai_api_call import estimate_tokens, estimate_tokens_from_messages
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("a") == 1
+    estimate, lower, upper = estimate_tokens("Hello world, this is a test!", bounds=True)
+    assert lower <= estimate <= upper and 5 <= estimate <= 10
+    # CJK characters take more tokens than ascii letters
+    assert estimate_tokens("你好世界你好世界") > estimate_tokens("helloworldhello")
+    assert estimate_tokens("你好世界你好世界", "gpt-4o") < estimate_tokens("你好世界你好世界", "gpt-4")
+    messages = [{"role": "user", "content": "hello"}, {"role": "assistant", "content": "hi"}]
+    estimate, lower, upper = estimate_tokens_from_messages(messages, bounds=True)
+    assert lower <= estimate <= upper
+    assert estimate == estimate_tokens_from_messages(messages)
+
+ESTIMATE_SAMPLES = {
+    "english": "Python is an easy to learn, powerful programming language. It has efficient high-level "
+               "data structures and a simple but effective approach to object-oriented programming. "
+               "Python's elegant syntax and dynamic typing, together with its interpreted nature, make "
+               "it an ideal language for scripting and rapid application development in many areas.",
+    "code": "def fibonacci(n):\n    \"\"\"Return the first n Fibonacci numbers.\"\"\"\n"
+            "    result, a, b = [], 0, 1\n    while len(result) < n:\n        result.append(a)\n"
+            "        a, b = b, a + b\n    return result\n\n\nif __name__ == \"__main__\":\n"
+            "    for value in fibonacci(10):\n        print(f\"{value:>4}\")\n",
+    "chinese": "人工智能是计算机科学的一个分支，它企图了解智能的实质，并生产出一种新的能以人类智能相似的方式"
+               "做出反应的智能机器。该领域的研究包括机器人、语言识别、图像识别、自然语言处理和专家系统等。"
+               "人工智能从诞生以来，理论和技术日益成熟，应用领域也不断扩大。可以设想，未来人工智能带来的"
+               "科技产品，将会是人类智慧的容器。人工智能可以对人的意识、思维的信息过程进行模拟。",
+    "russian": "Искусственный интеллект — это свойство интеллектуальных систем выполнять творческие "
+               "функции, которые традиционно считаются прерогативой человека. Это наука и технология "
+               "создания интеллектуальных машин, особенно интеллектуальных компьютерных программ. "
+               "Исследования в этой области охватывают распознавание речи и обработку естественного языка.",
+}
+
+@pytest.mark.parametrize("encoding", ["cl100k_base", "o200k_base", "p50k_base"])
+def test_estimate_bounds(encoding):
+    import tiktoken
+    from openai_api_call import estimate_tokens
+    try:
+        tiktoken_encoding = tiktoken.get_encoding(encoding)
+    except Exception: # the encoding files are downloaded on first use
+        pytest.skip(f"encoding {encoding} is not available")
+    for name, text in ESTIMATE_SAMPLES.items():
+        exact = len(tiktoken_encoding.encode(text))
+        estimate, lower, upper = estimate_tokens(text, encoding, bounds=True)
+        assert lower <= exact <= upper, f"{name}: {exact} tokens out of [{lower}, {upper}]"
+
+def test_token2cost_bulk():
+    from openai_api_call import token2cost, token2cost_bulk
+    models = ["gpt-3.5-turbo", "gpt-4", "gpt-3.5-turbo"]
+    prompts, completions = [100, 200, 300], [10, 20, 30]
+    for use_numpy in [False, True]:
+        costs, aggs = token2cost_bulk(models, prompts, completions, use_numpy=use_numpy)
+        expected = [token2cost(*args) for args in zip(models, prompts, completions)]
+        assert all(abs(c - e) < 1e-12 for c, e in zip(costs, expected))
+        assert aggs["gpt-3.5-turbo"]["count"] == 2
+        assert aggs["gpt-3.5-turbo"]["prompt_tokens"] == 400
+        assert aggs["gpt-4"]["completion_tokens"] == 20
+        assert abs(aggs["gpt-4"]["cost"] - expected[1]) < 1e-12
+        costs, aggs = token2cost_bulk("gpt-4", prompts, use_numpy=use_numpy)
+        assert list(aggs) == ["gpt-4"] and aggs["gpt-4"]["count"] == 3
+        costs, _ = token2cost_bulk(models, prompts, completions, [50, 0, 0], use_numpy=use_numpy)
+        assert abs(costs[0] - token2cost(models[0], 100, 10, cached_tokens=50)) < 1e-12
+
+def test_cached_tokens(monkeypatch):
+    from openai_api_call import token2cost, token2cost_bulk, model_cost_perktoken
+    monkeypatch.setitem(model_cost_perktoken, "cached-model", (0.01, 0.02, 0.001))
+    monkeypatch.setitem(model_cost_perktoken, "uncached-model", (0.01, 0.02))
+    resp = Resp({"model": "cached-model", "choices": [], "usage": {
+        "prompt_tokens": 2000, "completion_tokens": 0, "total_tokens": 2000,
+        "prompt_tokens_details": {"cached_tokens": 1000}}})
+    assert resp.cached_tokens == 1000
+    # cached tokens are billed at the discounted price
+    assert abs(resp.cost() - 0.011) < 1e-12
+    resp = Resp({"model": "gpt-3.5-turbo", "choices": [], "usage": {
+        "prompt_tokens": 10, "completion_tokens": 0, "total_tokens": 10}})
+    assert resp.cached_tokens == 0
+    # the cached input price is set by the model, the input price if not listed
+    assert token2cost("gpt-3.5-turbo", 2000, cached_tokens=1000) == token2cost("gpt-3.5-turbo", 2000)
+    assert abs(token2cost("cached-model", 2000, cached_tokens=1000) - 0.011) < 1e-12
+    assert abs(token2cost("uncached-model", 2000, cached_tokens=1000) - 0.02) < 1e-12
+    for use_numpy in [False, True]:
+        costs, _ = token2cost_bulk(["cached-model", "uncached-model"], [2000, 2000], 0, [1000, 1000],
+                                   use_numpy=use_numpy)
+        assert abs(costs[0] - 0.011) < 1e-12 and abs(costs[1] - 0.02) < 1e-12
@@ -0,0 +1,44 @@
+import time, pytest
+from openai_api_call import Step, run_pipeline
+from .fake_server import FakeServer
+
+def make_steps():
+    return [ Step("draft", lambda item, chats: f"poem about {item}")
+           , Step("critique", lambda item, chats: "critique", chat="draft")
+           , Step("title", lambda item, chats: f"title of {item}", after=[])
+           , Step("revise", lambda item, chats: "revise " + chats["title"].last_message()
+                 , chat="critique", temperature=0)]
+
+def test_pipeline(tmp_path):
+    chkpoint = str(tmp_path / "pipeline.jsonl")
+    items = ["cats", "dogs", "birds", "fish"]
+    with FakeServer(delay=0.2) as server:
+        start = time.time()
+        results = run_pipeline( items, make_steps(), chkpoint=chkpoint, api_key="sk-test"
+                              , chat_url=server.chat_url, ncoroutines=8)
+        # the items and the independent steps overlap: 3 rounds rather than 16 requests
+        assert time.time() - start < 1.2
+        assert len(server.payloads) == 16
+        assert [chats["draft"].last_message() for chats in results] == \
+            [f"echo: poem about {item}" for item in items]
+        chats = results[1]
+        assert len(chats["revise"]) == 6 and chats["revise"][:4] == chats["critique"].chat_log
+        assert chats["revise"].last_message() == "echo: revise echo: title of dogs"
+        revise = [payload for payload in server.payloads if payload["messages"][-1]["content"].startswith("revise")]
+        assert all(payload["temperature"] == 0 for payload in revise)
+        # the finished steps are skipped
+        results2 = run_pipeline( items, make_steps(), chkpoint=chkpoint, api_key="sk-test"
+                               , chat_url=server.chat_url, ncoroutines=8)
+        assert len(server.payloads) == 16 and results2 == results
+    with open(chkpoint) as f:
+        assert sum(1 for _ in f) == 16
+
+def test_pipeline_failure():
+    # the title of the fish fails, so its revision is skipped
+    with FakeServer(fail=lambda payload: payload["messages"][-1]["content"] == "title of fish") as server:
+        results = run_pipeline( ["cats", "fish"], make_steps(), api_key="sk-test"
+                              , chat_url=server.chat_url, ncoroutines=2)
+    assert set(results[0]) == {"draft", "critique", "title", "revise"}
+    assert set(results[1]) == {"draft", "critique"}
+    with pytest.raises(AssertionError):
+        run_pipeline([], [Step("a", str, after=["b"])], api_key="sk-test")
@@ -0,0 +1,81 @@
+import asyncio, threading, time
+import openai_api_call
+from openai_api_call import Chat, Scheduler, tenant, aiter_completion
+from .fake_server import FakeServer
+
+async def serve(scheduler, requests):
+    """Run the requests behind a held slot, and return the order they are served"""
+    order = []
+    async def request(name, priority, tenant_name):
+        with tenant(tenant_name):
+            async with scheduler.aslot(priority):
+                order.append(name)
+                await asyncio.sleep(0.01)
+    hold = scheduler.aslot('batch')
+    await hold.__aenter__()
+    tasks = [asyncio.ensure_future(request(*args)) for args in requests]
+    await asyncio.sleep(0.01) # all are waiting
+    assert scheduler.nwaiting == len(requests)
+    await hold.__aexit__()
+    await asyncio.gather(*tasks)
+    assert scheduler.nrunning == 0
+    return order
+
+def test_priority_and_fairness():
+    requests = [(f"a{i}", 'batch', 'a') for i in range(4)] + [(f"b{i}", 'batch', 'b') for i in range(2)]
+    requests.append(("i", 'interactive', 'c'))
+    order = asyncio.run(serve(Scheduler(concurrency=1), requests))
+    assert order == ["i", "a0", "b0", "a1", "b1", "a2", "a3"]
+    order = asyncio.run(serve(Scheduler(concurrency=1, weights={"a": 2}), requests))
+    assert order == ["i", "a0", "a1", "b0", "a2", "a3", "b1"]
+
+def test_cancel_and_threads():
+    scheduler = Scheduler(concurrency=1)
+    async def main():
+        hold = scheduler.aslot('batch')
+        await hold.__aenter__()
+        waiting = asyncio.ensure_future(scheduler.aslot('batch').__aenter__())
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        await hold.__aexit__()
+    asyncio.run(main())
+    # the cancelled waiter does not take the slot
+    order = []
+    def request(name):
+        with scheduler.slot():
+            order.append(name)
+    threads = [threading.Thread(target=request, args=(ind,)) for ind in range(5)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join(timeout=1)
+    assert sorted(order) == list(range(5)) and scheduler.nrunning == 0
+    assert scheduler.waits['interactive'].nrequests == 5
+
+def test_rate():
+    scheduler = Scheduler(concurrency=4, rate=600) # one request per 0.1 second
+    start = time.time()
+    for _ in range(3):
+        with scheduler.slot(): pass
+    assert 0.15 < time.time() - start < 0.5
+
+def test_interactive_ahead_of_batch():
+    openai_api_call.request.scheduler = Scheduler(concurrency=2)
+    try:
+        with FakeServer(delay=0.2) as server:
+            async def main():
+                async def batch():
+                    return [resp async for resp in aiter_completion(
+                        [f"batch {ind}" for ind in range(10)], api_key="sk-test",
+                        chat_url=server.chat_url, ncoroutines=10)]
+                task = asyncio.ensure_future(batch())
+                await asyncio.sleep(0.05) # the batch requests are waiting
+                chat = Chat("interactive", api_key="sk-test", chat_url=server.chat_url)
+                start = time.time()
+                await chat.agetresponse()
+                elapsed = time.time() - start
+                return elapsed, await task
+            elapsed, results = asyncio.run(main())
+            assert elapsed < 0.6 and len(results) == 10
+            contents = [payload["messages"][-1]["content"] for payload in server.payloads]
+            assert contents.index("interactive") <= 3
+    finally:
+        openai_api_call.request.scheduler = None
@@ -0,0 +1,55 @@
+import pytest
+from openai_api_call import Chat, SemanticCache
+from openai_api_call.semcache import BruteForceIndex
+from .fake_server import FakeServer
+
+np = pytest.importorskip("numpy")
+
+def bag_of_words(texts):
+    """Embedding by the counts of the words, so the paraphrases are close"""
+    vocab = ["weather", "today", "what", "is", "the", "how", "cook", "rice", "please"]
+    return np.array([[text.lower().replace('?', '').split().count(word) for word in vocab]
+                     for text in texts], dtype=np.float32)
+
+def test_brute_force_index():
+    index = BruteForceIndex()
+    assert index.search(np.ones(3, dtype=np.float32)) == (-1, -1)
+    vectors = np.eye(3, dtype=np.float32)
+    for _ in range(10): # grow the matrix
+        for vector in vectors: index.add(vector)
+    assert index.size == 30 and index.search(vectors[1])[1] == 1
+    assert index.search(vectors[2])[0] % 3 == 2
+
+def test_semantic_cache():
+    cache = SemanticCache(threshold=0.9, embed=bag_of_words)
+    with FakeServer() as server:
+        chat = Chat("What is the weather today?", api_key="sk-test", chat_url=server.chat_url)
+        resp = chat.getresponse(update=False, cache=cache)
+        assert len(server.payloads) == 1 and len(cache) == 1
+        # a paraphrase hits the cache
+        chat = Chat("what is the weather today please", api_key="sk-test", chat_url=server.chat_url)
+        hit = chat.getresponse(cache=cache)
+        assert hit.content == resp.content and hit.cached and not resp.cached
+        assert hit.cost() == 0 and chat.latest_cost() == 0
+        assert len(server.payloads) == 1 and chat.last_message() == resp.content
+        # a different prompt, or the same prompt under another system message, misses
+        Chat("how to cook rice", api_key="sk-test", chat_url=server.chat_url).getresponse(cache=cache)
+        chat = Chat(api_key="sk-test", chat_url=server.chat_url)
+        chat.system("be brief").user("What is the weather today?")
+        chat.getresponse(cache=cache)
+        assert len(server.payloads) == 3 and len(cache) == 3
+    assert cache.nhits == 1 and cache.nmisses == 3 and cache.hit_rate == 0.25
+    assert cache.latency.nrequests == 4 and cache.latency.percentile(50) is not None
+
+def test_semantic_cache_options():
+    cache = SemanticCache(threshold=0.9, embed=bag_of_words)
+    with FakeServer() as server:
+        chat = Chat("What is the weather today?", api_key="sk-test", chat_url=server.chat_url)
+        chat.getresponse(update=False, cache=cache, temperature=0)
+        # another model or other options miss the cache
+        chat.getresponse(update=False, cache=cache, temperature=1)
+        chat.model = "gpt-4"
+        chat.getresponse(update=False, cache=cache, temperature=0)
+        assert len(server.payloads) == 3 and cache.nhits == 0
+        chat.getresponse(update=False, cache=cache, temperature=0)
+        assert len(server.payloads) == 3 and cache.nhits == 1
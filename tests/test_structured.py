@@ -0,0 +1,57 @@
+import asyncio, json, pytest
+from openai_api_call import Chat
+from openai_api_call.structured import JSONStreamValidator, response_format
+from .fake_server import FakeServer
+
+schema = {"type": "object", "additionalProperties": False, "required": ["label"],
+          "properties": {"label": {"type": "string", "enum": ["pos", "neg"]},
+                         "score": {"type": "integer"},
+                         "tags": {"type": "array", "items": {"type": "string"}}}}
+
+def validate(text, schema=None):
+    validator = JSONStreamValidator(schema)
+    return validator.feed(text) and validator.finish(), validator
+
+def test_validator():
+    for text in ['{"a": [1, -2.5e+3, true, false, null, {"b": "c\\"\\u00e9"}], "d": {}}', '12', ' "x" ']:
+        assert validate(text)[0] and json.loads(text) is not None
+    for text in ['tru', '01', '1.', '{"a" 1}', '[1,]', '{,}', '"\\x"', '{"a": 1} {}', 'Sure! {}']:
+        assert not validate(text)[0]
+    assert validate('{"label": "pos", "score": 3, "tags": ["a"]}', schema)[0]
+    # rejected as soon as the prefix is invalid
+    for text, prefix in [ ('{"label": "neutral"}', '{"label": "neu')
+                        , ('{"label": "pos", "extra": 1}', '{"label": "pos", "extra"')
+                        , ('{"label": "pos", "score": 3.5}', '{"label": "pos", "score": 3.')
+                        , ('{"label": "pos", "tags": [1]}', '{"label": "pos", "tags": [1')
+                        , ('["pos"]', '[')]:
+        valid, validator = validate(text, schema)
+        assert not valid and not validator.valid
+        assert JSONStreamValidator(schema).feed(prefix[:-1]) and not JSONStreamValidator(schema).feed(prefix)
+    valid, validator = validate('{"score": 1}', schema)
+    assert not valid and "Missing required keys ['label']" in validator.error
+    validator = JSONStreamValidator(schema)
+    assert validator.feed('{"label": "pos"') and validator.valid # may still be completed
+    assert not validator.finish() and "Incomplete JSON" in validator.error
+    assert response_format() == {"type": "json_object"}
+    assert response_format(schema)["json_schema"]["schema"] == schema
+
+def test_getjson():
+    count = iter(range(100))
+    def reply(payload):
+        if next(count) == 0:
+            return '{"label": "neutral", "score": 1, "tags": ' + '["a", ' * 50 + '"b"' + ']' * 50 + '}'
+        return '{"label": "pos", "score": 3}'
+    with FakeServer(reply=reply) as server:
+        chat = Chat("classify", api_key="sk-test", chat_url=server.chat_url)
+        assert chat.getjson(schema) == {"label": "pos", "score": 3}
+        assert len(server.payloads) == 2 and server.payloads[0]["stream"]
+        assert server.payloads[0]["response_format"]["type"] == "json_schema"
+        assert chat.last_message() == '{"label": "pos", "score": 3}' and len(chat) == 2
+        # any JSON object without a schema
+        assert asyncio.run(chat.agetjson(update=False)) == {"label": "pos", "score": 3}
+        assert server.payloads[-1]["response_format"] == {"type": "json_object"}
+    with FakeServer(reply=lambda payload: "not json") as server:
+        chat = Chat("classify", api_key="sk-test", chat_url=server.chat_url)
+        with pytest.raises(ValueError):
+            chat.getjson(max_requests=2)
+        assert len(server.payloads) == 2 and len(chat) == 1
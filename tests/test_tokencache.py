@@ -0,0 +1,60 @@
+import os, time, pytest
+import tiktoken
+from click.testing import CliRunner
+from openai_api_call import cli, tokencache
+from openai_api_call.tokencache import prefetch_encodings, prewarm_encodings, \
+    encodings_ready, wait_encodings, cached_encodings
+
+def test_prefetch(tmp_path, monkeypatch):
+    # fake the download by tiktoken in the new process
+    fetched = []
+    def fetch(name, path):
+        fetched.append(name)
+        files = {"gpt2": ["encoder.json", "vocab.bpe"], "r50k_base": ["encoder.json", "vocab.bpe"]}
+        for file in files.get(name, [name + ".tiktoken"]):
+            if not os.path.exists(os.path.join(path, file)):
+                with open(os.path.join(path, file), 'w') as f: f.write("fake bpe")
+        return files.get(name, [name + ".tiktoken"])
+    monkeypatch.setattr(tokencache, "_fetch", fetch)
+    monkeypatch.setenv("TIKTOKEN_CACHE_DIR", str(tmp_path / "default"))
+    cache = str(tmp_path / "cache")
+    paths = prefetch_encodings(["cl100k_base", "gpt2"], path=cache)
+    assert len(paths) == 3 and all(os.path.exists(path) for path in paths)
+    assert os.environ["TIKTOKEN_CACHE_DIR"] == cache
+    assert cached_encodings() == ["cl100k_base", "gpt2"]
+    # the cached encodings are not fetched again
+    assert prefetch_encodings(["gpt2", "gpt2"]) == [] and fetched == ["cl100k_base", "gpt2"]
+    with pytest.raises(ValueError):
+        prefetch_encodings(["unknown"])
+    # command line
+    result = CliRunner().invoke(cli.main, ['prefetch', '-d', cache, '-e', 'o200k_base'])
+    assert result.exit_code == 0, result.output
+    assert "cl100k_base, gpt2, o200k_base" in result.output
+    result = CliRunner().invoke(cli.main, ['prefetch', '-d', cache, '-e', 'unknown'])
+    assert result.exit_code != 0 and "Unknown encoding" in result.output
+    # the files shared with another encoding are listed for both
+    assert prefetch_encodings("r50k_base") == [] and "r50k_base" in cached_encodings()
+    os.remove(os.path.join(cache, "vocab.bpe"))
+    assert cached_encodings() == ["cl100k_base", "o200k_base"]
+
+def test_prewarm(monkeypatch):
+    def get_encoding(name):
+        time.sleep(0.1)
+        if name == "r50k_base": raise ConnectionError("no network")
+    monkeypatch.setattr(tiktoken, "get_encoding", get_encoding)
+    monkeypatch.setattr(tokencache, "_done", {})
+    monkeypatch.setattr(tokencache, "_errors", {})
+    loaded = []
+    thread = prewarm_encodings(["p50k_base"], callback=loaded.extend)
+    assert not encodings_ready(["p50k_base"])
+    assert wait_encodings(timeout=5)
+    thread.join()
+    assert encodings_ready() and loaded == ["p50k_base"]
+    # failed loading
+    prewarm_encodings("r50k_base", background=False)
+    assert not encodings_ready("r50k_base")
+    with pytest.raises(ConnectionError):
+        wait_encodings("r50k_base")
+    # unknown encodings fail in the loading thread
+    prewarm_encodings("unknown").join()
+    assert not encodings_ready() and isinstance(tokencache._errors["unknown"], ValueError)
@@ -0,0 +1,69 @@
+import asyncio, json, time
+from openai_api_call import Chat, Tools, Resp
+from .fake_server import FakeServer
+
+def make_tools():
+    tools = Tools(timeout=1)
+
+    @tools.register
+    def add(a:int, b:int=0):
+        """Add two numbers"""
+        time.sleep(0.3)
+        return a + b
+
+    @tools.register(timeout=0.2)
+    async def slow(text:str):
+        await asyncio.sleep(2)
+        return text
+
+    @tools.register(name="fail")
+    def broken():
+        raise ValueError("broken")
+    return tools
+
+def tool_call(ind, name, **arguments):
+    return {"id": f"call_{ind}", "type": "function",
+            "function": {"name": name, "arguments": json.dumps(arguments)}}
+
+def reply(payload):
+    """Call the tools at first, then answer with the results"""
+    if payload["messages"][-1]["role"] == "tool":
+        results = [msg["content"] for msg in payload["messages"] if msg["role"] == "tool"]
+        return "results: " + ", ".join(results)
+    return {"role": "assistant", "content": None, "tool_calls": [
+        tool_call(0, "add", a=1, b=2), tool_call(1, "add", a=3), tool_call(2, "slow", text="hi"),
+        tool_call(3, "fail"), tool_call(4, "unknown")]}
+
+def test_schema():
+    schema = {tool["function"]["name"]: tool["function"] for tool in make_tools().schema()}
+    assert schema["add"]["description"] == "Add two numbers"
+    assert schema["add"]["parameters"] == {"type": "object", "required": ["a"],
+        "properties": {"a": {"type": "integer"}, "b": {"type": "integer"}}}
+    assert "description" not in schema["fail"]
+
+def test_run_tools():
+    tools = make_tools()
+    with FakeServer(reply=reply) as server:
+        chat = Chat("compute", api_key="sk-test", chat_url=server.chat_url)
+        start = time.time()
+        resp = chat.run_tools(tools)
+        # the tools run concurrently, and the slow one times out
+        assert time.time() - start < 0.9
+        assert resp.content == "results: 3, 3, Error: slow timed out after 0.2 seconds, " + \
+            "Error: ValueError('broken'), Error: unknown tool unknown"
+        assert [msg["role"] for msg in chat.chat_log] == ["user", "assistant"] + ["tool"] * 5 + ["assistant"]
+        assert len(chat[1]["tool_calls"]) == 5 and chat[2]["tool_call_id"] == "call_0"
+        assert server.payloads[0]["tools"] == tools.schema()
+        assert tools.stats["add"].nrequests == 2 and tools.stats["slow"].nfailures == 1
+        # asynchronous version
+        chat = Chat("compute", api_key="sk-test", chat_url=server.chat_url)
+        start = time.time()
+        assert asyncio.run(chat.arun_tools(tools)).content == resp.content
+        assert time.time() - start < 0.9
+    assert Resp({"choices": [{"message": {"content": "hi"}}]}).tool_calls == []
+    # no tool to offer
+    with FakeServer() as server:
+        chat = Chat("hello", api_key="sk-test", chat_url=server.chat_url)
+        assert chat.run_tools(Tools()).content == "echo: hello"
+        assert asyncio.run(chat.arun_tools(Tools())).content == "echo: echo: hello"
+        assert all("tools" not in payload for payload in server.payloads)
@@ -0,0 +1,34 @@
+import asyncio, time, pytest
+import openai_api_call
+from openai_api_call import Chat, record, replay
+from .fake_server import FakeServer
+
+def test_record_replay(tmp_path):
+    path = str(tmp_path / "trace.jsonl.gz")
+    chats = ["hello", "world"]
+    async def stream(chat):
+        return [resp.delta_content async for resp in chat.astream(update=False)]
+    with FakeServer(delay=0.3) as server:
+        chat = Chat("hello", api_key="sk-test", chat_url=server.chat_url)
+        with record(path) as recorder:
+            resp = chat.getresponse(update=False)
+            deltas = asyncio.run(stream(chat))
+            aresp = asyncio.run(chat.agetresponse(update=False))
+        assert recorder.nrecords == 3 and openai_api_call.request.transport is None
+        chat_url = server.chat_url
+    # the server is closed, and the API key is not needed to match
+    chat = Chat("hello", api_key="sk-other", chat_url=chat_url)
+    with replay(path, scale=0):
+        start = time.time()
+        assert chat.getresponse(update=False).content == resp.content
+        assert asyncio.run(stream(chat)) == deltas
+        assert asyncio.run(chat.agetresponse(update=False)).content == aresp.content
+        assert time.time() - start < 0.3
+        with pytest.raises(LookupError):
+            openai_api_call.request.chat_completion(
+                "sk-test", [{"role": "user", "content": "unknown"}], "gpt-3.5-turbo", chat_url)
+    # the recorded latency is reproduced
+    with replay(path, scale=1):
+        start = time.time()
+        chat.getresponse(update=False)
+        assert time.time() - start >= 0.3
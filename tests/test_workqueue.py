@@ -0,0 +1,103 @@
+import asyncio, json, os, pytest, time
+from click.testing import CliRunner
+from openai_api_call import WorkQueue, arun_worker, load_chats, cli
+from openai_api_call.checkpoint import merge_checkpoints
+from .fake_server import FakeServer
+
+def write_input(path, nchats):
+    with open(path, 'w') as f:
+        for ind in range(nchats):
+            f.write(json.dumps(f"chat {ind}") + '\n')
+            if ind % 4 == 0: f.write('\n') # empty lines are skipped
+
+def test_work_queue(tmp_path):
+    input, path = str(tmp_path / "input.jsonl"), str(tmp_path / "queue.db")
+    write_input(input, 10)
+    queue = WorkQueue(path, lease=0.2)
+    assert queue.populate(input, chunksize=3) == 4
+    assert WorkQueue(path).populate(input, chunksize=5) == 4 # populated once
+    # a crashed worker holds a chunk, which expires
+    assert queue.claim("crashed") == (0, 3, 0)
+    assert queue.status()["leased"] == 1
+    time.sleep(0.3)
+    assert queue.status()["expired"] == 1
+    outdir = str(tmp_path / "shards")
+    with FakeServer(delay=0.1) as server:
+        async def run():
+            return await asyncio.gather(*[
+                arun_worker(WorkQueue(path, lease=0.2), outdir, worker=f"worker{ind}", api_key="sk-test",
+                            chat_url=server.chat_url, ncoroutines=2) for ind in range(2)])
+        summaries = asyncio.run(run())
+    assert sum(summary["chunks"] for summary in summaries) == 4
+    assert sum(summary["completed"] for summary in summaries) == 10
+    assert queue.status() == {"total": 4, "done": 4, "leased": 0, "expired": 0, "pending": 0}
+    assert not queue.complete(0, "crashed") and queue.claim("worker0") is None
+    shards = [os.path.join(outdir, name) for name in sorted(os.listdir(outdir))]
+    assert len(shards) == 2
+    assert merge_checkpoints(str(tmp_path / "merged.jsonl"), shards) == 10
+    chats = load_chats(str(tmp_path / "merged.jsonl"), withid=True)
+    assert [chat.last_message() for chat in chats] == [f"echo: chat {ind}" for ind in range(10)]
+
+def test_work_cli(tmp_path):
+    input, path = str(tmp_path / "input.jsonl"), str(tmp_path / "queue.db")
+    write_input(input, 5)
+    runner = CliRunner()
+    result = runner.invoke(cli.main, ['enqueue', input, path, '--chunk-size', '2'])
+    assert result.exit_code == 0 and "0/3 done" in result.output
+    with FakeServer() as server:
+        result = runner.invoke(cli.main, ['work', path, '-o', str(tmp_path / "shards"), '-w', 'node1',
+                                          '--chat-url', server.chat_url, '--api-key', 'sk-test'])
+    assert result.exit_code == 0, result.output
+    assert "completed: 5" in result.output and "3/3 chunks done" in result.output
+    assert os.path.exists(tmp_path / "shards" / "node1.jsonl")
+
+def test_work_queue_leases(tmp_path):
+    input, path = str(tmp_path / "input.jsonl"), str(tmp_path / "queue.db")
+    write_input(input, 4)
+    queue, outdir = WorkQueue(path, lease=0.3), str(tmp_path / "shards")
+    assert queue.populate(input, chunksize=2) == 2
+    kwargs = {"worker": "worker0", "api_key": "sk-test"}
+    # the lease of a chunk with failures is released, and the run still finishes
+    with FakeServer(fail=lambda payload: payload["messages"][-1]["content"] == "chat 0") as server:
+        summary = asyncio.run(arun_worker(queue, outdir, chat_url=server.chat_url, **kwargs))
+    assert summary["chunks"] == 1 and summary["released"] == 1 and summary["failed"] == 1
+    assert queue.status() == {"total": 2, "done": 1, "leased": 0, "expired": 0, "pending": 1}
+    # the work stops when the lease is lost to another worker
+    with FakeServer(delay=2) as server:
+        async def run():
+            task = asyncio.ensure_future(arun_worker(queue, outdir, chat_url=server.chat_url, **kwargs))
+            await asyncio.sleep(0.2)
+            assert queue.release(0, "worker0") and queue.claim("worker1") == (0, 2, 0)
+            return await task
+        start = time.time()
+        summary = asyncio.run(run())
+        assert summary["lost"] == 1 and summary["completed"] == 0 and time.time() - start < 1
+        # an error of the renewal is raised
+        assert queue.release(0, "worker1")
+        def renew(start, worker):
+            raise RuntimeError("database is gone")
+        queue.renew = renew
+        with pytest.raises(RuntimeError, match="database is gone"):
+            asyncio.run(arun_worker(queue, outdir, chat_url=server.chat_url, **kwargs))
+
+def test_work_queue_reclaim(tmp_path):
+    input, path = str(tmp_path / "input.jsonl"), str(tmp_path / "queue.db")
+    write_input(input, 4)
+    queue = WorkQueue(path, lease=0.3)
+    assert queue.populate(input, chunksize=4) == 1
+    # the lease is lost once after the first chat, and the chunk is claimed again
+    renew, lost = queue.renew, []
+    def lose_once(start, worker):
+        if lost: return renew(start, worker)
+        lost.append(start)
+        queue.release(start, worker)
+        return False
+    queue.renew = lose_once
+    delay = lambda payload: 0.5 if payload["messages"][-1]["content"] == "chat 1" else 0
+    with FakeServer(delay=delay) as server:
+        summary = asyncio.run(arun_worker(queue, str(tmp_path / "shards"), worker="worker0",
+                                          api_key="sk-test", chat_url=server.chat_url))
+        contents = [payload["messages"][-1]["content"] for payload in server.payloads]
+    assert summary["lost"] == 1 and summary["chunks"] == 1 and summary["skipped"] == 1
+    # the chat done before the lease is lost is not requested again
+    assert contents.count("chat 0") == 1 and contents.count("chat 1") == 2